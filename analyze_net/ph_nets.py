@@ -3,6 +3,11 @@ Translate `cit-HepPh.txt` and `cit-HepTh.txt` into `graphml` files
 
 https://snap.stanford.edu/data/cit-HepPh.html
 https://snap.stanford.edu/data/cit-HepTh.html
+
+`load_snap` can be used on its own, for any SNAP edge list:  it parses the
+file with pandas' C parser, adds all of the edges to the graph at once, and
+caches the graph in graph-tool's binary format, with an index from the SNAP
+IDs to the vertices, so later runs just load the cache.
 '''
 
 import graph_tool as gt
@@ -10,10 +15,10 @@ import graph_tool.community as comm
 
 #import matplotlib.pyplot as plt
 
-import csv
 import json
 import numpy as np
 import os.path as path
+import pandas as pd
 from random import sample, seed
 
 phnet_infile = 'cit-HepPh.txt'
@@ -22,106 +27,140 @@ ptnet_infile = 'cit-HepTh.txt'
 phnet_outfile = 'phnet.graphml'
 ptnet_outfile = 'ptnet.graphml'
 
-# phnet_samplesfile = 'phnet_samples.json'
-# ptnet_samplesfile = 'ptnet_samples.json'
-
-nets = [(phnet_infile, phnet_outfile, phnet_samplesfile), 
-		(ptnet_infile, ptnet_outfile, ptnet_samplesfile)]
-
-for infile, outfile, samplesfile in nets:
-	# If the graphml file doesn't exist, 
-	if not path.isfile(outfile):
-		# Initialize the empty graph
-		net = gt.Graph()
-		# Add a vertex property for the citation network id
-		id = net.new_vertex_property('string')
-		# And make it internal to the graph
-		net.vertex_properties['id'] = id
-		# Since gt doesn't provide an efficient way to look up vertices given  
-		#  a property value, we'll need a dict to do that
-		id_to_gt = {}
-
-		# And parse the graph from `infile`
-		with open(infile) as readfile:
-			print('reading ' + infile)
-			read = csv.reader(readfile, delimiter = '\t')
-			count = 0
-			for line in read:
-				# Skip commented lines
-				if line[0][0] == '#':
-					continue
-				# Each non-commented line generates a list ['12345', '67890']
-				#  Entry 0 is the tail, entry 1 is the head
-				#print(line)
-				tail_id = line[0]
-				head_id = line[1]
-				#print(tail_id)
-				#print(head_id)
-			
-				# Check whether the tail is already in the lookup table
-				if tail_id in id_to_gt:
-					tail = id_to_gt[tail_id]
-				else:
-					# If not, add it to both the net and lookup table
-					tail = net.add_vertex()
-					id[tail] = tail_id
-					id_to_gt[tail_id] = tail
-			
-				# Likewise with the head
-				if head_id in id_to_gt:
-					head = id_to_gt[head_id]
-				else:
-					head = net.add_vertex()
-					id[head] = head_id
-					id_to_gt[head_id] = head
-			
-				# Add the edge and increase the progress counter
-				net.add_edge(tail, head)
-				# Show an update every nth node
-				count += 1
-				if count % 10000 == 0:
-					print(count)
-
-		print('finished reading ' + infile)
-		# Write it to disk so we don't have to do this again later
-		net.save(outfile)
-		print('finished saving ' + outfile)
-	else:
-		print('found saved ' + outfile)
-		# Read the saved network
-		net = gt.load_graph(outfile)
-		# Since vertices as such can't be pickled, we need to reconstruct 
-		#  id and id_to_gt manually
-		print('finished reading ' + outfile)
+# Binary caches, with the ID index beside each, e.g., `phnet.ids.npz`
+phnet_cachefile = 'phnet.gt'
+ptnet_cachefile = 'ptnet.gt'
+
+phnet_samplesfile = 'phnet_samples.json'
+ptnet_samplesfile = 'ptnet_samples.json'
+
+nets = [(phnet_infile, phnet_outfile, phnet_cachefile, phnet_samplesfile),
+		(ptnet_infile, ptnet_outfile, ptnet_cachefile, ptnet_samplesfile)]
+
+
+def read_edge_list(infile):
+	'''
+	Read a SNAP edge list:  one tab-separated pair of integer IDs per line,
+	tail then head, with comment lines starting with '#'
+
+	:return: (E, 2) int64 array of the IDs
+	'''
+	edges = pd.read_csv(infile, sep = '\t', comment = '#', header = None,
+						names = ['tail', 'head'], dtype = np.int64, engine = 'c')
+	return edges.to_numpy()
+
+
+def index_path(cachefile):
+	'''
+	:return: File name of the ID index for a cached graph
+	'''
+	return path.splitext(cachefile)[0] + '.ids.npz'
+
+
+def id_index(ids):
+	'''
+	:param ids: The SNAP ID of each vertex
+	:return: A dict, with the IDs sorted, and the vertex of each
+	'''
+	order = np.argsort(ids, kind = 'stable')
+	return {'ids': np.asarray(ids)[order], 'vertices': order}
+
+
+def lookup(index, ids):
+	'''
+	Vertices for SNAP IDs, as `id_to_gt` used to give
+
+	:param index: From `id_index`
+	:param ids: Array of SNAP IDs
+	:return: int64 array of vertex indices, with -1 for IDs not in the graph
+	'''
+	ids = np.asarray(ids, dtype = np.int64)
+	keys = index['ids']
+	result = np.full(len(ids), -1, dtype = np.int64)
+	if len(keys) == 0:
+		return result
+	pos = np.searchsorted(keys, ids)
+	pos[pos == len(keys)] = 0
+	found = keys[pos] == ids
+	result[found] = index['vertices'][pos[found]]
+	return result
+
+
+def load_snap(infile, cachefile = None):
+	'''
+	Load a SNAP citation edge list as a directed graph, with a string 'id'
+	vertex property holding the SNAP IDs.  Vertices are in the order their
+	IDs first appear.
+
+	:param infile: The edge list, e.g., `cit-HepPh.txt`
+	:param cachefile: The binary cache; defaults to `infile` with a `.gt`
+		extension.  It's used if it's newer than `infile`, and written if not.
+	:return: The graph, and its ID index (see `id_index` and `lookup`)
+	'''
+	if cachefile is None:
+		cachefile = path.splitext(infile)[0] + '.gt'
+	indexfile = index_path(cachefile)
+	if (path.isfile(cachefile) and path.isfile(indexfile) and
+			path.getmtime(cachefile) >= path.getmtime(infile)):
+		print('found cached ' + cachefile)
+		net = gt.load_graph(cachefile)
+		with np.load(indexfile, allow_pickle = False) as arrays:
+			index = {name: arrays[name] for name in arrays.files}
+		return net, index
+
+	print('reading ' + infile)
+	edges = read_edge_list(infile)
+	net = gt.Graph(directed = True)
+	# Hashing adds a vertex for each distinct ID, in order of first
+	#  appearance, and gives back the ID of each vertex
+	snap_ids = net.add_edge_list(edges, hashed = True, hash_type = 'int')
+	net.vertex_properties['id'] = net.new_vertex_property('string',
+									vals = snap_ids.a.astype(str).tolist())
+	index = id_index(snap_ids.a)
+	print('finished reading ' + infile)
+
+	net.save(cachefile)
+	with open(indexfile, 'wb') as writefile:
+		np.savez(writefile, **index)
+	print('finished saving ' + cachefile)
+	return net, index
+
+
+if __name__ == '__main__':
+	for infile, outfile, cachefile, samplesfile in nets:
+		net, index = load_snap(infile, cachefile)
+		# `analyze_net` reads the comparison networks as graphml
+		if not path.isfile(outfile):
+			net.save(outfile)
+			print('finished saving ' + outfile)
+		else:
+			print('found saved ' + outfile)
 		id = net.vertex_properties['id']
-		id_to_gt = {id[vertex]: vertex for vertex in net.vertices()}
-	
-	#print(len(id_to_gt))
-	print('total vertices: ' + str(net.num_vertices()))
-	print('total edges: ' + str(net.num_edges()))
-# 
-# 	# How many samples to collect?
-# 	n_samples = 1000
-# 	# Initialize a container for them
-# 	samples = []
-# 	# And set a seed
-# 	seed = 13579
-# 	print('generating ' + str(n_samples) + ' random partitions')
-# 	while len(samples) < n_samples:
-# 		# Generate a random partition
-# 		temp_part = sample(list(id_to_gt), 200)
-# 		#print(temp_part)
-# 		# `modularity` needs the groups passed as a PropertyMap
-# 		temp_part_pmap = net.new_vertex_property('bool')
-# 		for vertex in net.vertices():
-# 			temp_part_pmap[vertex] = id[vertex] in temp_part
-# 		#print(comm.modularity(net, temp_part_pmap))
-# 		# Calculate the modularity and save it in `samples`
-# 		samples += [comm.modularity(net, temp_part_pmap)]
-# 		if len(samples) % 50 == 0:
-# 			print(len(samples))
-# 	print('finished.  writing sample modularities to disc.')
-# 	with open(samplesfile, 'w') as writefile:
-# 		json.dump(samples, writefile)
-# 	print('modularity mean: ' + str(np.mean(samples)))
-# 	print('modularity sd: ' + str(np.std(samples)))
+
+		print('total vertices: ' + str(net.num_vertices()))
+		print('total edges: ' + str(net.num_edges()))
+#
+# 		# How many samples to collect?
+# 		n_samples = 1000
+# 		# Initialize a container for them
+# 		samples = []
+# 		# And set a seed
+# 		seed = 13579
+# 		print('generating ' + str(n_samples) + ' random partitions')
+# 		while len(samples) < n_samples:
+# 			# Generate a random partition
+# 			temp_part = sample(index['ids'].tolist(), 200)
+# 			#print(temp_part)
+# 			# `modularity` needs the groups passed as a PropertyMap
+# 			temp_part_pmap = net.new_vertex_property('bool')
+# 			temp_part_pmap.a[lookup(index, temp_part)] = True
+# 			#print(comm.modularity(net, temp_part_pmap))
+# 			# Calculate the modularity and save it in `samples`
+# 			samples += [comm.modularity(net, temp_part_pmap)]
+# 			if len(samples) % 50 == 0:
+# 				print(len(samples))
+# 		print('finished.  writing sample modularities to disc.')
+# 		with open(samplesfile, 'w') as writefile:
+# 			json.dump(samples, writefile)
+# 		print('modularity mean: ' + str(np.mean(samples)))
+# 		print('modularity sd: ' + str(np.std(samples)))
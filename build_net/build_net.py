@@ -1,275 +1,330 @@
 # -*- coding: utf-8 -*-
 '''
-Using the metadata retrieved from Scopus, build citation and coauthor networks.  
+Using the metadata retrieved from Scopus, build citation and coauthor networks.
 Each of the resulting `graphml` files contains a single connected network.
-'''
-import graph_tool as gt
-import graph_tool.topology as topo
 
-import json
+As a script:
+
+	python build_net.py [--infile papers.json] [--networks citenet autnet]
+		[--outdir .] [--format .graphml] [--fractional] [--force] [--serial]
+		[--incremental]
+
+The networks whose first output file (e.g., `citenet0.graphml`) already
+exists are skipped, unless `--force` or `--incremental` is given.  With
+`--incremental`, the whole networks are saved too, and the next run applies
+only the new and changed papers to them; see `incremental.py`.  The dataset is read once;
+when both networks are built, each is built in its own process, from the
+same parsed dataset.
+
+The input can be `papers.json`, a JSON Lines file (`papers.jsonl`), or a
+columnar store (`papers.npz`).  JSON Lines and stores are read a chunk of
+papers at a time into compact arrays, so the memory needed is about the
+size of the columns and the graphs, without the Python objects for the
+whole dataset; `papers.json` has to be loaded whole first.  Convert it
+with `python ../scrape/paperstore.py papers.json papers.jsonl`.
+
+Bibliographic coupling and co-citation networks can be built too, with
+`--networks coupling cocitation`; see `coupling.py`.  By default they cover
+the core set and its neighbourhood (`--scope core`), and `--min-weight` and
+`--top-k` prune their weakest edges.  `--incremental` only applies to the
+citation and coauthor networks.
+
+As a module, `build_citenet(papers)`, `build_autnet(papers)`,
+`build_coupling(papers)` and `build_cocitation(papers)` take the dataset as
+a file name, a `paperstore.PaperStore`, or a list of paper dicts, and
+`split_core_components(g)` splits any of the networks into its components
+with core set members.
+'''
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
 import os.path as path
+import sys
+
+# Read either format of the dataset with `scrape/paperstore.py`
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								'..', 'scrape'))
+import paperstore
+
+import builders
+import coupling
+import incremental
 
-# The json file with the dataset output from `run_scrape`
+# The dataset output from `run_scrape`:  the json file, a JSON Lines file
+#  ending in `.jsonl`, or a columnar store ending in `.npz`
 infile = 'papers.json'
 # Strings to build graphml file names
 citenet_outfile_pre = 'citenet'
 autnet_outfile_pre = 'autnet'
+coupling_outfile_pre = 'coupling'
+cocitation_outfile_pre = 'cocitation'
 outfile_suff = '.graphml'
+# Add a 'fractional' edge weight to the coauthor network, with each paper
+#  contributing 1/(k-1) to each pair of its k authors?
+fractional_counting = False
+# Pruning for the coupling and co-citation networks:  the fewest shared
+#  references (or citers) for an edge, and the most edges kept by each paper
+min_weight = 1
+top_k = None
+
+NETWORKS = ('citenet', 'autnet', 'coupling', 'cocitation')
+# Built by default, and the ones `--incremental` can update
+DEFAULT_NETWORKS = ('citenet', 'autnet')
+
 
+def load_dataset(papers):
+	'''
+	Columnar access to the dataset, with the papers without metadata dropped
 
-# Step 1:  Read json file
-print('Reading dataset')
-with open(infile, 'r') as inread:
-    all_papers = json.load(inread)
-   
-print('Cleaning dataset')
-# If the Scopus ID is empty, we don't actually have any metadata on it;
-# Drop it from the set of all papers
-papers_working = [paper for paper in all_papers if paper['sid'] != '']
+	:param papers: A file name (JSON, JSON Lines, or a store; see
+		`paperstore.open_papers`), a
+		`paperstore.PaperStore`, or a list of paper dicts
+	:return: The `PaperStore`, and the indices of the working papers
+	'''
+	if isinstance(papers, str):
+		# The builders work on the columns, with the Scopus IDs and author IDs
+		#  interned as ints; see `scrape/paperstore.py` and `scrape/interning.py`
+		store = paperstore.open_papers(papers)
+	elif isinstance(papers, paperstore.PaperStore):
+		store = papers
+	else:
+		store = paperstore.from_records(papers)
+	# If the Scopus ID is empty, we don't actually have any metadata on it;
+	# Drop it from the set of all papers
+	working = builders.working_papers(store)
+	return store, working
 
 
-# Step 2:  Build citation network
+def build_citenet(papers, working = None):
+	'''
+	Build the citation network
 
-if not path.isfile(citenet_outfile_pre + '0' + outfile_suff):
+	:param papers: The dataset; see `load_dataset`
+	:param working: Indices of the papers to use; by default, every paper
+		with a Scopus ID
+	:return: The citation network, as a `graph_tool.Graph`
+	'''
+	store, all_working = load_dataset(papers)
+	if working is None:
+		working = all_working
 	print('Building citation network')
-	citenet = gt.Graph()
-	citenet.set_directed(True)
-
-	# Metadata:  
-	#  doi, sid, pmid, authors, source, year, references
-	#  core status
-
-	doi = citenet.new_vertex_property('string')
-	citenet.vertex_properties['doi'] = doi
-	sid = citenet.new_vertex_property('string')
-	citenet.vertex_properties['sid'] = sid
-	pmid = citenet.new_vertex_property('string')
-	citenet.vertex_properties['pmid'] = pmid
-	authors = citenet.new_vertex_property('vector<string>')
-	citenet.vertex_properties['authors'] = authors
-	source = citenet.new_vertex_property('string')
-	citenet.vertex_properties['source'] = source
-	year = citenet.new_vertex_property('int')
-	citenet.vertex_properties['year'] = year
-	references = citenet.new_vertex_property('vector<string>')
-	citenet.vertex_properties['references'] = references
-	core = citenet.new_vertex_property('bool')
-	citenet.vertex_properties['core'] = core
-
-	# Define a dict to look up a vertex given its sid
-	sid_to_gt = {}
-
-	count = 0
-	print(str(len(papers_working)) + ' primary entries in dataset')
-	for paper in papers_working:
-		# Either add a new vertex to the graph, or retrieve the vertex already added
-		if paper['sid'] not in sid_to_gt:
-			vertex = citenet.add_vertex()
-		else:
-			vertex = sid_to_gt[paper['sid']]
-	
-		# Add the metadata
-		doi[vertex] = paper['doi']
-		sid[vertex] = paper['sid']
-		pmid[vertex] = paper['pmid']
-		authors[vertex] = paper['authors']
-		source[vertex] = paper['source']
-		if paper['year'] is not None:
-			year[vertex] = paper['year']
-		references[vertex] = paper['references']
-		core[vertex] = paper['core']
-	
-		# Add **incoming** edges for each bibliography item
-		for reference in paper['references']:
-			if reference in sid_to_gt:
-				# If the item already has an internal id, look it up            
-				inbound = sid_to_gt[reference]
-			else:
-				# If not, add it a new vertex
-				inbound = citenet.add_vertex()
-				# Record which vertex in `sid_to_gt`
-				sid_to_gt[reference] = inbound
-				# And add its sid to its metadata
-				sid[inbound] = reference
-			# Now we can add the new edge
-			citenet.add_edge(inbound, vertex)
-
-		count += 1
-		if count % 1000 == 0:
-			print(count)
-		
+	print(str(len(working)) + ' primary entries in dataset')
+	# Lay out the vertices, edges and metadata as arrays, and add them to
+	#  the graph in bulk; see `builders.py`
+	citenet = builders.build_citenet(store, working)
+
 	print('Finished building graph')
 	print('Total vertices: ' + str(citenet.num_vertices()))
 	print('Total edges: ' + str(citenet.num_edges()))
+	return citenet
+
+
+def build_autnet(papers, working = None, fractional = fractional_counting):
+	'''
+	Build the coauthor network
+
+	:param papers: The dataset; see `load_dataset`
+	:param working: Indices of the papers to use; by default, every paper
+		with a Scopus ID
+	:param fractional: Add a 'fractional' edge weight, too
+	:return: The coauthor network, as a `graph_tool.Graph`
+	'''
+	store, all_working = load_dataset(papers)
+	if working is None:
+		working = all_working
+	print('Building coauthor network')
+	print(str(len(working)) + ' primary entries in dataset')
+	# Edge weights, and the number of papers and core status of each author,
+	#  come from the sparse paper-author incidence matrix; see `builders.py`
+	autnet = builders.build_autnet(store, working, fractional = fractional)
+
+	print('Finished building coauthor graph')
+	print('Total vertices: ' + str(autnet.num_vertices()))
+	print('Total edges: ' + str(autnet.num_edges()))
+	return autnet
+
+
+def build_coupling(papers, working = None, scope = 'core',
+					min_weight = min_weight, top_k = top_k):
+	'''
+	Build the bibliographic coupling network, with edges between papers
+	weighted by their number of shared references
+
+	:param papers: The dataset; see `load_dataset`
+	:param scope, min_weight, top_k: See `coupling.similarity_arrays`
+	:return: The network, as a `graph_tool.Graph`
+	'''
+	return _build_similarity(papers, 'coupling', working, scope, min_weight, top_k)
+
+
+def build_cocitation(papers, working = None, scope = 'core',
+						min_weight = min_weight, top_k = top_k):
+	'''
+	Build the co-citation network, with edges between papers weighted by
+	the number of papers citing both
 
+	:param papers: The dataset; see `load_dataset`
+	:param scope, min_weight, top_k: See `coupling.similarity_arrays`
+	:return: The network, as a `graph_tool.Graph`
+	'''
+	return _build_similarity(papers, 'cocitation', working, scope, min_weight, top_k)
 
 
-# Step 3:  Drop the weakly connected components that don't include core set items
-	print('Extracting core connected components')      
-	# `label_components` returns a property map:  
-	#  `component_pmap[vertex]` returns the ID for the component containing vertex
-	component_pmap = topo.label_components(citenet, directed = False)[0]
-	# Extract a list with the distinct component IDs
-	component_list = set(component_pmap[vertex] for vertex in list(citenet.vertices()))
-	print(str(len(component_list)) + ' weakly connected components found')
-
-	# Find the vertices from the core set
-	core_vertices = [vertex for vertex in list(citenet.vertices()) if core[vertex]]
-	print(str(len(core_vertices)) + ' core set members found')
-	# Extract a list of the component IDs from the core set members
-	core_components = {component_pmap[vertex] for vertex in core_vertices}
-	print(str(len(core_components)) + ' components with core set members')
-	print(core_components)
-
-	# Construct a list of graphs, one for each core component
-	citenets = []
-	for component in core_components:
-		# Define a new pmap for component membership
-		core_comp_pmap = citenet.new_vertex_property('bool')
-		for vertex in citenet.vertices():
-			core_comp_pmap[vertex] = component_pmap[vertex] == component
-		# Use this to filter down to the component
-		citenet.set_vertex_filter(core_comp_pmap)
-		# Copy it
-		temp_graph = gt.Graph(citenet, prune = True)
-		# Remove the filter
-		citenet.set_vertex_filter(None)
-		# If the component isn't empty, add it to the list of graphs
-		if temp_graph.num_vertices() > 0:
-			citenets += [temp_graph]
-			print('Component #' + str(component))
-			print('Vertices: ' + str(temp_graph.num_vertices()))
-			print('Edges: '	+ str(temp_graph.num_edges()))
-		else:
-			print(component)
-
-
-# Step 4:  Save citation network to disk
-	print('Saving networks to disk')
-	for component in citenets:
-		outfile = citenet_outfile_pre + str(citenets.index(component)) + outfile_suff
-		component.save(outfile)
-
-
-# Step 5:  Build coauthor network
-print('Building coauthor network')
-autnet = gt.Graph()
-autnet.set_directed(False)
-
-# Author Metadata:  
-#  Scopus author ID
-#  sources published in
-#  no. of papers in the dataset
-#  author of a core set paper
-id = autnet.new_vertex_property('string')
-autnet.vertex_properties['id'] = id
-sources = autnet.new_vertex_property('vector<string>')
-autnet.vertex_properties['sources'] = sources
-num_papers_v = autnet.new_vertex_property('int')
-autnet.vertex_properties['num_papers'] = num_papers_v
-core = autnet.new_vertex_property('bool')
-autnet.vertex_properties['core'] = core
-
-# Edge Metadata:
-#  no. papers coauthored
-#    needs to be float since we increment it .5 at a time
-num_papers_e = autnet.new_edge_property('float')
-autnet.edge_properties['num_papers'] = num_papers_e
-
-# Define a dict to look up a vertex given the author ID
-aut_to_gt = {}
-
-count = 0
-print(str(len(papers_working)) + ' primary entries in dataset')
-for paper in papers_working:
-	authors = paper['authors']
-	
-	# If necessary, add a new vertex to the graph
-	for author in authors:
-		if author not in aut_to_gt:
-			vertex = autnet.add_vertex()
-			
-			aut_to_gt[author] = vertex
-			id[vertex] = author
-			sources[vertex] = []
-			num_papers_v[vertex] = 0
-			core[vertex] = False
-	
-	# Update the author metadata
-	for author in authors:
-		vertex = aut_to_gt[author]
-		#sources[vertex] = sources[vertex].append(paper['source'])
-		num_papers_v[vertex] += 1
-		core[vertex] = core[vertex] or paper['core']
-	
-	# Add edges
-	for author1 in authors:
-		for author2 in authors:
-			# Don't self-link
-			if author1 == author2:
-				continue
-			# If there isn't yet an edge, add a new one
-			edge = autnet.edge(aut_to_gt[author1], aut_to_gt[author2], 
-								add_missing=False)
-			if edge is None:
-				edge = autnet.edge(aut_to_gt[author1], aut_to_gt[author2], 
-									add_missing=True)
-				num_papers_e[edge] = 0
-			# Since each author1-author2 appears twice, only add .5 to the weight
-			num_papers_e[edge] += 0.5
-
-	count += 1
-	if count % 1000 == 0:
-		print(count)
-		
-print('Finished building coauthor graph')
-print('Total vertices: ' + str(autnet.num_vertices()))
-print('Total edges: ' + str(autnet.num_edges()))
-
-
-# Step 6: Core connected components for coauthor network
-#  This is copied from step 3, with `autnet` for `citenet`
-print('Extracting core connected components')
-# `label_components` returns a property map:  
-#  `component_pmap[vertex]` returns the ID for the component containing vertex
-component_pmap = topo.label_components(autnet, directed = False)[0]
-# Extract a list with the distinct component IDs
-component_list = set(component_pmap[vertex] for vertex in list(autnet.vertices()))
-print(str(len(component_list)) + ' weakly connected components found')
-
-# Find the vertices from the core set
-core_vertices = [vertex for vertex in list(autnet.vertices()) if core[vertex]]
-print(str(len(core_vertices)) + ' core set members found')
-# Extract a list of the component IDs from the core set members
-core_components = set(component_pmap[vertex] for vertex in core_vertices)
-print(str(len(core_components)) + ' components with core set members')
-print(core_components)
-
-# Construct a list of graphs, one for each core component
-autnets = []
-for component in core_components:
-	# Define a new pmap for component membership
-	core_comp_pmap = autnet.new_vertex_property('bool')
-	for vertex in autnet.vertices():
-		core_comp_pmap[vertex] = component_pmap[vertex] == component
-	# Use this to filter down to the component
-	autnet.set_vertex_filter(core_comp_pmap)
-	# Copy it
-	temp_graph = gt.Graph(autnet, prune = True)
-	# Remove the filter
-	autnet.set_vertex_filter(None)
-	# If the component isn't empty, add it to the list of graphs
-	if temp_graph.num_vertices() > 0:
-		autnets += [temp_graph]
-		print('Component #' + str(component))
-		print('Vertices: ' + str(temp_graph.num_vertices()))
-		print('Edges: '	+ str(temp_graph.num_edges()))
+def _build_similarity(papers, kind, working, scope, min_weight, top_k):
+	store, all_working = load_dataset(papers)
+	if working is None:
+		working = all_working
+	print('Building ' + kind + ' network')
+	graph = coupling.build_similarity(store, kind, working, scope = scope,
+										min_weight = min_weight, top_k = top_k)
+	print('Finished building ' + kind + ' graph')
+	print('Total vertices: ' + str(graph.num_vertices()))
+	print('Total edges: ' + str(graph.num_edges()))
+	return graph
+
+
+def split_core_components(g):
+	'''
+	Drop the weakly connected components that don't include core set items
+
+	:return: List of the components with core set members, in order of
+		component label (as `label_components` numbers them), so
+		component `i` is saved as, e.g., `citenet<i>`
+	'''
+	return builders.split_core_components(g)
+
+
+def outfile(prefix, i, suffix = outfile_suff, outdir = '.'):
+	'''
+	:return: File name for component `i` of a network
+	'''
+	return path.join(outdir, prefix + str(i) + suffix)
+
+
+def save_components(components, prefix, suffix = outfile_suff, outdir = '.'):
+	'''
+	Save each component to its own file; graph-tool picks the format from
+	`suffix`, e.g., '.graphml' or '.gt'
+
+	:return: The file names
+	'''
+	outfiles = []
+	for i, component in enumerate(components):
+		outfiles += [outfile(prefix, i, suffix, outdir)]
+		component.save(outfiles[-1])
+	return outfiles
+
+
+# The dataset shared with the worker processes; they're forked after it's
+#  loaded, so they get it without reading or pickling it again
+_shared = {}
+
+
+def _build_network(network):
+	'''
+	Build, split, and save one network from the shared dataset
+	'''
+	store, working = _shared['dataset']
+	options = _shared['options']
+	prefix = getattr(options, network + '_prefix')
+	if options.incremental and network in DEFAULT_NETWORKS:
+		return incremental.update_network(network, store, working, prefix,
+											options.format, options.outdir,
+											fractional = options.fractional)
+	if network == 'citenet':
+		graph = build_citenet(store, working)
+	elif network == 'autnet':
+		graph = build_autnet(store, working, fractional = options.fractional)
 	else:
-		print(component)
-		
-
-# Step 4:  Save coauthor network to disk
-print('Saving coauthor networks to disk')
-for component in autnets:
-	outfile = autnet_outfile_pre + str(autnets.index(component)) + outfile_suff
-	component.save(outfile)
+		graph = _build_similarity(store, network, working, options.scope,
+									options.min_weight, options.top_k)
+	components = split_core_components(graph)
+	print('Saving ' + network + ' components to disk')
+	return save_components(components, prefix, options.format, options.outdir)
+
+
+def build_networks(networks, store, working, options):
+	'''
+	Build the networks, each in its own process if there's more than one
+
+	:param networks: Some of `NETWORKS`
+	:param options: Parsed command-line options; see `main`
+	:return: A dict, with the file names saved for each network
+	'''
+	_shared['dataset'] = (store, working)
+	_shared['options'] = options
+	if (len(networks) < 2 or options.serial or
+			'fork' not in multiprocessing.get_all_start_methods()):
+		return {network: _build_network(network) for network in networks}
+
+	# Read any arrays still in the file before forking, so the processes
+	#  don't share a file handle
+	store.load()
+	context = multiprocessing.get_context('fork')
+	with concurrent.futures.ProcessPoolExecutor(max_workers = len(networks),
+												mp_context = context) as pool:
+		futures = {network: pool.submit(_build_network, network)
+						for network in networks}
+		return {network: future.result() for network, future in futures.items()}
+
+
+def main(argv = None):
+	parser = argparse.ArgumentParser(description =
+				'Build citation and coauthor networks from the Scopus metadata')
+	parser.add_argument('--infile', default = infile,
+						help = 'papers.json, papers.jsonl, or a columnar store ending in .npz')
+	parser.add_argument('--networks', nargs = '+', choices = NETWORKS,
+						default = list(DEFAULT_NETWORKS), help = 'Networks to build')
+	parser.add_argument('--outdir', default = '.',
+						help = 'Folder for the network files')
+	parser.add_argument('--citenet-prefix', default = citenet_outfile_pre)
+	parser.add_argument('--autnet-prefix', default = autnet_outfile_pre)
+	parser.add_argument('--coupling-prefix', default = coupling_outfile_pre)
+	parser.add_argument('--cocitation-prefix', default = cocitation_outfile_pre)
+	parser.add_argument('--format', default = outfile_suff,
+						choices = ['.graphml', '.gt', '.xml', '.dot', '.gml'],
+						help = 'Network file extension')
+	parser.add_argument('--fractional', action = 'store_true',
+						default = fractional_counting,
+						help = 'Add fractional-counting weights to the coauthor network')
+	parser.add_argument('--scope', choices = coupling.SCOPES, default = 'core',
+						help = 'Papers in the coupling and co-citation networks:  ' +
+								'the core set and its neighbourhood, or all of them')
+	parser.add_argument('--min-weight', type = int, default = min_weight,
+						help = 'Fewest shared references or citers for a ' +
+								'coupling or co-citation edge')
+	parser.add_argument('--top-k', type = int, default = top_k,
+						help = 'Most coupling or co-citation edges kept by each paper')
+	parser.add_argument('--force', action = 'store_true',
+						help = 'Rebuild networks whose files already exist')
+	parser.add_argument('--serial', action = 'store_true',
+						help = 'Build the networks one after the other, in this process')
+	parser.add_argument('--incremental', action = 'store_true',
+						help = 'Update the networks saved by the last incremental run ' +
+								'with the new and changed papers')
+	options = parser.parse_args(argv)
+
+	networks = []
+	for network in options.networks:
+		if network in networks:
+			continue
+		updating = options.incremental and network in DEFAULT_NETWORKS
+		if (not options.force and not updating and
+				path.isfile(outfile(getattr(options, network + '_prefix'), 0,
+									options.format, options.outdir))):
+			print(network + ' already built; skipping')
+			continue
+		networks += [network]
+	if len(networks) == 0:
+		return {}
+
+	print('Reading dataset')
+	store, working = load_dataset(options.infile)
+	if not path.isdir(options.outdir):
+		os.makedirs(options.outdir)
+	return build_networks(networks, store, working, options)
+
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,483 @@
+# -*- coding: utf-8 -*-
+'''
+Network builders that work on the columnar paper data (see
+`scrape/paperstore.py`) with NumPy, and hand the results to graph-tool in
+bulk, rather than adding vertices, edges and properties one at a time.
+
+The index arithmetic is done in functions that only need NumPy, like
+`citenet_arrays`, so it can be checked without graph-tool installed.
+'''
+
+import os
+import sys
+
+import numpy as np
+import scipy.sparse as sparse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								'..', 'scrape'))
+import paperstore
+
+import identity
+
+
+# Vertex properties of the citation network, and their types
+CITENET_PROPERTIES = (('doi', 'string'), ('sid', 'string'), ('pmid', 'string'),
+						('authors', 'vector<string>'), ('source', 'string'),
+						('year', 'int'), ('references', 'vector<string>'),
+						('core', 'bool'))
+
+
+def working_papers(store):
+	'''
+	If the Scopus ID is empty, we don't actually have any metadata on a
+	paper; leave it out
+
+	:param store: A `paperstore.PaperStore`
+	:return: Indices of the papers to build the networks from
+	'''
+	return np.flatnonzero(store.column('sid') != '')
+
+
+def _last_index(n, targets, values):
+	'''
+	For each of `n` slots, the largest of `values` sent to it by `targets`,
+	or -1 if nothing was
+	'''
+	result = np.full(n, -1, dtype = np.int64)
+	np.maximum.at(result, targets, values)
+	return result
+
+
+def list_values(column, working):
+	'''
+	The values of a `ListColumn` for the working papers, in order, and the
+	position in `working` of the paper each belongs to
+	'''
+	in_working = np.zeros(len(column), dtype = bool)
+	in_working[working] = True
+	keep = in_working[column.rows()]
+	rows = np.repeat(np.arange(len(working), dtype = np.int64),
+						column.lengths()[working])
+	return column.values[keep], rows
+
+
+def citenet_arrays(store, working = None):
+	'''
+	Lay out the citation network as arrays.
+
+	Each paper gets one vertex, however many times it turns up:  the records
+	and reference-list entries with the same Scopus ID, DOI or PubMed ID are
+	merged by `identity.entities`.  Vertices are numbered in the order their
+	papers first turn up, taking the papers in order, each followed by its
+	references.  Each field of a vertex comes from the last of its records
+	that has that field; it's a core vertex if any of its records is.  A
+	reference gives an edge from the cited vertex to the citing one;
+	duplicate edges, and edges from a paper to itself, are dropped.
+
+	:param store: A `paperstore.PaperStore`
+	:param working: Indices of the papers to use; defaults to `working_papers`
+	:return: A dict of arrays:
+		'n_vertices':  number of vertices
+		'edges':  (E, 2) array of (cited, citing) vertex indices
+		'sid':  interned Scopus ID of each vertex
+		'paper':  for each vertex, the index of the last paper record merged
+			into it, or -1
+		'fields':  a dict, with the same as 'paper' for each field, but only
+			counting records with that field
+		'core':  core status of each vertex
+		'index':  an `identity.IdentityIndex` for the vertices
+		'merges':  a dict of counts, for `print_merges`
+	'''
+	if working is None:
+		working = working_papers(store)
+	n_working = len(working)
+	sids = store.column('sid', interned = True)[working]
+	dois = identity.normalize('doi', store.column('doi')[working])
+	pmids = identity.normalize('pmid', store.column('pmid')[working])
+	references = store.column('references', interned = True)
+
+	# The references of the working papers, in order, and for each one,
+	#  the position of its citing paper in `working`
+	ref_sids, ref_citing = list_values(references, working)
+	lengths = references.lengths()[working]
+
+	resolved = identity.entities(sids, ref_sids, dois, pmids)
+	n_vertices = resolved['n_entities']
+
+	# Position of each paper and reference in the dataset:  a paper, then
+	#  its references
+	starts = np.zeros(n_working, dtype = np.int64)
+	np.cumsum(lengths[:-1], out = starts[1:])
+	paper_pos = starts + np.arange(n_working)
+	ref_pos = (paper_pos[ref_citing] + 1 +
+				np.arange(len(ref_sids)) - starts[ref_citing])
+
+	# Number the entities by their first appearance
+	first_pos = np.full(n_vertices, np.iinfo(np.int64).max, dtype = np.int64)
+	np.minimum.at(first_pos, resolved['paper'], paper_pos)
+	np.minimum.at(first_pos, resolved['reference'], ref_pos)
+	vertex_of_entity = np.empty(n_vertices, dtype = np.int64)
+	vertex_of_entity[np.argsort(first_pos, kind = 'stable')] = np.arange(n_vertices)
+	paper_vertex = vertex_of_entity[resolved['paper']]
+	ref_vertex = vertex_of_entity[resolved['reference']]
+
+	paper, fields, core = record_fields(store, working, paper_vertex, n_vertices)
+
+	# A vertex's Scopus ID is its last record's, or else the one it was
+	#  first cited by
+	vertex_sid = np.full(n_vertices, -1, dtype = np.int64)
+	cited, first_cite = np.unique(ref_vertex, return_index = True)
+	vertex_sid[cited] = ref_sids[first_cite]
+	has_paper = paper >= 0
+	vertex_sid[has_paper] = store.column('sid', interned = True)[paper[has_paper]]
+
+	# One edge per distinct (cited, citing) pair, in the order they turn up
+	edges = np.column_stack([ref_vertex, paper_vertex[ref_citing]])
+	loops = edges[:, 0] == edges[:, 1]
+	edges = edges[~loops]
+	_, first_edge = np.unique(edges[:, 0] * n_vertices + edges[:, 1],
+								return_index = True)
+	n_refs = len(edges)
+	edges = edges[np.sort(first_edge)]
+
+	all_sids = np.concatenate([sids, ref_sids])
+	index = identity.IdentityIndex.from_arrays({
+				'sid': (store.interner.strings('sid', all_sids),
+						np.concatenate([paper_vertex, ref_vertex])),
+				'doi': (dois, paper_vertex),
+				'pmid': (pmids, paper_vertex)})
+
+	paper_entities = np.unique(resolved['paper'])
+	merges = {'records': n_working,
+				'references': len(ref_sids),
+				'vertices': n_vertices,
+				'duplicate_records': n_working - len(paper_entities),
+				'cited_records': int(np.isin(paper_entities,
+											resolved['reference']).sum()),
+				'sid_aliases': resolved['n_sids'] - n_vertices,
+				'self_citations': int(loops.sum()),
+				'duplicate_edges': n_refs - len(edges)}
+	return {'n_vertices': n_vertices, 'edges': edges, 'sid': vertex_sid,
+			'paper': paper, 'fields': fields, 'core': core,
+			'index': index, 'merges': merges}
+
+
+def record_fields(store, working, paper_vertex, n_vertices):
+	'''
+	Merge the records for each vertex.  Later records overwrite earlier
+	ones on the same vertex, except that a missing field doesn't overwrite
+	one that's there.
+
+	:param working: Indices of the paper records
+	:param paper_vertex: The vertex of each record
+	:return: `paper`, `fields` and `core`, as in `citenet_arrays`
+	'''
+	positions = np.arange(len(working), dtype = np.int64)
+	def last_with(present):
+		index = _last_index(n_vertices, paper_vertex[present], positions[present])
+		index[index >= 0] = working[index[index >= 0]]
+		return index
+	paper = last_with(np.ones(len(working), dtype = bool))
+	fields = {'doi': store.column('doi')[working] != '',
+				'pmid': store.column('pmid')[working] != '',
+				'source': store.column('source')[working] != '',
+				'year': store.column('year')[working] != paperstore.YEAR_MISSING,
+				'authors': store.column('authors').lengths()[working] > 0,
+				'references': store.column('references').lengths()[working] > 0}
+	fields = {field: last_with(present) for field, present in fields.items()}
+
+	core = np.zeros(n_vertices, dtype = bool)
+	if store.has_column('core'):
+		core[paper_vertex[store.column('core')[working]]] = True
+	return paper, fields, core
+
+
+def print_merges(merges):
+	'''
+	Report how many records and references were merged by `citenet_arrays`
+	'''
+	print(str(merges['records']) + ' records and ' + str(merges['references']) +
+			' references resolved to ' + str(merges['vertices']) + ' vertices')
+	print(str(merges['duplicate_records']) + ' records merged with another record')
+	print(str(merges['cited_records']) +
+			' retrieved papers merged with the references to them')
+	print(str(merges['sid_aliases']) +
+			' Scopus IDs merged into another by DOI or PubMed ID')
+	print(str(merges['duplicate_edges']) + ' duplicate edges and ' +
+			str(merges['self_citations']) + ' self-citations dropped')
+
+
+def _gather(column, index, missing):
+	'''
+	`column[index]`, with `missing` where `index` is -1
+	'''
+	return np.where(index >= 0, column[np.maximum(index, 0)], missing)
+
+
+def _gather_lists(column, index):
+	'''
+	The lists from a `ListColumn` for each of `index`, with [] for -1
+	'''
+	return [column[i] if i >= 0 else [] for i in index.tolist()]
+
+
+def citenet_properties(store, layout, vertices = None):
+	'''
+	The vertex metadata of the citation network
+
+	:param layout: The output of `citenet_arrays`, or at least its 'fields',
+		'sid' and 'core'
+	:param vertices: The vertices to give values for; defaults to all of them
+	:return: A dict, with the values for each of `CITENET_PROPERTIES`
+	'''
+	if vertices is None:
+		vertices = np.arange(len(layout['sid']))
+	fields = {field: index[vertices] for field, index in layout['fields'].items()}
+	def string_values(name):
+		return _gather(store.column(name), fields[name], '').tolist()
+	return {'doi': string_values('doi'),
+			'sid': store.interner.strings('sid', layout['sid'][vertices]).tolist(),
+			'pmid': string_values('pmid'),
+			'authors': _gather_lists(store.column('authors'), fields['authors']),
+			'source': string_values('source'),
+			'year': _gather(store.column('year'), fields['year'], 0),
+			'references': _gather_lists(store.column('references'),
+										fields['references']),
+			'core': layout['core'][vertices]}
+
+
+def build_citenet(store, working = None, layout = None):
+	'''
+	Build the citation network, with the same properties as the old step 2
+	of `build_net.py`, but one vertex per paper; see `citenet_arrays`
+
+	:param store: A `paperstore.PaperStore`
+	:param working: Indices of the papers to use; defaults to `working_papers`
+	:param layout: The output of `citenet_arrays`, if it's already computed
+	:return: The `graph_tool.Graph`
+	'''
+	import graph_tool as gt
+
+	if layout is None:
+		layout = citenet_arrays(store, working)
+	print_merges(layout['merges'])
+	citenet = gt.Graph(directed = True)
+	if layout['n_vertices'] > 0:
+		citenet.add_vertex(layout['n_vertices'])
+	citenet.add_edge_list(layout['edges'])
+
+	# Metadata:
+	#  doi, sid, pmid, authors, source, year, references
+	#  core status
+	values = citenet_properties(store, layout)
+	for name, value_type in CITENET_PROPERTIES:
+		citenet.vertex_properties[name] = citenet.new_vertex_property(value_type,
+																vals = values[name])
+	return citenet
+
+
+def autnet_arrays(store, working = None, fractional = False):
+	'''
+	Lay out the coauthor network as arrays, from the sparse paper-author
+	incidence matrix `B`, with `B[p, a]` the number of times author `a` is
+	listed on paper `p`.  Then
+
+		vertex 'num_papers' = column sums of B
+		vertex 'core' = B^T c > 0, with c the core flags of the papers
+		edge 'num_papers' = off-diagonal entries of B^T B
+
+	which gives the same numbers as the old loop over every ordered pair of
+	authors of every paper, adding 0.5 each time.
+
+	Vertices are numbered in the order the old loop created them, by first
+	appearance.  Edges are in order of (lower, higher) vertex index.
+
+	:param store: A `paperstore.PaperStore`
+	:param working: Indices of the papers to use; defaults to `working_papers`
+	:param fractional: Also compute fractional-counting weights:  each paper
+		contributes 1/(k-1) to each coauthor pair, for k distinct authors,
+		so each author's total weight from a paper is 1
+	:return: A dict of arrays:
+		'n_vertices':  number of vertices
+		'author':  interned author ID of each vertex
+		'num_papers':  number of papers (as author listings) for each vertex
+		'core':  whether each vertex authored a core paper
+		'edges':  (E, 2) array of vertex indices
+		'weight':  number of papers coauthored, for each edge
+		'fractional':  only with `fractional`; fractional weight of each edge
+	'''
+	if working is None:
+		working = working_papers(store)
+	authors, rows = list_values(store.column('authors', interned = True), working)
+
+	# Vertices by first appearance
+	keys, first, inverse = np.unique(authors, return_index = True,
+										return_inverse = True)
+	rank = np.empty(len(keys), dtype = np.int64)
+	rank[np.argsort(first, kind = 'stable')] = np.arange(len(keys))
+	vertex = rank[inverse]
+	n_vertices = len(keys)
+	author = np.empty(n_vertices, dtype = np.int64)
+	author[vertex] = authors
+
+	incidence = incidence_matrix(rows, vertex, len(working), n_vertices)
+	num_papers = np.asarray(incidence.sum(axis = 0)).ravel()
+	if store.has_column('core'):
+		paper_core = store.column('core')[working].astype(np.int64)
+	else:
+		paper_core = np.zeros(len(working), dtype = np.int64)
+	core = (incidence.T @ paper_core) > 0
+
+	source, target, weight = upper_entries(coauthor_weights(incidence))
+	layout = {'n_vertices': n_vertices, 'author': author,
+				'num_papers': num_papers, 'core': core,
+				'edges': np.column_stack([source, target]).astype(np.int64),
+				'weight': weight.astype(float)}
+	if fractional:
+		# Only papers with several authors add edges, so this has the same
+		#  entries as the full count
+		layout['fractional'] = upper_entries(fractional_weights(incidence))[2]
+	return layout
+
+
+def incidence_matrix(rows, vertex, n_rows, n_vertices):
+	'''
+	The paper-author incidence matrix; duplicate entries are summed, so it
+	counts repeated listings
+
+	:param rows: The paper of each author listing
+	:param vertex: The author vertex of each listing
+	'''
+	return sparse.csr_matrix((np.ones(len(vertex), dtype = np.int64),
+								(rows, vertex)),
+								shape = (n_rows, n_vertices))
+
+
+def coauthor_weights(incidence):
+	'''
+	:return: `B^T B`, for the incidence matrix `B`; the off-diagonal
+		entries are the number of papers coauthored
+	'''
+	return incidence.T @ incidence
+
+
+def fractional_weights(incidence):
+	'''
+	:return: The fractional-counting version of `coauthor_weights`, with
+		each paper contributing 1/(k-1) to each pair of its k distinct authors
+	'''
+	binary = incidence.copy()
+	binary.data[:] = 1
+	n_authors = np.asarray(binary.sum(axis = 1)).ravel()
+	paper_weight = np.zeros(incidence.shape[0])
+	shared = n_authors > 1
+	paper_weight[shared] = 1 / (n_authors[shared] - 1)
+	return binary.T @ sparse.diags(paper_weight) @ binary
+
+
+def upper_entries(matrix):
+	'''
+	:return: Rows, columns and values of the entries above the diagonal,
+		in (row, column) order
+	'''
+	matrix = sparse.triu(matrix, k = 1).tocoo()
+	order = np.lexsort((matrix.col, matrix.row))
+	return matrix.row[order], matrix.col[order], matrix.data[order]
+
+
+def build_autnet(store, working = None, fractional = False, layout = None):
+	'''
+	Build the coauthor network, with the same vertices, properties and
+	edge weights as the old step 5 of `build_net.py`
+
+	:param store: A `paperstore.PaperStore`
+	:param working: Indices of the papers to use; defaults to `working_papers`
+	:param fractional: Add a 'fractional' edge property with fractional-counting
+		weights; see `autnet_arrays`
+	:param layout: The output of `autnet_arrays`, if it's already computed
+	:return: The `graph_tool.Graph`
+	'''
+	import graph_tool as gt
+
+	if layout is None:
+		layout = autnet_arrays(store, working, fractional)
+	autnet = gt.Graph(directed = False)
+	if layout['n_vertices'] > 0:
+		autnet.add_vertex(layout['n_vertices'])
+	autnet.add_edge_list(layout['edges'])
+
+	# Author Metadata:
+	#  Scopus author ID
+	#  sources published in
+	#  no. of papers in the dataset
+	#  author of a core set paper
+	autnet.vertex_properties['id'] = autnet.new_vertex_property('string',
+											vals = store.interner.strings('author',
+																layout['author']).tolist())
+	autnet.vertex_properties['sources'] = autnet.new_vertex_property('vector<string>')
+	autnet.vertex_properties['num_papers'] = autnet.new_vertex_property('int',
+											vals = layout['num_papers'])
+	autnet.vertex_properties['core'] = autnet.new_vertex_property('bool',
+											vals = layout['core'])
+
+	# Edge Metadata:
+	#  no. papers coauthored
+	autnet.edge_properties['num_papers'] = autnet.new_edge_property('float',
+											vals = layout['weight'])
+	if fractional:
+		autnet.edge_properties['fractional'] = autnet.new_edge_property('float',
+											vals = layout['fractional'])
+	return autnet
+
+
+def core_component_labels(labels, core):
+	'''
+	:param labels: Component label of each vertex
+	:param core: Core flag of each vertex
+	:return: The labels of the components with core vertices, in order
+	'''
+	return np.unique(np.asarray(labels)[np.asarray(core, dtype = bool)])
+
+
+def split_core_components(graph, core = 'core'):
+	'''
+	Split a network into its weakly connected components that include
+	core set items, dropping the rest.  Used for both the citation and
+	coauthor networks.
+
+	:param graph: A `graph_tool.Graph`
+	:param core: Name of the bool vertex property marking the core set
+	:return: A list of new graphs, one for each core component, in order
+		of component label
+	'''
+	import graph_tool.topology as topo
+
+	print('Extracting core connected components')
+	# `label_components` returns a property map; its array has the
+	#  component ID of each vertex
+	labels = topo.label_components(graph, directed = False)[0].a
+	core_flags = graph.vertex_properties[core].a.astype(bool)
+	print(str(len(np.unique(labels))) + ' weakly connected components found')
+	print(str(int(core_flags.sum())) + ' core set members found')
+	core_labels = core_component_labels(labels, core_flags)
+	print(str(len(core_labels)) + ' components with core set members')
+	print(core_labels.tolist())
+
+	return [extract_component(graph, labels, label) for label in core_labels]
+
+
+def extract_component(graph, labels, label):
+	'''
+	:param labels: Component label of each vertex
+	:return: A new graph, with just the component with `label`
+	'''
+	import graph_tool as gt
+
+	# Filter down to the component, and copy it
+	view = gt.GraphView(graph, vfilt = labels == label)
+	component = gt.Graph(view, prune = True)
+	print('Component #' + str(label))
+	print('Vertices: ' + str(component.num_vertices()))
+	print('Edges: '	+ str(component.num_edges()))
+	return component
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+'''
+Check `incremental.update_network` against building from scratch.
+
+For each trial, a random dataset is built into a network, then changed --
+references added, authors swapped, core flags flipped, new papers -- and the
+saved network is updated with the changes.  The updated network has to match
+the layout of the changed dataset from `builders`, which doesn't need
+graph-tool; the core components saved by the update have to match those of a
+build from scratch; and updating again, with nothing changed, has to leave
+the components as they are.
+
+Vertices that an update leaves isolated, for papers no longer cited or
+authors no longer listed, are ignored.
+
+Needs graph-tool.  Run as
+
+	python check_incremental.py [trials]
+'''
+
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								'..', 'scrape'))
+import paperstore
+
+import builders
+import incremental
+
+N_TRIALS = 150
+SUFFIX = '.graphml'
+
+
+def random_papers(rnd, n, sids):
+	'''
+	:param rnd: A `random.Random`
+	:param n: Number of papers
+	:param sids: Scopus IDs to draw from, for the papers and their references
+	:return: A list of paper dicts
+	'''
+	papers = []
+	for i in range(n):
+		papers += [{'sid': rnd.choice(sids),
+					'doi': rnd.choice(['', '', '', 'D' + str(rnd.randint(0, 40))]),
+					'pmid': '',
+					'source': rnd.choice(['', 'src']),
+					'year': rnd.choice([None, 1990 + i]),
+					'authors': [str(rnd.randint(0, 12))
+								for _ in range(rnd.randint(0, 4))],
+					'references': rnd.sample(sids, rnd.randint(0, 3)),
+					'core': rnd.random() < .15}]
+	return papers
+
+
+def change_papers(rnd, papers, sids):
+	'''
+	:return: A changed copy of `papers`
+	'''
+	changed = [dict(paper) for paper in papers]
+	for paper in changed:
+		if rnd.random() < .2:
+			paper['references'] = paper['references'] + [rnd.choice(sids)]
+		if rnd.random() < .2:
+			paper['authors'] = paper['authors'][:-1] + [str(rnd.randint(0, 15))]
+		if rnd.random() < .1:
+			paper['core'] = not paper['core']
+	return changed + random_papers(rnd, rnd.randint(0, 8), sids)
+
+
+def _summary(vertices, edges, weights = ()):
+	# Comparable form of a network:  the vertices by identifier, and the
+	#  edges as identifier pairs, with their weights
+	edges = {pair: tuple(round(float(w), 9) for w in weight)
+				for pair, weight in zip(edges, zip(*weights) if weights else
+										[()] * len(edges))}
+	return sorted(vertices.items()), sorted(edges.items())
+
+
+def citenet_summary(vertices, edges):
+	'''
+	:param vertices: Dict of property name -> list of values, one per vertex
+	:param edges: (E, 2) array of vertex indices, cited then citing
+	'''
+	n = len(vertices['sid'])
+	linked = np.zeros(n, dtype = bool)
+	linked[np.asarray(edges, dtype = np.int64).ravel()] = True
+	names = [name for name, _ in builders.CITENET_PROPERTIES]
+	summary = {}
+	for v in range(n):
+		values = tuple(vertices[name][v] if not isinstance(vertices[name][v], list)
+						else tuple(vertices[name][v]) for name in names)
+		# Keep vertices with edges, or with a record of their own
+		if linked[v] or vertices['doi'][v] or vertices['source'][v] or \
+				vertices['authors'][v] or vertices['references'][v]:
+			summary[vertices['sid'][v]] = values
+	sid = vertices['sid']
+	return _summary(summary, [(sid[s], sid[t]) for s, t in np.asarray(edges).tolist()])
+
+
+def autnet_summary(ids, num_papers, core, edges, weights):
+	'''
+	:param ids: Author ID of each vertex
+	:param edges: (E, 2) array of vertex indices
+	:param weights: Arrays of edge weights
+	'''
+	vertices = {ids[v]: (int(num_papers[v]), bool(core[v]))
+				for v in range(len(ids)) if num_papers[v] > 0}
+	pairs = [tuple(sorted((ids[s], ids[t]))) for s, t in np.asarray(edges).tolist()]
+	return _summary(vertices, pairs, weights)
+
+
+def layout_summary(network, store, working, fractional):
+	'''
+	The network a build from scratch gives, from the `builders` layout
+	'''
+	if network == 'citenet':
+		layout = builders.citenet_arrays(store, working)
+		values = builders.citenet_properties(store, layout)
+		vertices = {name: [value.tolist() if hasattr(value, 'tolist') else value
+							for value in values[name]]
+					for name, _ in builders.CITENET_PROPERTIES}
+		vertices['core'] = [bool(value) for value in vertices['core']]
+		return citenet_summary(vertices, layout['edges'])
+	layout = builders.autnet_arrays(store, working, fractional)
+	weights = [layout['weight']] + ([layout['fractional']] if fractional else [])
+	return autnet_summary(store.interner.strings('author', layout['author']).tolist(),
+							layout['num_papers'], layout['core'], layout['edges'],
+							weights)
+
+
+def graph_summary(network, graph, fractional):
+	'''
+	The same, for a `graph_tool.Graph`
+	'''
+	edges = graph.get_edges([graph.edge_index])
+	vertices = [graph.vertex(v) for v in range(graph.num_vertices())]
+	if network == 'citenet':
+		values = {}
+		for name, value_type in builders.CITENET_PROPERTIES:
+			prop = graph.vertex_properties[name]
+			values[name] = [list(prop[v]) if value_type.startswith('vector') else
+							bool(prop[v]) if value_type == 'bool' else prop[v]
+							for v in vertices]
+		return citenet_summary(values, edges[:, :2])
+	names = ['num_papers'] + (['fractional'] if fractional else [])
+	weights = [graph.edge_properties[name].a[edges[:, 2]] for name in names]
+	ids = graph.vertex_properties['id']
+	return autnet_summary([ids[v] for v in vertices],
+							graph.vertex_properties['num_papers'].a,
+							graph.vertex_properties['core'].a, edges[:, :2],
+							weights)
+
+
+def files_summary(network, files, fractional):
+	import graph_tool as gt
+
+	return sorted(repr(graph_summary(network, gt.load_graph(f), fractional))
+					for f in files)
+
+
+def update(papers, network, outdir, fractional):
+	'''
+	:return: The store, the working papers, and the component files
+	'''
+	store = paperstore.from_records(papers)
+	working = builders.working_papers(store)
+	with contextlib.redirect_stdout(io.StringIO()):
+		files = incremental.update_network(network, store, working, network,
+											SUFFIX, outdir, fractional)
+	return store, working, files
+
+
+def check(trial):
+	'''
+	Run one trial, for both networks
+
+	:raise AssertionError: If the updated network differs
+	'''
+	rnd = random.Random(trial)
+	sids = ['s' + str(i) for i in range(120)]
+	papers = random_papers(rnd, rnd.randint(0, 40), sids)
+	for network in ('citenet', 'autnet'):
+		fractional = network == 'autnet' and trial % 2 == 0
+		changed = change_papers(rnd, papers, sids)
+		with tempfile.TemporaryDirectory() as updated, \
+				tempfile.TemporaryDirectory() as scratch:
+			update(papers, network, updated, fractional)
+			store, working, files = update(changed, network, updated, fractional)
+			graph = incremental.load_network(network, updated)[0]
+			assert (graph_summary(network, graph, fractional) ==
+					layout_summary(network, store, working, fractional)), \
+					(trial, network, 'network')
+			full = files_summary(network, update(changed, network, scratch,
+													fractional)[2], fractional)
+			assert files_summary(network, files, fractional) == full, \
+					(trial, network, 'components')
+			files = update(changed, network, updated, fractional)[2]
+			assert files_summary(network, files, fractional) == full, \
+					(trial, network, 'unchanged update')
+
+
+if __name__ == '__main__':
+	n_trials = int(sys.argv[1]) if len(sys.argv) > 1 else N_TRIALS
+	for trial in range(n_trials):
+		check(trial)
+	print(str(n_trials) + ' trials:  incremental updates match builds from scratch')
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+'''
+Bibliographic coupling and co-citation networks, derived from the citation
+network as sparse matrix products.
+
+With `A` the citation adjacency matrix, `A[i, j] = 1` if paper `i` cites
+paper `j`:
+
+	bibliographic coupling:  `A A^T`; the weight of a pair of papers is the
+		number of references they share
+	co-citation:  `A^T A`; the weight of a pair of papers is the number of
+		papers that cite both
+
+Both are undirected.  The products are computed a block of rows at a time,
+and each block is pruned before the next is computed:  pairs below
+`min_weight` are dropped, and with `top_k`, each paper keeps only its `top_k`
+heaviest pairs (a pair is kept if it's in the top `top_k` of either paper).
+So memory depends on the pruned network, plus one block of the product,
+rather than on the square of the number of papers.
+
+By default the networks are built for the core set and its neighbourhood,
+the papers that cite or are cited by a core paper; shared references and
+citers are counted over the whole citation network.
+'''
+
+import numpy as np
+import scipy.sparse as sparse
+
+import builders
+
+BLOCK_SIZE = 1000		# Rows of the product computed at a time
+SCOPES = ('core', 'all')
+
+
+def citation_matrix(layout):
+	'''
+	:param layout: The output of `builders.citenet_arrays`
+	:return: The citation adjacency matrix, as a CSR matrix, with
+		`A[citing, cited] = 1`
+	'''
+	n = layout['n_vertices']
+	edges = layout['edges']
+	return sparse.csr_matrix((np.ones(len(edges), dtype = np.int64),
+								(edges[:, 1], edges[:, 0])),
+								shape = (n, n))
+
+
+def core_neighbourhood(layout, adjacency):
+	'''
+	:return: The core vertices, and those citing or cited by them, in order
+	'''
+	core = layout['core'].astype(np.int64)
+	near = (core > 0) | (adjacency @ core > 0) | (adjacency.T @ core > 0)
+	return np.flatnonzero(near)
+
+
+def _prune(rows, cols, weights, min_weight, top_k):
+	'''
+	Drop entries below `min_weight`, and all but the `top_k` heaviest
+	entries of each row
+	'''
+	keep = weights >= min_weight
+	rows, cols, weights = rows[keep], cols[keep], weights[keep]
+	if top_k is not None and len(rows) > 0:
+		# Heaviest first within each row; ties go to the lower column
+		order = np.lexsort((cols, -weights, rows))
+		rows, cols, weights = rows[order], cols[order], weights[order]
+		starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+		lengths = np.diff(np.r_[starts, len(rows)])
+		rank = np.arange(len(rows)) - np.repeat(starts, lengths)
+		keep = rank < top_k
+		rows, cols, weights = rows[keep], cols[keep], weights[keep]
+	return rows, cols, weights
+
+
+def shared_counts(matrix, min_weight = 1, top_k = None, block_size = BLOCK_SIZE):
+	'''
+	The off-diagonal entries of `M M^T`, pruned as above
+
+	:param matrix: A CSR matrix `M`
+	:return: Arrays of rows and columns, with row < column, and weights
+	'''
+	matrix = sparse.csr_matrix(matrix)
+	transpose = matrix.T.tocsc()
+	rows, cols, weights = [], [], []
+	for start in range(0, matrix.shape[0], block_size):
+		block = (matrix[start:start + block_size] @ transpose).tocoo()
+		block_rows = block.row.astype(np.int64) + start
+		off_diagonal = block_rows != block.col
+		pruned = _prune(block_rows[off_diagonal],
+						block.col[off_diagonal].astype(np.int64),
+						block.data[off_diagonal], min_weight, top_k)
+		rows += [pruned[0]]
+		cols += [pruned[1]]
+		weights += [pruned[2]]
+	rows = np.concatenate(rows) if rows else np.array([], dtype = np.int64)
+	cols = np.concatenate(cols) if cols else np.array([], dtype = np.int64)
+	weights = np.concatenate(weights) if weights else np.array([], dtype = np.int64)
+
+	# Each pair once, kept if either of its papers kept it
+	low = np.minimum(rows, cols)
+	high = np.maximum(rows, cols)
+	_, first = np.unique(low * matrix.shape[0] + high, return_index = True)
+	return low[first], high[first], weights[first]
+
+
+def similarity_arrays(layout, kind, scope = 'core', min_weight = 1,
+						top_k = None, block_size = BLOCK_SIZE):
+	'''
+	Lay out a bibliographic coupling or co-citation network as arrays
+
+	:param layout: The output of `builders.citenet_arrays`
+	:param kind: 'coupling' or 'cocitation'
+	:param scope: 'core' for the core set and its neighbourhood, or 'all'
+	:return: A dict of arrays:
+		'vertices':  the citation network vertex of each vertex
+		'edges':  (E, 2) array of vertex indices
+		'weight':  shared references or citers, for each edge
+	'''
+	adjacency = citation_matrix(layout)
+	if scope == 'core':
+		vertices = core_neighbourhood(layout, adjacency)
+	elif scope == 'all':
+		vertices = np.arange(layout['n_vertices'])
+	else:
+		raise ValueError('Unknown scope ' + str(scope))
+	if kind == 'coupling':
+		# Rows are the papers, columns their references
+		matrix = adjacency[vertices]
+	elif kind == 'cocitation':
+		# Rows are the papers, columns the papers citing them
+		matrix = adjacency.T.tocsr()[vertices]
+	else:
+		raise ValueError('Unknown network ' + str(kind))
+	sources, targets, weights = shared_counts(matrix, min_weight, top_k, block_size)
+	return {'vertices': vertices,
+			'edges': np.column_stack([sources, targets]),
+			'weight': weights}
+
+
+def build_similarity(store, kind, working = None, scope = 'core',
+						min_weight = 1, top_k = None):
+	'''
+	Build a bibliographic coupling or co-citation network, with the same
+	vertex properties as the citation network, and a 'weight' edge property
+
+	:param store: A `paperstore.PaperStore`
+	:param kind: 'coupling' or 'cocitation'
+	:param working: Indices of the papers to use; defaults to
+		`builders.working_papers`
+	:param scope, min_weight, top_k: See `similarity_arrays`
+	:return: The `graph_tool.Graph`
+	'''
+	import graph_tool as gt
+
+	layout = builders.citenet_arrays(store, working)
+	similarity = similarity_arrays(layout, kind, scope, min_weight, top_k)
+	vertices = similarity['vertices']
+	graph = gt.Graph(directed = False)
+	if len(vertices) > 0:
+		graph.add_vertex(len(vertices))
+	graph.add_edge_list(similarity['edges'])
+
+	values = builders.citenet_properties(store, layout, vertices)
+	for name, value_type in builders.CITENET_PROPERTIES:
+		graph.vertex_properties[name] = graph.new_vertex_property(value_type,
+															vals = values[name])
+	graph.edge_properties['weight'] = graph.new_edge_property('int',
+											vals = similarity['weight'])
+	return graph
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+'''
+Identity resolution for the citation network.
+
+The same paper can turn up in the dataset several times:  as a retrieved
+record and as an entry in other papers' reference lists (which give only
+its Scopus ID), or as two records with different Scopus IDs but the same
+DOI or PubMed ID.  `entities` groups all of these into one entity per
+paper, in a single pass over the identifiers, and `IdentityIndex` maps each
+Scopus ID, DOI and PubMed ID to the entity's vertex.
+
+Two identifiers belong to the same entity if any record lists both of them;
+the grouping is the connected components of the graph with an edge between
+each record's Scopus ID and its DOI, and between its Scopus ID and its
+PubMed ID.
+'''
+
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+
+KINDS = ('sid', 'doi', 'pmid')
+MISSING = -1				# `lookup` result for an identifier that isn't indexed
+
+
+def normalize(kind, idents):
+	'''
+	Put identifiers in the form they're compared in:  DOIs are
+	case-insensitive, and stray whitespace is dropped
+
+	:param idents: Array of strings
+	:return: Array of strings
+	'''
+	idents = np.char.strip(np.asarray(idents, dtype = str))
+	if kind == 'doi':
+		idents = np.char.lower(idents)
+	return idents
+
+
+def entities(sids, ref_sids, dois, pmids):
+	'''
+	Group papers and references into entities
+
+	:param sids: Interned Scopus ID of each paper record
+	:param ref_sids: Interned Scopus ID of each reference
+	:param dois: Normalized DOI of each paper record, '' if it has none
+	:param pmids: Normalized PubMed ID of each paper record, '' if it has none
+	:return: A dict:
+		'n_entities':  number of entities
+		'paper':  entity of each paper record
+		'reference':  entity of each reference
+		'n_sids':  number of distinct Scopus IDs
+	'''
+	sid_keys, sid_inverse = np.unique(np.concatenate([
+										np.asarray(sids, dtype = np.int64),
+										np.asarray(ref_sids, dtype = np.int64)]),
+									return_inverse = True)
+	n_sids = len(sid_keys)
+	paper_node = sid_inverse[:len(sids)]
+	ref_node = sid_inverse[len(sids):]
+
+	# Nodes are the Scopus IDs, then the DOIs, then the PubMed IDs
+	rows = []
+	cols = []
+	n_nodes = n_sids
+	for idents in (dois, pmids):
+		present = idents != ''
+		keys, inverse = np.unique(idents[present], return_inverse = True)
+		rows += [paper_node[present]]
+		cols += [n_nodes + inverse]
+		n_nodes += len(keys)
+	rows = np.concatenate(rows)
+	cols = np.concatenate(cols)
+	links = sparse.coo_matrix((np.ones(len(rows), dtype = np.int8), (rows, cols)),
+								shape = (n_nodes, n_nodes))
+	n_components, labels = connected_components(links, directed = False)
+	# Every DOI and PubMed ID node is linked to a Scopus ID node, so the
+	#  labels of the Scopus IDs cover every component
+	return {'n_entities': n_components,
+			'paper': labels[paper_node].astype(np.int64),
+			'reference': labels[ref_node].astype(np.int64),
+			'n_sids': n_sids}
+
+
+class IdentityIndex:
+	'''
+	Lookup from Scopus IDs, DOIs and PubMed IDs to vertex indices.  Other
+	kinds of identifiers can be indexed too, e.g., 'author' for the
+	coauthor network.
+	'''
+	def __init__(self, keys = None, vertices = None):
+		'''
+		:param keys: Dict, with a sorted string array for each kind
+		:param vertices: Dict, with the vertex of each key
+		'''
+		self.keys = {kind: np.array([], dtype = str) for kind in KINDS}
+		self.vertices = {kind: np.array([], dtype = np.int64) for kind in KINDS}
+		if keys is not None:
+			self.keys.update(keys)
+			self.vertices.update(vertices)
+
+	@classmethod
+	def from_arrays(cls, idents):
+		'''
+		:param idents: Dict, with a pair of arrays (identifiers, vertices)
+			for each kind.  Empty identifiers are dropped.  Duplicate
+			identifiers must all have the same vertex.
+		'''
+		keys = {}
+		vertices = {}
+		for kind, (strings, vertex) in idents.items():
+			strings = normalize(kind, strings)
+			present = strings != ''
+			keys[kind], first = np.unique(strings[present], return_index = True)
+			vertices[kind] = np.asarray(vertex, dtype = np.int64)[present][first]
+		return cls(keys, vertices)
+
+	def __len__(self):
+		return sum(len(keys) for keys in self.keys.values())
+
+	def lookup(self, kind, idents):
+		'''
+		:param idents: Array of identifiers
+		:return: int64 array of their vertices, with `MISSING` for the ones
+			that aren't indexed
+		'''
+		idents = normalize(kind, idents)
+		keys = self.keys.get(kind, [])
+		result = np.full(len(idents), MISSING, dtype = np.int64)
+		if len(keys) == 0:
+			return result
+		pos = np.searchsorted(keys, idents)
+		pos[pos == len(keys)] = 0
+		found = keys[pos] == idents
+		result[found] = self.vertices[kind][pos[found]]
+		return result
+
+	def add(self, kind, idents, vertices):
+		'''
+		Index identifiers that aren't indexed yet; the ones that are keep
+		their vertex
+
+		:param idents: Array of identifiers
+		:param vertices: The vertex of each
+		'''
+		idents = normalize(kind, idents)
+		vertices = np.asarray(vertices, dtype = np.int64)
+		new = (idents != '') & (self.lookup(kind, idents) == MISSING)
+		keys, first = np.unique(idents[new], return_index = True)
+		keys = np.concatenate([self.keys.get(kind, np.array([], dtype = str)), keys])
+		vertices = np.concatenate([self.vertices.get(kind,
+											np.array([], dtype = np.int64)),
+									vertices[new][first]])
+		order = np.argsort(keys, kind = 'stable')
+		self.keys[kind] = keys[order]
+		self.vertices[kind] = vertices[order]
+
+	def vertex(self, kind, ident):
+		'''
+		:return: The vertex for a single identifier, or None
+		'''
+		vertex = self.lookup(kind, [ident])[0]
+		return None if vertex == MISSING else int(vertex)
+
+	def save(self, path):
+		'''
+		Write the index to a `.npz` file
+		'''
+		arrays = {}
+		for kind in self.keys:
+			arrays[kind + '_keys'] = self.keys[kind]
+			arrays[kind + '_vertices'] = self.vertices[kind]
+		with open(path, 'wb') as writefile:
+			np.savez(writefile, **arrays)
+
+	@classmethod
+	def load(cls, path):
+		with np.load(path, allow_pickle = False) as arrays:
+			kinds = [name[:-len('_keys')] for name in arrays.files
+						if name.endswith('_keys')]
+			return cls({kind: arrays[kind + '_keys'] for kind in kinds},
+						{kind: arrays[kind + '_vertices'] for kind in kinds})
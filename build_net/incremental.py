@@ -0,0 +1,569 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental updates of the citation and coauthor networks.
+
+A full build keeps only the core components of each network.  With
+`python build_net.py --incremental`, the whole network is saved as well,
+so the next run can apply just the records that are new or changed since,
+rather than rebuilding everything.  For each network, e.g., `citenet`:
+
+	citenet.gt:  the whole network, in graph-tool's binary format
+	citenet.ids.npz:  identifier -> vertex index (see `identity.py`); Scopus
+		IDs, DOIs and PubMed IDs for the citation network, author IDs for
+		the coauthor network
+	citenet.state.npz:  a hash of the records for each Scopus ID, to tell
+		which have changed; the component file each vertex was saved in;
+		and, for the coauthor network, the author listings of each record
+
+Vertices are only ever added, so vertex numbers, and so the index, stay
+valid from one run to the next.  (A paper no longer cited, or an author no
+longer listed, is left as an isolated vertex, outside every core component.)  A changed paper's vertex gets its
+metadata and incoming citations recomputed from all of its records; the
+coauthor weights are changed by the difference between the old and new
+author listings of the changed records.  Then only the core components
+that have changed vertices, or whose vertices have changed, are extracted
+and saved again; the files of the others are kept (renumbered, if need be).
+
+The network is rebuilt from scratch instead if records have been dropped
+from the dataset, or if a new record would merge two existing vertices
+(e.g., it gives a paper already in the network under a different Scopus
+ID), or if the saved hashes were computed differently.
+
+`check_incremental.py` checks updates against builds from scratch, on
+random datasets.
+'''
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+								'..', 'scrape'))
+import paperstore
+
+import builders
+import identity
+
+GRAPH_EXT = '.gt'
+INDEX_EXT = '.ids.npz'
+STATE_EXT = '.state.npz'
+
+
+def _paths(prefix, outdir):
+	base = os.path.join(outdir, prefix)
+	return base + GRAPH_EXT, base + INDEX_EXT, base + STATE_EXT
+
+
+def _mix(x):
+	'''
+	Scramble the bits of a uint64 array (the splitmix64 finalizer)
+	'''
+	x = x ^ (x >> np.uint64(30))
+	x = x * np.uint64(0xbf58476d1ce4e5b9)
+	x = x ^ (x >> np.uint64(27))
+	x = x * np.uint64(0x94d049bb133111eb)
+	return x ^ (x >> np.uint64(31))
+
+
+def _salt(name):
+	# A fixed uint64 for each column
+	return np.uint64(int.from_bytes(name.encode('utf-8')[:8].ljust(8, b'\0'), 'little'))
+
+
+def _string_hashes(strings):
+	'''
+	:param strings: Array of strings
+	:return: A uint64 hash of each, the same whatever the width of the array
+	'''
+	strings = np.asarray(strings, dtype = str)
+	width = strings.dtype.itemsize // 4
+	if width == 0 or len(strings) == 0:
+		return np.zeros(len(strings), dtype = np.uint64)
+	codes = strings.view(np.uint32).reshape(len(strings), width).astype(np.uint64)
+	position = _mix(np.arange(1, width + 1, dtype = np.uint64))
+	# The padding after each string is all zeros, and doesn't count
+	return (_mix(codes + position) * (codes != 0)).sum(axis = 1, dtype = np.uint64)
+
+
+def _list_hashes(column, start, stop):
+	'''
+	:param column: A `paperstore.ListColumn` of strings
+	:return: A uint64 hash of the list of each paper from `start` to `stop`
+	'''
+	offsets = column.offsets[start:stop + 1]
+	values = _string_hashes(column.values[offsets[0]:offsets[-1]])
+	offsets = offsets - offsets[0]
+	lengths = np.diff(offsets)
+	position = (np.arange(len(values), dtype = np.int64) -
+				np.repeat(offsets[:-1], lengths)).astype(np.uint64)
+	# Each paper's sum is a difference of the (wrapping) running totals
+	totals = np.zeros(len(values) + 1, dtype = np.uint64)
+	np.cumsum(_mix(values + _mix(position + np.uint64(1))), out = totals[1:])
+	return _mix((totals[offsets[1:]] - totals[offsets[:-1]]) +
+				lengths.astype(np.uint64))
+
+
+HASH_VERSION = 2			# Changes whenever `record_hashes` gives different hashes
+
+
+def record_hashes(store, working):
+	'''
+	A hash of the records for each Scopus ID, computed from the column
+	arrays a chunk of papers at a time
+
+	:return: The sorted Scopus IDs of the working papers, and a uint64 hash
+		of the records with each
+	'''
+	row_hashes = np.zeros(len(store), dtype = np.uint64)
+	for start in range(0, len(store), paperstore.CHUNK_SIZE):
+		stop = min(start + paperstore.CHUNK_SIZE, len(store))
+		chunk = np.zeros(stop - start, dtype = np.uint64)
+		for name in store.columns():
+			if name in paperstore.LIST_COLUMNS:
+				hashes = _list_hashes(store.column(name), start, stop)
+			elif name in paperstore.STRING_COLUMNS:
+				hashes = _string_hashes(store.column(name)[start:stop])
+				is_json = store.json_flags(name, start, stop)
+				if is_json is not None:
+					# A JSON value and the same text as a string differ
+					hashes = hashes + is_json
+			else:
+				hashes = store.column(name)[start:stop].astype(np.int64).view(np.uint64)
+			chunk += _mix(hashes + _salt(name))
+		row_hashes[start:stop] = chunk
+	sids, inverse = np.unique(store.column('sid')[working], return_inverse = True)
+	# Order doesn't matter, and the sum wraps around
+	hashes = np.zeros(len(sids), dtype = np.uint64)
+	np.add.at(hashes, inverse, row_hashes[working])
+	return sids, hashes
+
+
+def changed_sids(state, sids, hashes):
+	'''
+	:param state: The saved state
+	:param sids, hashes: From `record_hashes`, for the dataset now
+	:return: The Scopus IDs with new or changed records, and the number of
+		Scopus IDs that have been dropped from the dataset
+	'''
+	old_sids = state['sids']
+	if len(old_sids) == 0:
+		return sids, 0
+	pos = np.searchsorted(old_sids, sids)
+	pos[pos == len(old_sids)] = 0
+	known = old_sids[pos] == sids
+	changed = ~known | (state['hashes'][pos] != hashes)
+	return sids[changed], len(old_sids) - int(known.sum())
+
+
+def update_citenet(graph, index, store, working, sids):
+	'''
+	Apply new and changed records to the citation network, in place
+
+	:param index: The network's `identity.IdentityIndex`; updated in place
+	:param sids: Scopus IDs with new or changed records
+	:return: The vertices that were added or changed, or None if the
+		records would merge existing vertices
+	'''
+	records = working[np.isin(store.column('sid')[working], sids)]
+	if len(records) == 0:
+		return np.array([], dtype = np.int64)
+	references = store.column('references', interned = True)
+	sid_strings = store.column('sid')[records]
+	ref_ints, _ = builders.list_values(references, records)
+	ref_strings = store.interner.strings('sid', ref_ints)
+	dois = identity.normalize('doi', store.column('doi')[records])
+	pmids = identity.normalize('pmid', store.column('pmid')[records])
+	resolved = identity.entities(store.column('sid', interned = True)[records],
+									ref_ints, dois, pmids)
+
+	# The existing vertex of each entity, if it has one
+	entity = np.concatenate([resolved['paper']] * 3 + [resolved['reference']])
+	found = np.concatenate([index.lookup('sid', sid_strings),
+							index.lookup('doi', dois),
+							index.lookup('pmid', pmids),
+							index.lookup('sid', ref_strings)])
+	has = found != identity.MISSING
+	pairs = np.unique(np.column_stack([entity[has], found[has]]), axis = 0)
+	if len(np.unique(pairs[:, 0])) < len(pairs):
+		return None
+	entity_vertex = np.full(resolved['n_entities'], -1, dtype = np.int64)
+	entity_vertex[pairs[:, 0]] = pairs[:, 1]
+
+	# New vertices for the rest, by first appearance
+	n_old = graph.num_vertices()
+	appearances = np.concatenate([resolved['paper'], resolved['reference']])
+	entities, first = np.unique(appearances, return_index = True)
+	new = entity_vertex[entities] == -1
+	new_entities = entities[new][np.argsort(first[new], kind = 'stable')]
+	entity_vertex[new_entities] = n_old + np.arange(len(new_entities))
+	if len(new_entities) > 0:
+		graph.add_vertex(len(new_entities))
+	paper_vertex = entity_vertex[resolved['paper']]
+	ref_vertex = entity_vertex[resolved['reference']]
+	index.add('sid', np.concatenate([sid_strings, ref_strings]),
+				np.concatenate([paper_vertex, ref_vertex]))
+	index.add('doi', dois, paper_vertex)
+	index.add('pmid', pmids, paper_vertex)
+	new_vertices = np.arange(n_old, graph.num_vertices())
+
+	# New vertices that are only cited get their Scopus ID
+	sid_property = graph.vertex_properties['sid']
+	cited, first_cite = np.unique(ref_vertex, return_index = True)
+	cited_only = (cited >= n_old) & ~np.isin(cited, paper_vertex)
+	for vertex, sid in zip(cited[cited_only].tolist(),
+							ref_strings[first_cite[cited_only]].tolist()):
+		sid_property[graph.vertex(vertex)] = sid
+
+	# Recompute the metadata and citations of the changed vertices, from
+	#  all of their records
+	affected = np.unique(paper_vertex)
+	all_vertex = index.lookup('sid', store.column('sid')[working])
+	in_affected = np.isin(all_vertex, affected)
+	vertex_records = working[in_affected]
+	record_vertex = all_vertex[in_affected]
+	n_vertices = graph.num_vertices()
+	paper, fields, core = builders.record_fields(store, vertex_records,
+													record_vertex, n_vertices)
+	vertex_sid = np.full(n_vertices, -1, dtype = np.int64)
+	vertex_sid[affected] = store.column('sid', interned = True)[paper[affected]]
+	values = builders.citenet_properties(store,
+						{'fields': fields, 'sid': vertex_sid, 'core': core},
+						affected)
+	for name, value_type in builders.CITENET_PROPERTIES:
+		prop = graph.vertex_properties[name]
+		if value_type in ('int', 'bool'):
+			prop.a[affected] = values[name]
+		else:
+			for vertex, value in zip(affected.tolist(), values[name]):
+				prop[graph.vertex(vertex)] = value
+
+	ref_ints, ref_rows = builders.list_values(references, vertex_records)
+	edges = np.column_stack([index.lookup('sid',
+								store.interner.strings('sid', ref_ints)),
+							record_vertex[ref_rows]])
+	edges = edges[(edges[:, 0] != identity.MISSING) & (edges[:, 0] != edges[:, 1])]
+	_, first_edge = np.unique(edges[:, 0] * n_vertices + edges[:, 1],
+								return_index = True)
+	edges = edges[np.sort(first_edge)]
+
+	# Replace the incoming edges of the changed vertices
+	_remove_edges(graph, lambda edges: np.isin(edges[:, 1], affected))
+	graph.add_edge_list(edges)
+	return np.union1d(affected, new_vertices)
+
+
+def _remove_edges(graph, drop):
+	'''
+	Remove edges in bulk
+
+	:param drop: Function taking an array of (source, target, edge index)
+		rows, and giving a bool array of the edges to remove
+	'''
+	edges = graph.get_edges([graph.edge_index])
+	remove = drop(edges)
+	if not remove.any():
+		return
+	keep = graph.new_edge_property('bool')
+	keep.a[:] = True
+	keep.a[edges[remove, 2]] = False
+	graph.set_edge_filter(keep)
+	graph.purge_edges()
+	graph.set_edge_filter(None)
+
+
+def _author_vertices(store, index, ints):
+	'''
+	:param ints: Interned author IDs
+	:return: Their vertices in the coauthor network
+	'''
+	keys, inverse = np.unique(ints, return_inverse = True)
+	return index.lookup('author', store.interner.strings('author', keys))[inverse]
+
+
+def author_listings(store, working, index, sids):
+	'''
+	The author listings of each record, as vertices, to save with the state
+
+	:param sids: Sorted Scopus IDs of the working papers
+	'''
+	authors = store.column('authors', interned = True)
+	ints, _ = builders.list_values(authors, working)
+	offsets = np.zeros(len(working) + 1, dtype = np.int64)
+	np.cumsum(authors.lengths()[working], out = offsets[1:])
+	return {'row_group': np.searchsorted(sids, store.column('sid')[working]),
+			'author_offsets': offsets,
+			'author_vertices': _author_vertices(store, index, ints)}
+
+
+def update_autnet(graph, index, state, store, working, sids, fractional = False):
+	'''
+	Apply new and changed records to the coauthor network, in place
+
+	:param index: The network's `identity.IdentityIndex`; updated in place
+	:param state: The saved state, with the old author listings
+	:param sids: Scopus IDs with new or changed records
+	:param fractional: Update the 'fractional' edge weights, too
+	:return: The vertices that were added or changed
+	'''
+	authors = store.column('authors', interned = True)
+	records = working[np.isin(store.column('sid')[working], sids)]
+	new_ints, new_rows = builders.list_values(authors, records)
+	new_strings = store.interner.strings('author', new_ints)
+
+	# New vertices for new authors, by first appearance
+	n_old = graph.num_vertices()
+	missing = index.lookup('author', new_strings) == identity.MISSING
+	keys, first = np.unique(new_strings[missing], return_index = True)
+	keys = keys[np.argsort(first, kind = 'stable')]
+	index.add('author', keys, n_old + np.arange(len(keys)))
+	if len(keys) > 0:
+		graph.add_vertex(len(keys))
+		id_property = graph.vertex_properties['id']
+		for vertex, key in enumerate(keys.tolist(), n_old):
+			id_property[graph.vertex(vertex)] = key
+	n_vertices = graph.num_vertices()
+
+	# The change in the weights is the difference between the incidence
+	#  matrices of the new records and of the old records with the same
+	#  Scopus IDs
+	new_incidence = builders.incidence_matrix(new_rows,
+									index.lookup('author', new_strings),
+									len(records), n_vertices)
+	old_rows = np.flatnonzero(np.isin(state['row_group'],
+										np.flatnonzero(np.isin(state['sids'], sids))))
+	old_vertices, old_row_pos = builders.list_values(
+									paperstore.ListColumn(state['author_offsets'],
+														state['author_vertices']),
+									old_rows)
+	old_incidence = builders.incidence_matrix(old_row_pos, old_vertices,
+												len(old_rows), n_vertices)
+	delta = (builders.coauthor_weights(new_incidence) -
+				builders.coauthor_weights(old_incidence))
+	changed = abs(delta)
+	if fractional:
+		fractional_delta = (builders.fractional_weights(new_incidence) -
+							builders.fractional_weights(old_incidence))
+		changed = changed + abs(fractional_delta)
+	changed.eliminate_zeros()
+	sources, targets, _ = builders.upper_entries(changed)
+	def entries(matrix):
+		# Indexing a sparse matrix with empty arrays doesn't give an empty array
+		if len(sources) == 0:
+			return np.zeros(0)
+		return np.asarray(matrix[sources, targets], dtype = float).ravel()
+	weight_delta = entries(delta)
+	if fractional:
+		fractional_delta = entries(fractional_delta)
+
+	# Change the weights of the pairs that already have an edge, and add
+	#  the rest with their weights, matching pairs by `low * n + high`
+	weight = graph.edge_properties['num_papers']
+	weights = [weight]
+	deltas = [weight_delta]
+	if fractional:
+		weights += [graph.edge_properties['fractional']]
+		deltas += [fractional_delta]
+	edges = graph.get_edges([graph.edge_index])
+	keys = (np.minimum(edges[:, 0], edges[:, 1]) * n_vertices +
+			np.maximum(edges[:, 0], edges[:, 1]))
+	order = np.argsort(keys)
+	pair_keys = sources.astype(np.int64) * n_vertices + targets
+	exists = np.zeros(len(pair_keys), dtype = bool)
+	if len(keys) > 0:
+		pos = np.searchsorted(keys, pair_keys, sorter = order)
+		pos[pos == len(keys)] = 0
+		exists = keys[order[pos]] == pair_keys
+		edge_index = edges[order[pos[exists]], 2]
+		for prop, prop_delta in zip(weights, deltas):
+			prop.a[edge_index] += prop_delta[exists]
+	graph.add_edge_list(np.column_stack([sources[~exists], targets[~exists]] +
+										[prop_delta[~exists] for prop_delta in deltas]),
+						eprops = weights)
+	# Pairs that no longer have any papers together
+	_remove_edges(graph, lambda edges: weight.a[edges[:, 2]] <= 0)
+
+	# The vertex properties are cheap to recompute for every author
+	ints, rows = builders.list_values(authors, working)
+	vertices = _author_vertices(store, index, ints)
+	num_papers = np.bincount(vertices, minlength = n_vertices)
+	if store.has_column('core'):
+		paper_core = store.column('core')[working].astype(float)
+	else:
+		paper_core = np.zeros(len(working))
+	core = np.bincount(vertices, weights = paper_core[rows],
+						minlength = n_vertices) > 0
+	num_papers_property = graph.vertex_properties['num_papers']
+	core_property = graph.vertex_properties['core']
+	props_changed = np.flatnonzero((num_papers_property.a != num_papers) |
+									(core_property.a.astype(bool) != core))
+	num_papers_property.a[:] = num_papers
+	core_property.a[:] = core
+	return np.unique(np.concatenate([np.arange(n_old, n_vertices), sources,
+										targets, props_changed]))
+
+
+def save_components(graph, state, touched, prefix, suffix, outdir = '.'):
+	'''
+	Save the core components of a network, extracting only those that have
+	changed, and keeping the files of the rest
+
+	:param state: The saved state, or {} if there isn't one
+	:param touched: Vertices added or changed since the state was saved, or
+		None to extract every component
+	:return: The file names, and the file of each vertex (-1 for none)
+	'''
+	import graph_tool.topology as topo
+
+	def filename(i):
+		return os.path.join(outdir, prefix + str(i) + suffix)
+
+	print('Extracting core connected components')
+	labels = topo.label_components(graph, directed = False)[0].a
+	core = graph.vertex_properties['core'].a.astype(bool)
+	core_labels = builders.core_component_labels(labels, core)
+	print(str(len(core_labels)) + ' components with core set members')
+	file_of_label = np.full(labels.max() + 1 if len(labels) > 0 else 0, -1,
+							dtype = np.int64)
+	file_of_label[core_labels] = np.arange(len(core_labels))
+	component = file_of_label[labels]
+	n_files = len(core_labels)
+
+	# An old file can be kept if its component has no touched vertices, and
+	#  still has exactly the vertices that were saved in it
+	reuse = np.full(n_files, -1, dtype = np.int64)
+	n_old_files = int(state['n_files']) if 'n_files' in state else 0
+	if (touched is not None and 'component' in state and
+			str(state['suffix']) == suffix):
+		old = np.full(len(component), -1, dtype = np.int64)
+		old[:len(state['component'])] = state['component']
+		in_file = component >= 0
+		is_touched = np.zeros(len(component), dtype = bool)
+		is_touched[touched] = True
+		any_touched = np.bincount(component[in_file], weights = is_touched[in_file],
+									minlength = n_files) > 0
+		low = np.full(n_files, np.iinfo(np.int64).max, dtype = np.int64)
+		high = np.full(n_files, -1, dtype = np.int64)
+		np.minimum.at(low, component[in_file], old[in_file])
+		np.maximum.at(high, component[in_file], old[in_file])
+		size = np.bincount(component[in_file], minlength = n_files)
+		old_size = np.bincount(old[old >= 0], minlength = n_old_files)
+		same = (~any_touched & (low == high) & (low >= 0))
+		same[same] &= size[same] == old_size[low[same]]
+		reuse[same] = low[same]
+		reuse[same] = [f if os.path.isfile(filename(f)) else -1
+						for f in reuse[same].tolist()]
+	print(str(int((reuse >= 0).sum())) + ' components unchanged')
+
+	# Set aside the files being kept, and clear out the rest
+	kept = set(reuse[reuse >= 0].tolist())
+	for f in kept:
+		os.replace(filename(f), filename(f) + '.keep')
+	for f in range(n_old_files):
+		if f not in kept and os.path.isfile(filename(f)):
+			os.remove(filename(f))
+	outfiles = []
+	for i, label in enumerate(core_labels.tolist()):
+		outfiles += [filename(i)]
+		if reuse[i] >= 0:
+			os.replace(filename(reuse[i]) + '.keep', outfiles[-1])
+		else:
+			builders.extract_component(graph, labels, label).save(outfiles[-1])
+	return outfiles, component
+
+
+def load_network(prefix, outdir = '.'):
+	'''
+	:return: A saved network, its index, and its state, or None if there
+		isn't one
+	'''
+	paths = _paths(prefix, outdir)
+	if not all(os.path.isfile(path) for path in paths):
+		return None
+	import graph_tool as gt
+
+	graph_path, index_path, state_path = paths
+	graph = gt.load_graph(graph_path)
+	index = identity.IdentityIndex.load(index_path)
+	with np.load(state_path, allow_pickle = False) as arrays:
+		state = {name: arrays[name] for name in arrays.files}
+	return graph, index, state
+
+
+def save_network(graph, index, state, prefix, outdir = '.'):
+	graph_path, index_path, state_path = _paths(prefix, outdir)
+	graph.save(graph_path)
+	index.save(index_path)
+	with open(state_path + '.tmp', 'wb') as writefile:
+		np.savez(writefile, **state)
+	os.replace(state_path + '.tmp', state_path)
+
+
+def _build(network, store, working, fractional):
+	'''
+	Build a network from scratch, with its index
+	'''
+	print('Building ' + network + ' from scratch')
+	if network == 'citenet':
+		layout = builders.citenet_arrays(store, working)
+		return builders.build_citenet(store, working, layout), layout['index']
+	layout = builders.autnet_arrays(store, working, fractional)
+	index = identity.IdentityIndex.from_arrays({'author':
+				(store.interner.strings('author', layout['author']),
+					np.arange(layout['n_vertices']))})
+	return builders.build_autnet(store, working, fractional, layout), index
+
+
+def update_network(network, store, working, prefix, suffix, outdir = '.',
+					fractional = False):
+	'''
+	Update a saved network with the new and changed records, building it
+	from scratch if there isn't one, then save it and its core components
+
+	:param network: 'citenet' or 'autnet'
+	:param prefix, suffix: For the component files, e.g., 'citenet' and
+		'.graphml'; the whole network is saved as `prefix + GRAPH_EXT`
+	:param fractional: For the coauthor network; see `builders.autnet_arrays`
+	:return: The component file names
+	'''
+	sids, hashes = record_hashes(store, working)
+	saved = load_network(prefix, outdir)
+	state = {}
+	touched = None
+	if saved is not None:
+		graph, index, state = saved
+		changed, dropped = changed_sids(state, sids, hashes)
+		reason = None
+		if int(state.get('hash_version', 1)) != HASH_VERSION:
+			reason = 'the records were hashed differently'
+		elif dropped > 0:
+			reason = str(dropped) + ' Scopus IDs dropped from the dataset'
+		elif network == 'autnet' and bool(state['fractional']) != fractional:
+			reason = 'fractional counting changed'
+		else:
+			print(network + ':  ' + str(len(changed)) +
+					' Scopus IDs with new or changed records')
+			if network == 'citenet':
+				touched = update_citenet(graph, index, store, working, changed)
+				if touched is None:
+					reason = 'new records merge papers already in the network'
+			else:
+				touched = update_autnet(graph, index, state, store, working,
+										changed, fractional)
+		if reason is not None:
+			print('Rebuilding ' + network + ':  ' + reason)
+			saved = None
+			touched = None
+	if saved is None:
+		graph, index = _build(network, store, working, fractional)
+
+	outfiles, component = save_components(graph, state, touched, prefix,
+											suffix, outdir)
+	state = {'sids': sids, 'hashes': hashes, 'component': component,
+				'n_files': np.array(len(outfiles)), 'suffix': np.array(suffix),
+				'fractional': np.array(fractional),
+				'hash_version': np.array(HASH_VERSION)}
+	if network == 'autnet':
+		state.update(author_listings(store, working, index, sids))
+	save_network(graph, index, state, prefix, outdir)
+	return outfiles
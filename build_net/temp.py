@@ -1,5 +1,13 @@
-import json
+import os
 import pandas
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+								'..', 'scrape'))
+import paperstore
+
+# Either `papers.json` or a columnar store, `papers.npz`
+papers_file = 'papers.json'
 
 data = pandas.read_excel('project leads.xlsx')
 #print(data[['Scopus ID', 'Topic']])
@@ -8,8 +16,7 @@ sid_topic_df = data[['Scopus ID', 'Topic']].to_dict(orient = 'records')
 sid_topic = {str(entry['Scopus ID']): entry['Topic'] for entry in sid_topic_df}
 #print(sid_topic)
 
-with open('papers.json') as readfile:
-	papers = json.load(readfile)
+papers = paperstore.load_papers(papers_file, columns = ('core', 'authors'))
 
 core = [paper for paper in papers if paper['core']]
 print(len(core))
@@ -1,6 +1,15 @@
 import graph_tool as gt
 import json
+import os
 from random import sample
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+								'..', 'scrape'))
+from interning import Interner, interning_path
+
+# The paper data the network was built from; its interning table is shared
+papers_infile = 'papers.json'
 
 net = gt.load_graph('citenet0.out.gt')
 
@@ -15,12 +24,19 @@ boundary_pmap = net.new_vp('bool',
 boundary = [vertex for vertex in net.vertices() if boundary_pmap[vertex]]
 
 core_dois = [net.vp['doi'][vertex] for vertex in core]
-core_sids = [net.vp['sid'][vertex] for vertex in core]
+# Work with the SIDs as ints from the interning table saved with the paper 
+#  data.  Interning the core SIDs only assigns new ints (in memory) if 
+#  the table is missing or out of date.  
+ids = Interner(interning_path(papers_infile))
+core_sids = ids.intern_many('sid', [net.vp['sid'][vertex] for vertex in core])
+core_by_sid = dict(zip(core_sids.tolist(), core))
 
 core_refs = {}
 for paper in boundary:
-	core_ref_sids = [sid for sid in net.vp['references'][paper] if sid in core_sids]
-	core_ref_papers = [paper for paper in core if net.vp['sid'][paper] in core_ref_sids]
+	# References that were never interned can't be core SIDs
+	ref_sids = ids.lookup_ids('sid', net.vp['references'][paper]).tolist()
+	core_ref_papers = [core_by_sid[sid] for sid in dict.fromkeys(ref_sids) 
+							if sid in core_by_sid]
 	core_ref_dois = {net.vp['doi'][paper]: 0 for paper in core_ref_papers}
 
 	core_refs[net.vp['doi'][paper]] = core_ref_dois
@@ -4,199 +4,717 @@ This module allows us to break the process of retrieving metadata using `scrape`
 across several batch sessions.  The retrieval function is abstracted
 as the `retrieve` parameter in `run_batch`, and retrieved data are saved 
 periodically for some basic error handling.  
+
+Retrieved data are appended to a JSON Lines log, one record per item, 
+rather than rewriting all of the data at every checkpoint.  The log is 
+flushed and fsync'd every `CHECKPOINT_LEN` items.  Each record notes which 
+item it came from, so replaying the log tells us which items are still 
+pending, even after a crash.  A small index of the logged items, 
+`DONE_FILENAME`, lets us find the pending items without decoding the data.  
 '''
 
 import os
 import json
+import threading
+import time
+
+import metrics
+from workqueue import LeaseTable, WorkQueue
 
-BATCH_FOLDER = 'batch'			# Folder, in cwd, to store batch data
+BATCH_FOLDER = 'batch'			# Default folder, in cwd, to store batch data
 BATCH_FILENAME = 'batch.json'	# File that holds the list of items to be retrieved
-OUTPUT_FILENAME = 'data.json'	# File that holds the retrieved data
+LOG_FILENAME = 'data.jsonl'		# Append-only log of the retrieved data
+OUTPUT_FILENAME = 'data.json'	# Retrieved data, as written by older versions
+DONE_FILENAME = 'done.jsonl'	# Index of the items in the log
 
 MAX_RUN_LEN = 17000				# Maximum number of items to retrieve w/ each run
+CHECKPOINT_LEN = 1000			# Number of items between checkpoints
+
+LEASE_SIZE = 50					# Items leased to a worker at a time, in parallel runs
+LEASE_TIMEOUT = 10*60			# Seconds before an unrenewed lease expires
 
 
 class BatchError(Exception):
 	pass
 
 
-def exists_batch():
+def exists_batch(folder = None):
 	'''
 	Test for an active (incomplete) batch
 	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
 	:return: True iff a batch file exists in the batch folder
 	'''
-	return(os.access(BATCH_FOLDER + '/' + BATCH_FILENAME, os.F_OK))
+	if folder is None:
+		folder = BATCH_FOLDER
+	return(WorkQueue.exists(os.path.join(folder, BATCH_FILENAME)))
+
+
+def exists_data(folder = None):
+	'''
+	Test for retrieved data that hasn't been cleaned up yet
+	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
+	:return: True iff a log or older data file exists in the batch folder
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	return(os.access(os.path.join(folder, LOG_FILENAME), os.F_OK) or 
+			os.access(os.path.join(folder, OUTPUT_FILENAME), os.F_OK))
+
+
+def _replay_log(log_path):
+	'''
+	Read the log, dropping a partly-written final record left by a crash.  
+	
+	:param log_path: Path to the log file
+	
+	:return: A list of the log records, as dicts with keys 
+		'item': The retrieved item, or None for data migrated from `OUTPUT_FILENAME`
+		'data': The retrieved data, or None if the item was skipped
+	'''
+	records = []
+	if not os.access(log_path, os.F_OK):
+		return records
+	good_len = 0				# Length of the log up to the last complete record
+	with open(log_path, 'rb') as readfile:
+		for line in readfile:
+			if not line.endswith(b'\n'):
+				# The last write didn't finish
+				break
+			try:
+				records += [json.loads(line.decode('utf-8'))]
+			except ValueError:
+				break
+			good_len += len(line)
+	if good_len < os.path.getsize(log_path):
+		print('Dropping incomplete record at the end of the log')
+		with open(log_path, 'r+b') as logfile:
+			logfile.truncate(good_len)
+	return records
+
+
+def _log_length(log_path):
+	'''
+	Length of the log up to the last complete record, dropping a 
+	partly-written final record left by a crash.  
+	
+	:param log_path: Path to the log file
+	
+	:return: The length in bytes, or 0 if there's no log
+	'''
+	if not os.access(log_path, os.F_OK):
+		return 0
+	with open(log_path, 'r+b') as logfile:
+		end = logfile.seek(0, os.SEEK_END)
+		good_len = end
+		# Look back for the end of the last complete record
+		while good_len > 0:
+			start = max(good_len - 4096, 0)
+			logfile.seek(start)
+			block = logfile.read(good_len - start)
+			newline = block.rfind(b'\n')
+			if newline >= 0:
+				good_len = start + newline + 1
+				break
+			good_len = start
+		if good_len < end:
+			print('Dropping incomplete record at the end of the log')
+			logfile.truncate(good_len)
+	return good_len
+
+
+def _index_entry(item, has_data, log_len):
+	'''
+	A line of `DONE_FILENAME`:  the item, whether it has data, and the 
+	length of the log through its record
+	'''
+	return json.dumps([item, has_data, log_len]) + '\n'
+
+
+class _Log:
+	'''
+	Appends records to the log, and entries for them to the index.  
+	'''
+	def __init__(self, folder):
+		'''
+		:param folder: The batch folder; the log has to have been checked 
+			with `_log_items` first
+		'''
+		self.log_len = _log_length(os.path.join(folder, LOG_FILENAME))
+		# No newline translation, so the lengths stay in bytes
+		self._logfile = open(os.path.join(folder, LOG_FILENAME), 'a', newline = '')
+		self._donefile = open(os.path.join(folder, DONE_FILENAME), 'a')
+	
+	def record(self, item, new_data):
+		line = json.dumps({'item': item, 'data': new_data}) + '\n'
+		self._logfile.write(line)
+		# json.dumps escapes non-ASCII, so characters are bytes
+		self.log_len += len(line)
+		self._donefile.write(_index_entry(item, new_data is not None, self.log_len))
+	
+	def sync(self):
+		'''
+		Make sure everything so far is on the disk.  The log goes first, 
+		but `_log_items` checks the index against it anyways.  
+		'''
+		for writefile in (self._logfile, self._donefile):
+			writefile.flush()
+			os.fsync(writefile.fileno())
+	
+	def close(self):
+		self.sync()
+		self._logfile.close()
+		self._donefile.close()
+
+
+def _log_items(folder):
+	'''
+	Read the items recorded in the log, without decoding their data.  
+	
+	Entries of `DONE_FILENAME` count only if the log reaches as far as their 
+	records; the rest are dropped.  Records past the last entry, e.g. from 
+	before the index existed, are read from the log itself, up to their item, 
+	and added to the index.  
+	
+	:param folder: The batch folder
+	
+	:return: A list of `(item, has_data)` pairs, in log order
+	'''
+	log_path = os.path.join(folder, LOG_FILENAME)
+	done_path = os.path.join(folder, DONE_FILENAME)
+	log_len = _log_length(log_path)
+	items = []
+	indexed_len = 0				# Length of the log covered by the index
+	if os.access(done_path, os.F_OK):
+		good_len = 0			# Length of the index up to the last good entry
+		with open(done_path, 'rb') as readfile:
+			for line in readfile:
+				if not line.endswith(b'\n'):
+					break
+				try:
+					item, has_data, end = json.loads(line.decode('utf-8'))
+				except ValueError:
+					break
+				if end > log_len:
+					# The crash came before the record reached the disk
+					break
+				items += [(item, has_data)]
+				indexed_len = end
+				good_len += len(line)
+		if good_len < os.path.getsize(done_path):
+			with open(done_path, 'r+b') as donefile:
+				donefile.truncate(good_len)
+	if indexed_len == log_len:
+		return items
+	
+	# Records are written as `{"item": ..., "data": ...}`, so the item 
+	#  can be decoded on its own
+	prefix = '{"item": '
+	decoder = json.JSONDecoder()
+	with open(log_path, 'rb') as readfile, open(done_path, 'a') as donefile:
+		readfile.seek(indexed_len)
+		for line in readfile:
+			text = line.decode('utf-8')
+			if text.startswith(prefix):
+				item = decoder.raw_decode(text, len(prefix))[0]
+				has_data = not text.rstrip().endswith(', "data": null}')
+			else:
+				record = json.loads(text)
+				item, has_data = record['item'], record['data'] is not None
+			items += [(item, has_data)]
+			indexed_len += len(line)
+			donefile.write(_index_entry(item, has_data, indexed_len))
+	return items
+
+
+def _migrate_output(folder):
+	'''
+	Convert a data file written by older versions of this module into a log.  
+	Items already retrieved had been removed from the batch file, so 
+	the migrated records don't need to name their items.  
+	
+	:param folder: The batch folder
+	'''
+	output_path = os.path.join(folder, OUTPUT_FILENAME)
+	log_path = os.path.join(folder, LOG_FILENAME)
+	if not os.access(output_path, os.F_OK) or os.access(log_path, os.F_OK):
+		return
+	print('Converting ' + OUTPUT_FILENAME + ' to ' + LOG_FILENAME)
+	with open(output_path, 'r') as readfile:
+		data = json.load(readfile)
+	with open(log_path + '.tmp', 'w') as writefile:
+		for entry in data:
+			writefile.write(json.dumps({'item': None, 'data': entry}) + '\n')
+		writefile.flush()
+		os.fsync(writefile.fileno())
+	os.replace(log_path + '.tmp', log_path)
+	os.remove(output_path)
+
+
+def _load_queue(folder, items = None):
+	'''
+	Load the queue of pending items:  the batch file, minus the items 
+	with a record in the log
+	
+	:param folder: The batch folder
+	:param items: The items in the log, if they've already been read
+	
+	:return: A `WorkQueue`
+	'''
+	try:
+		queue = WorkQueue.load(os.path.join(folder, BATCH_FILENAME))
+	except ValueError:
+		# item_list should be a list of DOIs or other ID numbers
+		raise BatchError('Batch file does not read as list') 
+	if items is None:
+		_migrate_output(folder)
+		items = [item for item, _ in _log_items(folder)]
+	for item in items:
+		queue.discard(item)
+	return queue
+
+
+def pending_items(folder = None):
+	'''
+	Read the items still to be retrieved in the active batch
+	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
+	:return: The list of items
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	return(list(_load_queue(folder)))
+
+
+def compact_batch(folder = None):
+	'''
+	Compact the batch files:  rewrite the log without duplicate records for 
+	the same item (keeping the latest), and rewrite the batch file with just 
+	the pending items.  This isn't needed for correctness, only to keep the 
+	files small.  
+	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
+	:return: Number of pending items
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	_migrate_output(folder)
+	log_path = os.path.join(folder, LOG_FILENAME)
+	records = _replay_log(log_path)
+	# Keep the latest record for each item, in the order items were first retrieved
+	latest = {}
+	unnamed = []
+	for record in records:
+		if record['item'] is None:
+			unnamed += [record]
+		else:
+			latest[json.dumps(record['item'])] = record
+	with open(log_path + '.tmp', 'w') as writefile:
+		for record in unnamed + list(latest.values()):
+			writefile.write(json.dumps(record) + '\n')
+		writefile.flush()
+		os.fsync(writefile.fileno())
+	# The index no longer matches; `_log_items` rebuilds it from the new log
+	if os.access(os.path.join(folder, DONE_FILENAME), os.F_OK):
+		os.remove(os.path.join(folder, DONE_FILENAME))
+	os.replace(log_path + '.tmp', log_path)
+	
+	if not exists_batch(folder):
+		return 0
+	queue = _load_queue(folder, [record['item'] for record in records])
+	queue.save(os.path.join(folder, BATCH_FILENAME))
+	return len(queue)
 
 
-def set_batch(item_list):
+def set_batch(item_list, folder = None):
 	'''
 	Set up a new batch.  
 	
 	:param list: List of items to retrieve
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
 	
 	:return: True if the batch was set up correctly
 	'''
+	if folder is None:
+		folder = BATCH_FOLDER
 	# Check whether the batch folder exists and we have write access
-	if not os.access(BATCH_FOLDER, os.F_OK):
-		os.mkdir(BATCH_FOLDER)
-	if not os.access(BATCH_FOLDER, os.W_OK): 
+	if not os.access(folder, os.F_OK):
+		os.mkdir(folder)
+	if not os.access(folder, os.W_OK): 
 		raise BatchError('No permission to write to batch folder')
 		
-	# Save the current working directory, to restore it later
-	original_wd = os.getcwd()
-	# Move down into the batch folder
-	os.chdir(BATCH_FOLDER)
-		
 	# Check that we're not overwriting anything
-	if os.access(BATCH_FILENAME, os.F_OK):
+	if exists_batch(folder):
 		raise BatchError('Batch file already exists')
-	if os.access(OUTPUT_FILENAME, os.F_OK):
+	if (os.access(os.path.join(folder, OUTPUT_FILENAME), os.F_OK) or 
+			os.access(os.path.join(folder, LOG_FILENAME), os.F_OK)):
 		raise BatchError('Output file already exists')
 
-	# Write the list of items into the batch file
-	with open(BATCH_FILENAME, 'w') as writefile:
-		json.dump(item_list, writefile)
-	# Write an empty list into the data file
-	with open(OUTPUT_FILENAME, 'w') as writefile:
-		json.dump([], writefile)
+	# Write the items into the batch file, dropping any duplicates
+	WorkQueue(item_list).save(os.path.join(folder, BATCH_FILENAME))
+	# Start an empty log and index
+	open(os.path.join(folder, LOG_FILENAME), 'w').close()
+	open(os.path.join(folder, DONE_FILENAME), 'w').close()
 	
-	# Reset the working directory and return that everything went okay
-	os.chdir(original_wd)
+	# Return that everything went okay
 	return True
 
 
-def run_batch(retrieve):
+def _retrieve_items(retrieve, items, chunk_size = None):
 	'''
-	Run a session of the batch. 
+	Call the retrieval function on each item, or on chunks of items. 
 	
 	:param retrieve: The function used to retrieve the data
+	:param items: List of items to retrieve
+	:param chunk_size: If None, `retrieve` takes a single item and returns 
+		its data.  Otherwise, `retrieve` takes a list of up to `chunk_size` 
+		items and returns a dict with the items as keys and their data as 
+		values; items missing from the dict count as not found.  
 	
-	:return: True iff we reached the end of the run without errors
+	:return: A generator of `(item, data)` pairs, in the order of `items`, 
+		with None as the data for empty items
 	'''
-	# Check whether the batch folder exists and we have write access
-	if not os.access(BATCH_FOLDER, os.F_OK):
+	if chunk_size is None:
+		for item in items:
+			if item == '':
+				yield item, None
+			else:
+				yield item, retrieve(item)
+		return
+	for start in range(0, len(items), chunk_size):
+		chunk = items[start:start + chunk_size]
+		chunk_data = retrieve([item for item in chunk if item != ''])
+		for item in chunk:
+			if item == '':
+				yield item, None
+			else:
+				# Missing items are treated like `Resource not found`
+				yield item, chunk_data.get(item, {'doi': '', 'sid': ''})
+
+
+def _clean_data(item, new_data):
+	'''
+	Decide what to record in the log for an item
+	
+	:return: The data to record, or None if the item is to be discarded
+	'''
+	# Skip empty items
+	if item == '':
+		print('Skipped empty item')
+		return None
+	# The retrieve functions in scrape return empty metadata if 
+	#  the server returns a `Resource not found` error
+	#  If both DOI and SID are empty, this means we don't have a way to 
+	#  point at this entry anyways, so go ahead and discard it. 
+	if new_data['doi'] == '' and new_data['sid'] == '':
+		return None
+	if (('references' not in new_data) or 
+			(new_data['references'] == '') or 
+			(new_data['references'] == [])):
+		#input('Empty reference list. Do anything except Ctrl-C to continue.')	
+		print('\t\t', 'Empty reference list')
+	return new_data
+
+
+def _check_folder(folder):
+	'''
+	Check that the batch folder exists, we can write to it, and there's 
+	an active batch
+	'''
+	if not os.access(folder, os.F_OK):
 		raise BatchError('Batch folder does not exist')
-	if not os.access(BATCH_FOLDER, os.W_OK): 
+	if not os.access(folder, os.W_OK): 
 		raise BatchError('No permission to write to batch folder')
-	# Check whether there's an active batch
-	if not exists_batch():
+	if not exists_batch(folder):
 		raise BatchError('No active batch')
+
+
+def run_batch(retrieve, chunk_size = None, max_items = None, folder = None):
+	'''
+	Run a session of the batch. 
 	
-	# Save the current working directory, to restore it later
-	original_wd = os.getcwd()
-	# Move down into the batch folder
-	os.chdir(BATCH_FOLDER)
-	
-	# Read the item and data list
-	with open(BATCH_FILENAME, 'r') as readfile:
-		item_list = json.load(readfile)
-		if type(item_list) is not list:
-			# item_list should be a list of DOIs or other ID numbers
-			raise BatchError('Batch file does not read as list') 
-	with open(OUTPUT_FILENAME, 'r') as readfile:
-		data = json.load(readfile)
-	# Make a backup of the data file
-	with open(OUTPUT_FILENAME + '.bak', 'w') as writefile:
-		json.dump(data, writefile)
+	:param retrieve: The function used to retrieve the data
+	:param chunk_size: If given, `retrieve` handles a list of up to this 
+		many items at a time, e.g., `scrape.search_meta_by_scopus`.  
+		See `_retrieve_items`.  
+	:param max_items: Maximum number of items to retrieve on this run; 
+		defaults to `MAX_RUN_LEN`.  See `scheduler.py` to set this from the 
+		remaining API quota.  
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
+	:return: True iff we reached the end of the run without errors
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	_check_folder(folder)
+	
+	# Bring data files from older versions up to date
+	_migrate_output(folder)
+	
+	# Load the queue of items, checking the log to see what's already done
+	items = _log_items(folder)
+	n_data = sum(1 for _, has_data in items if has_data)
+	queue = _load_queue(folder, [item for item, _ in items])
+	del items
 
-	print('Total items to retrieve: ' + str(len(item_list)))
+	print('Total items to retrieve: ' + str(len(queue)))
 		
 	# Grab the items that we'll retrieve on this run
-	this_run = item_list[:MAX_RUN_LEN]
+	if max_items is None:
+		max_items = MAX_RUN_LEN
+	this_run = queue.peek(max_items)
 	print('Items to retrieve on this run: ' + str(len(this_run)))
 	
+	log = _Log(folder)
+	n_retrieved = 0						# Number of items retrieved on this run
+	# Throughput, latency, and ETA; see `metrics.py`
+	run_metrics = metrics.BatchMetrics(folder, len(queue))
+	metrics.activate(run_metrics)
 	try:
-		temp_data = []					# Container for the newly retrieved data
-		retrieved = []					# Container for the list of items successfully retrieved
-		for item in this_run:
-			# Skip empty items
-			if item == '':
-				print('Skipped empty item')
-				retrieved += [item]
-				continue
-			# Retrieve the item's data
-			new_data = retrieve(item)
-			# The retrieve functions in scrape return empty metadata if 
-			#  the server returns a `Resource not found` error
-			#  If both DOI and SID are empty, this means we don't have a way to 
-			#  point at this entry anyways, so go ahead and discard it. 
-			if new_data['doi'] == '' and new_data['sid'] == '':
-				retrieved += [item]
-				continue
-			if (('references' not in new_data) or 
-					(new_data['references'] == '') or 
-					(new_data['references'] == [])):
-				#input('Empty reference list. Do anything except Ctrl-C to continue.')	
-				print('\t\t', 'Empty reference list')
-			# Add it to our temporary container
-			temp_data += [new_data]
-			# Note that we retrieved it successfully
-			retrieved += [item]
+		since_checkpoint = 0
+		for item, new_data in _retrieve_items(retrieve, this_run, chunk_size):
+			new_data = _clean_data(item, new_data)
+			# Add it to the log, noting that we retrieved it
+			log.record(item, new_data)
+			queue.discard(item)
+			n_retrieved += 1
+			run_metrics.item_done(discarded = new_data is None)
+			if new_data is not None:
+				n_data += 1
 			# Print a count for the user
-			if len(retrieved) % 50 == 0:
-				print(len(data) + len(retrieved))
-			if len(retrieved) >= 1000:
-				# Add temp_data to data
-				data += temp_data
-				# Remove retrieved items from item_list
-				item_list = [item for item in item_list if item not in retrieved]
-				# Write both to the disk
-				with open(OUTPUT_FILENAME, 'w') as writefile:
-					json.dump(data, writefile)
-				with open(BATCH_FILENAME, 'w') as writefile:
-					json.dump(item_list, writefile)
+			if n_retrieved % 50 == 0:
+				print(str(n_data) + '\t' + run_metrics.summary())
+			since_checkpoint += 1
+			if since_checkpoint >= CHECKPOINT_LEN:
+				# Make sure everything so far is on the disk
+				with metrics.timer('checkpoint'):
+					log.sync()
 				print('Saved retrieved data')
 				print('Continuing batch run')
-				temp_data = []
-				retrieved = []
+				since_checkpoint = 0
+	except Exception:
+		run_metrics.inc('errors')
+		raise
 	finally:
-		# In case of error: 
-		# Add temp_data to data
-		data += temp_data
-		# Remove retrieved items from item_list
-		item_list = [item for item in item_list if item not in retrieved]
-		# Write both to the disk
-		# Data is the easy one
-		with open(OUTPUT_FILENAME, 'w') as writefile:
-			json.dump(data, writefile)
-		# For the item list, check whether the list is empty
-		if item_list != []:
-			with open(BATCH_FILENAME, 'w') as writefile:
-				json.dump(item_list, writefile)
-		else:
-			os.remove(BATCH_FILENAME)
+		# In case of error, too:  
+		# Make sure the log is on the disk
+		log.close()
+		run_metrics.export()
+		metrics.activate(None)
+		# If everything's been retrieved, the batch is finished
+		if len(queue) == 0:
+			os.remove(os.path.join(folder, BATCH_FILENAME))
 		print('Saved retrieved data')
-		# Reset the working directory
-		os.chdir(original_wd)
 
 	# Return that everything went okay
 	print('Finished batch run')
 	return True
 
+class _LogWriter:
+	'''
+	Merges the results of several workers into the log, one record per item.  
+	A second result for the same item (e.g., from a worker whose lease 
+	expired) is dropped.  
+	'''
+	def __init__(self, folder, queue, run_metrics):
+		'''
+		:param folder: The batch folder
+		:param queue: `WorkQueue` of all pending items; emptied as items are recorded
+		:param run_metrics: The session's `metrics.BatchMetrics`
+		'''
+		self.queue = queue
+		self.metrics = run_metrics
+		self.n_retrieved = 0
+		self._since_checkpoint = 0
+		self._done = WorkQueue()
+		self._lock = threading.Lock()
+		self._log = _Log(folder)
+
+	def record(self, item, new_data):
+		'''
+		:return: True iff this was the first record for the item
+		'''
+		with self._lock:
+			if item in self._done:
+				return False
+			self._log.record(item, new_data)
+			self._done.add(item)
+			self.queue.discard(item)
+			self.n_retrieved += 1
+			self.metrics.item_done(discarded = new_data is None)
+			if self.n_retrieved % 50 == 0:
+				print(str(self.n_retrieved) + '\t' + self.metrics.summary())
+			self._since_checkpoint += 1
+			if self._since_checkpoint >= CHECKPOINT_LEN:
+				with metrics.timer('checkpoint'):
+					self._log.sync()
+				print('Saved retrieved data')
+				self._since_checkpoint = 0
+			return True
+
+	def close(self):
+		with self._lock:
+			self._log.close()
+
+
+def run_batch_parallel(retrieve, workers = 4, chunk_size = None, 
+						max_items = None, folder = None, 
+						lease_size = LEASE_SIZE, lease_timeout = LEASE_TIMEOUT):
+	'''
+	Run a session of the batch with several worker threads.  
+	Each worker leases a chunk of `lease_size` pending items at a time.  If a 
+	worker raises an error, its unfinished items go back to the queue at once; 
+	if it hangs, its lease expires after `lease_timeout` seconds without 
+	progress.  Results are merged into the same log as `run_batch`, without 
+	duplicates.  
+	
+	This never changes the working directory, so batches in different 
+	folders can run side by side.  `retrieve` must be safe to call from 
+	several threads at once; the `scrape` functions are.  
+	
+	:param retrieve: The function used to retrieve the data
+	:param workers: Number of worker threads
+	:param chunk_size: As for `run_batch`; should be at most `lease_size`
+	:param max_items: As for `run_batch`
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	:param lease_size: Maximum number of items leased to a worker at a time
+	:param lease_timeout: Seconds before an unrenewed lease expires
+	
+	:return: True iff we reached the end of the run without errors
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	_check_folder(folder)
+	_migrate_output(folder)
+	
+	queue = _load_queue(folder)
+	print('Total items to retrieve: ' + str(len(queue)))
+	if max_items is None:
+		max_items = MAX_RUN_LEN
+	this_run = queue.peek(max_items)
+	print('Items to retrieve on this run: ' + str(len(this_run)) + 
+			' with ' + str(workers) + ' workers')
+	
+	table = LeaseTable(WorkQueue(this_run), lease_size, lease_timeout)
+	run_metrics = metrics.BatchMetrics(folder, len(queue))
+	writer = _LogWriter(folder, queue, run_metrics)
+	stop = threading.Event()
+	errors = []
+	
+	def work():
+		# Report fetch and parse times from this thread to the session's metrics
+		metrics.activate(run_metrics)
+		while not stop.is_set():
+			lease = table.acquire()
+			if lease is None:
+				# Other workers' leases might still expire and come back
+				if table.outstanding() == 0:
+					return
+				time.sleep(1)
+				continue
+			lease_id, items = lease
+			try:
+				for item, new_data in _retrieve_items(retrieve, items, chunk_size):
+					writer.record(item, _clean_data(item, new_data))
+					table.complete(lease_id, item)
+					if stop.is_set() or not table.renew(lease_id):
+						# Stopping, or our lease expired and went to another worker
+						break
+			except Exception as error:
+				print('Worker failed:  ' + repr(error))
+				run_metrics.inc('errors')
+				errors.append(error)
+				return
+			finally:
+				table.release(lease_id)
+	
+	threads = [threading.Thread(target = work, name = 'batch-worker-' + str(n), 
+									daemon = True) 
+				for n in range(workers)]
+	try:
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			while thread.is_alive():
+				thread.join(timeout = 1)
+	finally:
+		# In case of error, too:  
+		# Tell the workers to stop after their current item
+		stop.set()
+		for thread in threads:
+			thread.join(timeout = lease_timeout)
+		# Make sure the log is on the disk
+		writer.close()
+		run_metrics.export()
+		# If everything's been retrieved, the batch is finished
+		if len(queue) == 0:
+			os.remove(os.path.join(folder, BATCH_FILENAME))
+		print('Saved retrieved data')
+	
+	if errors:
+		raise errors[0]
+	print('Finished batch run')
+	return True
+
 	
-def retrieve_batch():
+def retrieve_batch(folder = None):
 	'''
 	Abstraction for reading the output file from the batch folder. 
 	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
 	:return: A list of the retrieved item data
 	'''
-	if exists_batch():
+	if folder is None:
+		folder = BATCH_FOLDER
+	if exists_batch(folder):
 		BatchError('Current batch is not finished')
-	with open(BATCH_FOLDER + '/' + OUTPUT_FILENAME, 'r') as readfile:
-		data = json.load(readfile)
-	return(data)
+	_migrate_output(folder)
+	records = _replay_log(os.path.join(folder, LOG_FILENAME))
+	return([record['data'] for record in records if record['data'] is not None])
 
 	
-def clean_batch():
+def drop_batch(folder = None):
+	'''
+	Give up on the items still pending, keeping the data already retrieved.
+	Afterwards the batch counts as finished, and `retrieve_batch` returns
+	what was retrieved.
+
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+
+	:return: Number of pending items dropped
+	'''
+	if folder is None:
+		folder = BATCH_FOLDER
+	if not exists_batch(folder):
+		return 0
+	dropped = len(pending_items(folder))
+	os.remove(os.path.join(folder, BATCH_FILENAME))
+	return dropped
+
+
+def clean_batch(folder = None):
 	'''
 	Abstraction for removing the output file from the batch folder. 
 	
+	:param folder: The batch folder; defaults to `BATCH_FOLDER`
+	
 	:return: True iff remove completed without error
 	'''
-	if exists_batch():
+	if folder is None:
+		folder = BATCH_FOLDER
+	if exists_batch(folder):
 		BatchError('Current batch is not finished')
-	return(os.remove(BATCH_FOLDER + '/' + OUTPUT_FILENAME))
+	if os.access(os.path.join(folder, OUTPUT_FILENAME), os.F_OK):
+		os.remove(os.path.join(folder, OUTPUT_FILENAME))
+	if os.access(os.path.join(folder, DONE_FILENAME), os.F_OK):
+		os.remove(os.path.join(folder, DONE_FILENAME))
+	return(os.remove(os.path.join(folder, LOG_FILENAME)))
 
 
 if __name__ == '__main__':
@@ -205,7 +723,7 @@ if __name__ == '__main__':
 	set_batch(['a', 'b', 'c'])
 	print(exists_batch())
 	if exists_batch():
-		run_batch(lambda x: x)
+		run_batch(lambda x: {'doi': x, 'sid': x, 'references': []})
 	print(exists_batch())
 	print(retrieve_batch());
 	#clean_batch()
\ No newline at end of file
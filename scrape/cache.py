@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+'''
+A persistent cache of raw API responses, kept in a single SQLite file.
+
+Responses are keyed by the kind of query ('doi', 'scopus', 'pmid', ...) and the
+identifier, and stored zlib-compressed along with the time they were fetched.
+Re-running a scrape after a crash, or after changing the parser, then reads
+the responses from disk instead of spending the weekly quota again.
+'''
+
+import sqlite3
+import threading
+import time
+import zlib
+
+
+class CacheMiss(Exception):
+    pass
+
+
+class CachedResponse:
+    '''
+    Stands in for a `requests.Response` read back from the cache.
+    Only the attributes that `scrape` uses are provided.
+    '''
+    def __init__(self, content, status_code, encoding, fetched):
+        self.content = content
+        self.status_code = status_code
+        self.encoding = encoding
+        self.fetched = fetched
+        self.headers = {}
+        self.from_cache = True
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or 'utf-8', errors = 'replace')
+
+
+def normalize(kind, ident):
+    '''
+    Normalize a cache key, so trivially different spellings share an entry.
+    :param kind: The kind of query, e.g., 'doi' or 'scopus'
+    :param ident: The identifier
+    :return: The normalized (kind, identifier) pair
+    '''
+    kind = kind.strip().lower()
+    ident = str(ident).strip()
+    # DOIs are case-insensitive
+    if kind == 'doi':
+        ident = ident.lower()
+    return kind, ident
+
+
+class ResponseCache:
+    '''
+    Raw responses, stored in an SQLite file.
+    '''
+    # Run `evict` after this many new entries
+    EVICT_EVERY = 1000
+
+    def __init__(self, path, ttl = None, max_bytes = None):
+        '''
+        :param path: The SQLite file; created if it doesn't exist
+        :param ttl: Entries older than this many seconds are ignored and
+            evicted; None keeps entries forever
+        :param max_bytes: Evict the oldest entries when the compressed bodies
+            add up to more than this; None for no limit
+        '''
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        # The connection is shared by the threads in `scrape.fetch_many`
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread = False)
+        with self._lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('''CREATE TABLE IF NOT EXISTS responses (
+                                    kind TEXT NOT NULL,
+                                    ident TEXT NOT NULL,
+                                    fetched REAL NOT NULL,
+                                    status INTEGER NOT NULL,
+                                    encoding TEXT,
+                                    size INTEGER NOT NULL,
+                                    body BLOB NOT NULL,
+                                    PRIMARY KEY (kind, ident))''')
+            self._conn.execute('''CREATE INDEX IF NOT EXISTS responses_fetched
+                                    ON responses (fetched)''')
+            self._conn.commit()
+        self.evict()
+
+    def _fresh_after(self):
+        if self.ttl is None:
+            return 0
+        return time.time() - self.ttl
+
+    def contains(self, kind, ident):
+        '''
+        :return: True iff there's a fresh entry for this key
+        '''
+        kind, ident = normalize(kind, ident)
+        with self._lock:
+            row = self._conn.execute('''SELECT 1 FROM responses
+                                        WHERE kind = ? AND ident = ? AND fetched >= ?''',
+                                        (kind, ident, self._fresh_after())).fetchone()
+        return row is not None
+
+    def get(self, kind, ident):
+        '''
+        Look up a response.
+        :return: A `CachedResponse`, or None if there's no fresh entry
+        '''
+        kind, ident = normalize(kind, ident)
+        with self._lock:
+            row = self._conn.execute('''SELECT fetched, status, encoding, body
+                                        FROM responses
+                                        WHERE kind = ? AND ident = ? AND fetched >= ?''',
+                                        (kind, ident, self._fresh_after())).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        fetched, status, encoding, body = row
+        return CachedResponse(zlib.decompress(body), status, encoding, fetched)
+
+    def put(self, kind, ident, response):
+        '''
+        Store a response, replacing any existing entry for the key.
+        :param response: A `requests.Response` (or `CachedResponse`)
+        '''
+        kind, ident = normalize(kind, ident)
+        body = zlib.compress(response.content)
+        with self._lock:
+            self._conn.execute('''INSERT OR REPLACE INTO responses
+                                    (kind, ident, fetched, status, encoding, size, body)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                                (kind, ident, time.time(), response.status_code,
+                                    response.encoding, len(body), body))
+            self._conn.commit()
+            self._puts += 1
+            evict = self._puts % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self):
+        '''
+        Remove expired entries, then the oldest entries until the cache fits
+        in `max_bytes`.
+        :return: Number of entries removed
+        '''
+        with self._lock:
+            removed = self._conn.execute('DELETE FROM responses WHERE fetched < ?',
+                                            (self._fresh_after(),)).rowcount
+            if self.max_bytes is not None:
+                total = self._conn.execute(
+                            'SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+                if total > self.max_bytes:
+                    # Walk from the oldest entry, until enough has been dropped
+                    cutoff = None
+                    for fetched, size in self._conn.execute(
+                            'SELECT fetched, size FROM responses ORDER BY fetched').fetchall():
+                        total -= size
+                        cutoff = fetched
+                        if total <= self.max_bytes:
+                            break
+                    removed += self._conn.execute(
+                                    'DELETE FROM responses WHERE fetched <= ?',
+                                    (cutoff,)).rowcount
+            self._conn.commit()
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,554 @@
+# -*- coding: utf-8 -*-
+'''
+A breadth-first crawler over the citation network, one generation at a time.
+
+Generation +1 is the seed set, retrieved by DOI.  Each later generation is
+the set of papers cited by (crawling backward) or citing (crawling forward)
+the previous generation, less everything already seen.  Each generation is
+retrieved as a batch (see `batch.py`), so a crawl spreads over as many runs
+as the quota requires; the crawler's state is saved between runs.
+
+Rather than reloading every earlier generation to work out which papers are
+new, the crawler keeps one persistent index of every SID and DOI it has seen,
+as an append-only text file.
+
+By default a generation is queued in the order its items were first found.
+With a `priority`, it's queued with the most important items first:
+
+	'citations':  cited (or citing) the most papers of the previous generation
+	'core':  reached by the most core papers, along any path of the crawl,
+		with ties broken by citations
+	a function:  called as `priority(sid, stats)`, where `stats` is a dict
+		with the 'citations' and 'core' counts; higher scores go first
+
+Since the queue is in priority order, a crawl can be stopped at any point --
+because the `budget` is spent, because a generation is bigger than
+`max_generation_size`, or with `Crawler.stop` -- and what has been retrieved
+is the most important part of the network.
+'''
+
+import json
+import os
+
+import batch
+import paperstore
+import stubs
+
+STATE_FILE = 'crawl.json'		# The crawler's state between runs
+SEEN_FILE = 'seen.txt'			# Index of every SID and DOI seen so far
+REACH_FILE = 'reach.json'		# Core papers reaching each queued item
+MAX_GENERATION_SIZE = 100000	# Stop before retrieving a generation this big
+
+
+def gen_label(generation):
+	'''
+	Label for a generation, as in `+1`, `0`, `-1`
+	'''
+	if generation > 0:
+		return '+' + str(generation)
+	return str(generation)
+
+
+def gen_filename(generation):
+	'''
+	File name for a generation's data:  `gen_1.json`, `gen_0.json`,
+	`gen_n1.json`, ...
+	'''
+	if generation < 0:
+		return 'gen_n' + str(-generation) + '.json'
+	return 'gen_' + str(generation) + '.json'
+
+
+class SeenIndex:
+	'''
+	Persistent set of the identifiers the crawl has already seen, stored as
+	one `kind:identifier` key per line
+	'''
+	def __init__(self, path = SEEN_FILE):
+		self.path = path
+		self._keys = set()
+		if os.access(path, os.F_OK):
+			with open(path, 'r') as readfile:
+				self._keys = {line.rstrip('\n') for line in readfile}
+
+	@staticmethod
+	def _key(kind, ident):
+		ident = str(ident).strip()
+		if kind == 'doi':
+			# DOIs are case-insensitive
+			ident = ident.lower()
+		return kind + ':' + ident
+
+	def __contains__(self, kind_ident):
+		return self._key(*kind_ident) in self._keys
+
+	def __len__(self):
+		return len(self._keys)
+
+	def add_all(self, kind, idents):
+		'''
+		Add identifiers to the index, and append the new ones to its file
+		'''
+		new = []
+		for ident in idents:
+			if ident is None or ident == '' or ident != ident:
+				# Skip missing identifiers, including NaN
+				continue
+			key = self._key(kind, ident)
+			if key not in self._keys:
+				self._keys.add(key)
+				new += [key]
+		if new:
+			with open(self.path, 'a') as writefile:
+				writefile.write(''.join(key + '\n' for key in new))
+				writefile.flush()
+				os.fsync(writefile.fileno())
+
+
+def popcount(bits):
+	'''
+	Number of core papers in a reach bitmask
+	'''
+	return bin(bits).count('1')
+
+
+def references(paper):
+	'''
+	Backward expansion:  the SIDs a paper cites
+	'''
+	return paper.get('references', [])
+
+
+class Crawler:
+	'''
+	Breadth-first crawl from a seed set, with configurable depth and direction
+	'''
+	def __init__(self, depth = 2, direction = 'backward', citing = None,
+					max_generation_size = MAX_GENERATION_SIZE,
+					priority = None, core_dois = None, budget = None,
+					leaf_stubs = False,
+					state_file = STATE_FILE, seen_file = SEEN_FILE,
+					reach_file = REACH_FILE, batch_folder = None):
+		'''
+		:param depth: Number of generations to crawl beyond the seed set
+		:param direction: 'backward' follows references; 'forward' follows
+			citing papers
+		:param citing: For a forward crawl, a function that takes a paper's
+			SID and returns the SIDs of the papers citing it, e.g.,
+			`scrape.get_citing_sids`
+		:param max_generation_size: If a new generation would have this many
+			items or more, the crawl stops without retrieving it.  With a
+			`priority`, the generation is cut down to its top
+			`max_generation_size` items instead, and the crawl stops after it.
+		:param priority: None, 'citations', 'core', or a scoring function;
+			see above
+		:param core_dois: DOIs of the core papers, for the 'core' priority;
+			defaults to all of generation +1
+		:param budget: Maximum number of items to queue over the whole crawl
+		:param leaf_stubs: Build the last generation from the reference stubs
+			of the one before it, instead of retrieving it (backward crawls
+			only; set `scrape.REFERENCE_STUBS` so the stubs are parsed)
+		:param state_file: File to save the crawler's state between runs
+		:param seen_file: File for the index of seen identifiers
+		:param reach_file: File for the core reach of the queued items
+		:param batch_folder: Folder for the batches; defaults to `batch.BATCH_FOLDER`
+		'''
+		if direction == 'backward':
+			self.expand = references
+			self.step = -1
+		elif direction == 'forward':
+			if citing is None:
+				raise ValueError('A forward crawl needs a `citing` function')
+			self.expand = lambda paper: citing(paper['sid'])
+			self.step = 1
+			if leaf_stubs:
+				raise ValueError('Stubs only describe references, so ' +
+									'`leaf_stubs` needs a backward crawl')
+		else:
+			raise ValueError('Unknown direction ' + str(direction))
+		if priority not in (None, 'citations', 'core') and not callable(priority):
+			raise ValueError('Unknown priority ' + str(priority))
+		self.depth = depth
+		self.max_generation_size = max_generation_size
+		self.priority = priority
+		self.core_dois = None
+		if core_dois is not None:
+			self.core_dois = {str(doi).strip().lower() for doi in core_dois}
+		self.budget = budget
+		self.leaf_stubs = leaf_stubs
+		self.state_file = state_file
+		self.reach_file = reach_file
+		self.seen = SeenIndex(seen_file)
+		self.batch_folder = batch_folder
+
+		if os.access(state_file, os.R_OK):
+			with open(state_file) as readfile:
+				self.state = json.load(readfile)
+		else:
+			self.state = {'generation': None,		# Generation now being retrieved
+							'generations': [],		# Generations finished
+							'sizes': {},			# Items queued, by generation
+							'finished': False}
+
+		# For each item of the generation being retrieved, a bitmask of
+		#  the core papers that reach it
+		self._load_reach()
+
+		if 'queuing' in self.state:
+			# The last run stopped while it was setting up a batch
+			if batch.exists_batch(self.batch_folder):
+				self._queued()
+			elif self.state['generations'] == []:
+				# The seed set wasn't queued; `start` queues it again
+				self.state['sizes'].pop(str(self.state.pop('queuing')), None)
+				self._save_state()
+
+	def _load_reach(self):
+		self.reach = {}
+		if self.priority is not None and os.access(self.reach_file, os.R_OK):
+			with open(self.reach_file) as readfile:
+				self.reach = {sid: int(bits, 16)
+								for sid, bits in json.load(readfile).items()}
+
+	def _save_state(self):
+		with open(self.state_file + '.tmp', 'w') as writefile:
+			json.dump(self.state, writefile)
+		os.replace(self.state_file + '.tmp', self.state_file)
+
+	def started(self):
+		return (self.state['generation'] is not None or self.state['finished'] or
+				'queuing' in self.state)
+
+	def finished(self):
+		return self.state['finished']
+
+	def start(self, seed_dois):
+		'''
+		Queue the seed set, generation +1
+
+		:param seed_dois: DOIs of the seed papers
+		'''
+		if self.started():
+			raise batch.BatchError('Crawl already started')
+		seed_dois = list(seed_dois)
+		self.seen.add_all('doi', seed_dois)
+		self._queue(1, seed_dois)
+
+	def adopt(self, generations, generation = None):
+		'''
+		Take over a crawl started by other code, e.g., an older `run_scrape`,
+		from the generations it saved and the batch it left
+
+		:param generations: The finished generations, in order, each saved
+			as `gen_filename(generation)`
+		:param generation: The generation whose batch is in the batch
+			folder, or None if the next generation hasn't been queued yet
+		'''
+		if self.started():
+			raise batch.BatchError('Crawl already started')
+		for finished in generations:
+			with open(gen_filename(finished)) as readfile:
+				papers = json.load(readfile)
+			self.seen.add_all('sid', [paper.get('sid', '') for paper in papers])
+			self.seen.add_all('doi', [paper.get('doi', '') for paper in papers])
+			self.state['sizes'][str(finished)] = len(papers)
+		self.state['generations'] = list(generations)
+		if generation is None:
+			# `run` queues it
+			self.state['queuing'] = generations[-1] + self.step
+		else:
+			pending = []
+			if batch.exists_batch(self.batch_folder):
+				pending = batch.pending_items(self.batch_folder)
+			self.seen.add_all('doi' if generation == 1 else 'sid', pending)
+			self.state['sizes'][str(generation)] = (len(pending) +
+								len(batch.retrieve_batch(folder = self.batch_folder)))
+			self.state['generation'] = generation
+		self._save_state()
+
+	def _queue(self, generation, items):
+		print(str(len(items)) + ' items in generation ' + gen_label(generation))
+		self.state['sizes'][str(generation)] = len(items)
+		# Note the generation before its batch is set up, so that a run that
+		#  stops in between doesn't take the new batch for the old generation
+		self.state['queuing'] = generation
+		self._save_state()
+		if self.priority is not None:
+			# Kept apart until the batch is set up, since the reach of the
+			#  old generation is needed to queue the new one again
+			with open(self.reach_file + '.next', 'w') as writefile:
+				json.dump({sid: format(self.reach.get(sid, 0), 'x') for sid in items},
+							writefile)
+		batch.set_batch(items, folder = self.batch_folder)
+		self._queued()
+
+	def _queued(self):
+		'''
+		Switch to the generation whose batch has been set up
+		'''
+		if os.access(self.reach_file + '.next', os.F_OK):
+			os.replace(self.reach_file + '.next', self.reach_file)
+			self._load_reach()
+		self.state['generation'] = self.state.pop('queuing')
+		self._save_state()
+
+	def _queue_again(self):
+		'''
+		Queue the next generation again, from the last finished one, after
+		a run that stopped before the batch was set up
+		'''
+		self.state['sizes'].pop(str(self.state.pop('queuing')), None)
+		generation = self.state['generations'][-1]
+		print('Queueing the generation after ' + gen_label(generation) + ' again')
+		with open(gen_filename(generation)) as readfile:
+			papers = json.load(readfile)
+		self._next_generation(generation, papers)
+
+	def _seed_reach(self, papers):
+		'''
+		Give each core paper of generation +1 its own bit
+		'''
+		self.reach = {}
+		for paper in papers:
+			doi = str(paper.get('doi', '')).strip().lower()
+			if self.core_dois is None or doi in self.core_dois:
+				self.reach[paper.get('sid', '')] = 1 << len(self.reach)
+
+	def _frontier(self, papers):
+		'''
+		The next generation:  everything the papers point to that hasn't
+		been seen yet, in priority order or else in order of first appearance
+		'''
+		citations = {}
+		reach = {}
+		for paper in papers:
+			paper_reach = self.reach.get(paper.get('sid', ''), 0)
+			# Dicts keep the order items were first seen, and count each
+			#  citing paper once, even if it lists a reference twice.  A
+			#  forward expansion is an API call, so each paper is expanded
+			#  only once.
+			for sid in dict.fromkeys(self.expand(paper)):
+				if ('sid', sid) in self.seen:
+					continue
+				citations[sid] = citations.get(sid, 0) + 1
+				if paper_reach:
+					reach[sid] = reach.get(sid, 0) | paper_reach
+		# Sorting is stable, so ties stay in the order items were first seen
+		frontier = list(citations)
+		if self.priority == 'citations':
+			frontier.sort(key = lambda sid: citations[sid], reverse = True)
+		elif self.priority == 'core':
+			frontier.sort(key = lambda sid: (popcount(reach.get(sid, 0)),
+												citations[sid]),
+							reverse = True)
+		elif self.priority is not None:
+			frontier.sort(key = lambda sid: self.priority(sid,
+								{'citations': citations[sid],
+								 'core': popcount(reach.get(sid, 0))}),
+							reverse = True)
+		self.reach = reach
+		return frontier
+
+	def _write_generation(self, generation, papers):
+		'''
+		Save a generation's data, so that the file is either complete or
+		missing
+		'''
+		with open(gen_filename(generation) + '.tmp', 'w') as writefile:
+			json.dump(papers, writefile)
+			writefile.flush()
+			os.fsync(writefile.fileno())
+		os.replace(gen_filename(generation) + '.tmp', gen_filename(generation))
+
+	def _finish_generation(self, expand = True):
+		'''
+		Save the finished generation's data, and queue the next generation
+		if there is one
+		'''
+		generation = self.state['generation']
+		if (os.access(gen_filename(generation), os.F_OK) and
+				not batch.exists_data(self.batch_folder)):
+			# An earlier run saved the generation and cleaned up the batch,
+			#  but stopped before it saved the crawler's state
+			print('Finished generation ' + gen_label(generation) + '; already saved')
+			with open(gen_filename(generation)) as readfile:
+				papers = json.load(readfile)
+		else:
+			print('Finished generation ' + gen_label(generation) + '; moving data and cleaning up')
+			papers = batch.retrieve_batch(folder = self.batch_folder)
+			self._write_generation(generation, papers)
+			batch.clean_batch(folder = self.batch_folder)
+		self.seen.add_all('sid', [paper.get('sid', '') for paper in papers])
+		self.seen.add_all('doi', [paper.get('doi', '') for paper in papers])
+		self.state['generations'] += [generation]
+		self.state['generation'] = None
+		print('Generation ' + gen_label(generation) + ':  ' + str(len(papers)) + ' papers')
+		self._next_generation(generation, papers, expand)
+
+	def _next_generation(self, generation, papers, expand = True):
+		'''
+		Queue the generation after a finished one, if there is one
+		'''
+		if generation == 1 and self.priority is not None:
+			self._seed_reach(papers)
+		if not expand or len(self.state['generations']) > self.depth:
+			self.state['finished'] = True
+			self._save_state()
+			return
+		frontier = self._frontier(papers)
+		next_generation = generation + self.step
+		if (frontier != [] and self.leaf_stubs and
+				len(self.state['generations']) == self.depth):
+			# Stubs cost no API calls, so neither the budget nor the size
+			#  cutoff applies
+			self._stub_generation(next_generation, frontier, papers)
+			return
+		# A generation cut short is still retrieved, but the crawl stops after it
+		stop_after = False
+		if self.budget is not None:
+			left = self.budget - sum(self.state['sizes'].values())
+			if len(frontier) > left:
+				print('Crawl budget allows ' + str(max(0, left)) + ' of ' +
+						str(len(frontier)) + ' new items in generation ' +
+						gen_label(next_generation))
+				frontier = frontier[:max(0, left)]
+				stop_after = True
+		if frontier == []:
+			print('Generation ' + gen_label(next_generation) + ' is empty; crawl finished')
+			self.state['finished'] = True
+			self._save_state()
+			return
+		if len(frontier) >= self.max_generation_size:
+			if self.priority is None:
+				# Too many to retrieve; stop here, as the old `run_scrape` did
+				print(str(len(frontier)) + ' new items in generation ' +
+						gen_label(next_generation) + '; too many, so the crawl stops here')
+				self.state['finished'] = True
+				self._save_state()
+				return
+			print(str(len(frontier)) + ' new items in generation ' +
+					gen_label(next_generation) + '; keeping the top ' +
+					str(self.max_generation_size))
+			frontier = frontier[:self.max_generation_size]
+			stop_after = True
+		del papers
+		self.state['stop_after'] = stop_after
+		self._queue(next_generation, frontier)
+		# Only once the batch is set up, so that it can be queued again
+		self.seen.add_all('sid', frontier)
+
+	def _stub_generation(self, generation, sids, papers):
+		'''
+		Build the last generation from the stubs in `papers`, without
+		retrieving anything
+		'''
+		leaf = stubs.stub_generation(papers, sids)
+		empty = sum(1 for stub in leaf if stub['year'] is None and
+						stub['author_names'] == [])
+		print('Generation ' + gen_label(generation) + ':  ' + str(len(leaf)) +
+				' papers built from reference stubs (' + str(empty) +
+				' without any details)')
+		self._write_generation(generation, leaf)
+		self.state['sizes'][str(generation)] = len(leaf)
+		self.state['generations'] += [generation]
+		self.state['finished'] = True
+		self._save_state()
+
+	def stop(self):
+		'''
+		Stop the crawl now.  The items still pending in the current
+		generation are dropped; what has been retrieved is kept.
+		'''
+		if self.state['finished']:
+			return
+		if self.state['generation'] is not None:
+			dropped = batch.drop_batch(self.batch_folder)
+			print('Stopping the crawl; dropped ' + str(dropped) + ' pending items')
+			self._finish_generation(expand = False)
+		self.state['finished'] = True
+		self._save_state()
+
+	def leaf(self):
+		'''
+		:return: True iff the generation being retrieved is the last one
+			(so its own references won't be followed)
+		'''
+		return (len(self.state['generations']) == self.depth or
+				self.state.get('stop_after', False))
+
+	def run(self, run_batch):
+		'''
+		Work through the crawl, until it finishes or a batch doesn't finish
+		on this run (e.g., because the quota ran out)
+
+		:param run_batch: Function that runs the current batch, e.g., with
+			`batch.run_batch` or `Scheduler.run`.  It's called as
+			`run_batch(generation, leaf)`, where `leaf` is True for the last
+			generation (whose references won't be followed).  Generation +1
+			is a batch of DOIs; later generations are batches of SIDs.
+
+		:return: True iff the crawl is finished
+		'''
+		if 'queuing' in self.state:
+			self._queue_again()
+		while not self.state['finished']:
+			if self.state['generation'] is None:
+				raise batch.BatchError('Crawl not started')
+			if batch.exists_batch(self.batch_folder):
+				generation = self.state['generation']
+				print('Running batch for generation ' + gen_label(generation))
+				run_batch(generation, self.leaf())
+				if batch.exists_batch(self.batch_folder):
+					print('Finished the current batch run; batch not finished')
+					return False
+			self._finish_generation(expand = not self.state.get('stop_after', False))
+		return True
+
+	def _combined(self, totals):
+		# Generate the papers of every generation, loading one at a time.
+		#  Each generation is filled in from the bibliographies of the
+		#  one before it, where the search API left fields missing.
+		previous = []
+		for generation in self.state['generations']:
+			with open(gen_filename(generation)) as readfile:
+				papers = json.load(readfile)
+			filled = stubs.fill_from_stubs(papers, previous)
+			if filled > 0:
+				print('Generation ' + gen_label(generation) + ':  ' + str(filled) +
+						' papers filled in from reference stubs')
+			totals[generation] = len(papers)
+			for paper in papers:
+				# The stubs have served their purpose once the next
+				#  generation is filled in
+				yield {field: value for field, value in paper.items()
+						if field != 'reference_stubs'}
+			previous = papers
+
+	def combine(self, outfile):
+		'''
+		Combine all of the generations into one file, loading one
+		generation at a time (and the one before it, for its stubs; see
+		`stubs.fill_from_stubs`)
+
+		:param outfile: The combined file, e.g., `papers.json`, a JSON Lines
+			file, e.g., `papers.jsonl`, or a paper store, e.g., `papers.npz`;
+			see `paperstore.py`
+		:return: Number of papers, by generation
+		'''
+		totals = {}
+		if paperstore.is_store(outfile):
+			paperstore.write_store(self._combined(totals), outfile)
+			return totals
+		if paperstore.is_jsonl(outfile):
+			paperstore.write_jsonl(self._combined(totals), outfile)
+			return totals
+		with open(outfile, 'w') as writefile:
+			writefile.write('[')
+			first = True
+			for paper in self._combined(totals):
+				if not first:
+					writefile.write(', ')
+				json.dump(paper, writefile)
+				first = False
+			writefile.write(']')
+		return totals
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+'''
+Persistent interning of external IDs:  each Scopus ID and each Scopus author
+ID gets a dense int64, so the later stages can work on integer arrays, and
+translate back to the string IDs only when writing their output.
+
+Scopus IDs (of papers, and in reference lists) and author IDs are interned
+separately, in the 'sid' and 'author' namespaces.  IDs are assigned in the
+order they're first seen, and never change once assigned, so the same table
+can be extended as the dataset grows.  The table is saved next to the paper
+data:  `papers.json` or `papers.npz` gets `papers.ids.npz`.
+'''
+
+import os
+
+import numpy as np
+
+NAMESPACES = ('sid', 'author')
+MISSING = -1				# `lookup_ids` result for an ID that isn't interned
+
+
+def interning_path(papers_path):
+	'''
+	:return: File name of the interning table for a paper data file
+	'''
+	return os.path.splitext(papers_path)[0] + '.ids.npz'
+
+
+class Interner:
+	'''
+	Two-way mapping between external string IDs and dense ints
+	'''
+	def __init__(self, path = None):
+		'''
+		:param path: File to load the table from, if it exists, and to save it to
+		'''
+		self.path = path
+		self._ids = {namespace: {} for namespace in NAMESPACES}
+		self._strings = {namespace: [] for namespace in NAMESPACES}
+		# Cached NumPy copies of `_strings`, for vectorized lookups
+		self._arrays = {}
+		if path is not None and os.access(path, os.R_OK):
+			with np.load(path, allow_pickle = False) as arrays:
+				for namespace in NAMESPACES:
+					if namespace in arrays.files:
+						strings = arrays[namespace].tolist()
+						self._strings[namespace] = strings
+						self._ids[namespace] = {string: i
+												for i, string in enumerate(strings)}
+
+	def __len__(self):
+		return sum(len(strings) for strings in self._strings.values())
+
+	def size(self, namespace):
+		'''
+		:return: Number of IDs interned in `namespace`
+		'''
+		return len(self._strings[namespace])
+
+	def intern(self, namespace, ident):
+		'''
+		:return: The int for `ident`, assigning a new one if needed
+		'''
+		ids = self._ids[namespace]
+		i = ids.get(ident)
+		if i is None:
+			i = len(ids)
+			ids[ident] = i
+			self._strings[namespace].append(ident)
+			self._arrays.pop(namespace, None)
+		return i
+
+	def intern_many(self, namespace, idents):
+		'''
+		:param idents: Iterable of string IDs
+		:return: int64 array of their ints, assigning new ones as needed
+		'''
+		intern = self.intern
+		return np.fromiter((intern(namespace, ident) for ident in idents),
+							dtype = np.int64)
+
+	def lookup_ids(self, namespace, idents):
+		'''
+		Like `intern_many`, but without assigning new ints
+
+		:return: int64 array, with `MISSING` for IDs that aren't interned
+		'''
+		ids = self._ids[namespace]
+		return np.fromiter((ids.get(ident, MISSING) for ident in idents),
+							dtype = np.int64)
+
+	def strings(self, namespace, ints = None):
+		'''
+		Translate ints back to the external IDs
+
+		:param ints: int array; defaults to every interned ID, in order
+		:return: Array of strings
+		'''
+		if namespace not in self._arrays:
+			self._arrays[namespace] = np.array(self._strings[namespace], dtype = str)
+		if ints is None:
+			return self._arrays[namespace]
+		return self._arrays[namespace][ints]
+
+	def string(self, namespace, i):
+		'''
+		:return: The external ID for a single int
+		'''
+		return self._strings[namespace][i]
+
+	def save(self, path = None):
+		'''
+		Write the table, replacing the file atomically
+		'''
+		if path is None:
+			path = self.path
+		with open(path + '.tmp', 'wb') as writefile:
+			np.savez(writefile, **{namespace: self.strings(namespace)
+									for namespace in NAMESPACES})
+		os.replace(path + '.tmp', path)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+'''
+Throughput, latency and ETA instrumentation for batch runs.
+
+`batch.run_batch` creates a `BatchMetrics` for each session and makes it
+active in the threads doing the work.  Code further down -- `scrape`'s fetch
+and parse steps, the retry policy -- reports to whichever metrics are active
+with the module-level `timer` and `inc` functions, which do nothing if no
+metrics are active.
+
+Every `EXPORT_INTERVAL` seconds the metrics are written to the batch folder,
+as `metrics.json` and in the Prometheus text format as `metrics.prom`, so a
+run can be followed with, e.g.,
+
+	watch -n 10 cat batch/metrics.prom
+'''
+
+from collections import deque
+from contextlib import contextmanager
+import json
+import os
+import threading
+import time
+
+EXPORT_INTERVAL = 10			# Seconds between exports
+JSON_FILENAME = 'metrics.json'
+PROM_FILENAME = 'metrics.prom'
+
+# Phases of retrieving an item that are timed
+PHASES = ('fetch', 'parse', 'checkpoint')
+# Upper bounds, in seconds, of the latency histogram buckets
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float('inf'))
+# Number of recent samples kept for each phase, to compute percentiles
+RESERVOIR_LEN = 1000
+# Percentiles reported for each phase
+PERCENTILES = (50, 90, 99)
+
+_local = threading.local()
+
+
+class _Histogram:
+	'''
+	Latencies for one phase:  cumulative bucket counts (for Prometheus) and
+	the most recent samples (for percentiles)
+	'''
+	def __init__(self):
+		self.bucket_counts = [0] * len(BUCKETS)
+		self.count = 0
+		self.total = 0.0
+		self.recent = deque(maxlen = RESERVOIR_LEN)
+
+	def observe(self, seconds):
+		self.count += 1
+		self.total += seconds
+		self.recent.append(seconds)
+		for i, bound in enumerate(BUCKETS):
+			if seconds <= bound:
+				self.bucket_counts[i] += 1
+
+	def percentile(self, p):
+		if not self.recent:
+			return None
+		ordered = sorted(self.recent)
+		return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class BatchMetrics:
+	'''
+	Metrics for one batch session
+	'''
+	def __init__(self, folder, pending, interval = EXPORT_INTERVAL):
+		'''
+		:param folder: Folder to write the metrics files to
+		:param pending: Number of items in the batch at the start of the session
+		:param interval: Seconds between exports
+		'''
+		self.folder = folder
+		self.pending = pending
+		self.interval = interval
+		self.start = time.time()
+		self.counters = {'items': 0, 'discarded': 0, 'errors': 0, 'retries': 0}
+		self.phases = {phase: _Histogram() for phase in PHASES}
+		# (time, items) at recent item completions, for the current rate
+		self._recent_items = deque(maxlen = 100)
+		self._last_export = 0
+		self._lock = threading.Lock()
+		self._export_lock = threading.Lock()
+
+	def observe(self, phase, seconds):
+		with self._lock:
+			if phase not in self.phases:
+				self.phases[phase] = _Histogram()
+			self.phases[phase].observe(seconds)
+
+	def inc(self, counter, n = 1):
+		with self._lock:
+			self.counters[counter] = self.counters.get(counter, 0) + n
+		self.maybe_export()
+
+	def item_done(self, discarded = False):
+		'''
+		Count a finished item
+		'''
+		with self._lock:
+			self.counters['items'] += 1
+			if discarded:
+				self.counters['discarded'] += 1
+			self.pending = max(0, self.pending - 1)
+			self._recent_items.append((time.time(), self.counters['items']))
+		self.maybe_export()
+
+	def _rates(self):
+		# Called with the lock held
+		elapsed = time.time() - self.start
+		overall = self.counters['items'] / elapsed if elapsed > 0 else 0.0
+		current = overall
+		if len(self._recent_items) > 1:
+			(t0, n0), (t1, n1) = self._recent_items[0], self._recent_items[-1]
+			if t1 > t0:
+				current = (n1 - n0) / (t1 - t0)
+		return overall, current
+
+	def snapshot(self):
+		'''
+		:return: The current metrics, as a dict
+		'''
+		with self._lock:
+			overall, current = self._rates()
+			eta = None
+			if current > 0:
+				eta = time.time() + self.pending / current
+			phases = {}
+			for phase, hist in self.phases.items():
+				phases[phase] = {'count': hist.count,
+									'mean': hist.total / hist.count if hist.count else None}
+				for p in PERCENTILES:
+					phases[phase]['p' + str(p)] = hist.percentile(p)
+			return {'updated': time.time(),
+					'started': self.start,
+					'items_per_sec': overall,
+					'current_items_per_sec': current,
+					'pending': self.pending,
+					'eta': eta,
+					'counters': dict(self.counters),
+					'phases': phases}
+
+	def summary(self):
+		'''
+		:return: A one-line summary for printing
+		'''
+		snap = self.snapshot()
+		line = ('{:.2f} items/s'.format(snap['current_items_per_sec']) +
+				'; ' + str(snap['pending']) + ' pending')
+		if snap['eta'] is not None:
+			line += '; ETA ' + time.strftime('%c', time.localtime(snap['eta']))
+		return line
+
+	def prometheus(self):
+		'''
+		:return: The metrics in the Prometheus text exposition format
+		'''
+		snap = self.snapshot()
+		lines = []
+		for counter, value in sorted(snap['counters'].items()):
+			lines += ['# TYPE batch_' + counter + '_total counter',
+						'batch_' + counter + '_total ' + str(value)]
+		lines += ['# TYPE batch_items_per_second gauge',
+					'batch_items_per_second ' + str(snap['current_items_per_sec']),
+					'# TYPE batch_pending_items gauge',
+					'batch_pending_items ' + str(snap['pending'])]
+		if snap['eta'] is not None:
+			lines += ['# TYPE batch_eta_timestamp_seconds gauge',
+						'batch_eta_timestamp_seconds ' + str(snap['eta'])]
+		lines += ['# TYPE batch_phase_seconds histogram']
+		with self._lock:
+			for phase, hist in sorted(self.phases.items()):
+				for bound, count in zip(BUCKETS, hist.bucket_counts):
+					le = '+Inf' if bound == float('inf') else str(bound)
+					lines += ['batch_phase_seconds_bucket{phase="' + phase +
+								'",le="' + le + '"} ' + str(count)]
+				lines += ['batch_phase_seconds_sum{phase="' + phase + '"} ' +
+								str(hist.total),
+							'batch_phase_seconds_count{phase="' + phase + '"} ' +
+								str(hist.count)]
+		return '\n'.join(lines) + '\n'
+
+	def maybe_export(self):
+		'''
+		Export, if it's been at least `interval` seconds since the last time
+		'''
+		if time.time() - self._last_export >= self.interval:
+			# If another thread is already exporting, leave it to that one
+			if self._export_lock.acquire(blocking = False):
+				try:
+					self._export()
+				finally:
+					self._export_lock.release()
+
+	def export(self):
+		'''
+		Write the metrics files, replacing them atomically
+		'''
+		with self._export_lock:
+			self._export()
+
+	def _export(self):
+		# Called with the export lock held
+		self._last_export = time.time()
+		json_path = os.path.join(self.folder, JSON_FILENAME)
+		with open(json_path + '.tmp', 'w') as writefile:
+			json.dump(self.snapshot(), writefile, indent = 1)
+		os.replace(json_path + '.tmp', json_path)
+		prom_path = os.path.join(self.folder, PROM_FILENAME)
+		with open(prom_path + '.tmp', 'w') as writefile:
+			writefile.write(self.prometheus())
+		os.replace(prom_path + '.tmp', prom_path)
+
+
+def activate(metrics):
+	'''
+	Make `metrics` the active metrics for the current thread; None to deactivate
+	'''
+	_local.metrics = metrics
+
+
+def active():
+	'''
+	:return: The active metrics for the current thread, or None
+	'''
+	return getattr(_local, 'metrics', None)
+
+
+@contextmanager
+def timer(phase):
+	'''
+	Time the enclosed block as one sample of `phase`, if metrics are active
+	'''
+	metrics = active()
+	if metrics is None:
+		yield
+		return
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		metrics.observe(phase, time.perf_counter() - start)
+
+
+def inc(counter, n = 1):
+	'''
+	Increase a counter of the active metrics, if any
+	'''
+	metrics = active()
+	if metrics is not None:
+		metrics.inc(counter, n)
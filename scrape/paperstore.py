@@ -0,0 +1,504 @@
+# -*- coding: utf-8 -*-
+'''
+A columnar store for the paper metadata, as an alternative to `papers.json`.
+
+`papers.json` has to be loaded whole, as one Python dict and several lists
+of strings for every paper.  The store keeps each field as a NumPy array
+instead, in one uncompressed `.npz` file:
+
+	sid, doi, pmid, source:  string arrays, one entry per paper
+	year:  int32, with `YEAR_MISSING` for papers without a year
+	core:  bool (only if the papers have been marked)
+	authors, references:  list columns, each stored as a string array of
+		all the values, plus int64 offsets:  paper `i` has the values
+		`values[offsets[i]:offsets[i+1]]`, as in Arrow
+
+Arrays are read from the file only when they're asked for, so a reader
+that needs just the SIDs and references never loads the author lists.
+Only these fields are stored; anything else in the JSON (e.g., 'raw') is
+dropped.
+
+The Scopus IDs and author IDs are also stored as ints, interned with the
+table in `papers.ids.npz` (see `interning.py`).  `column(name, interned = True)`
+gives the int version of 'sid', 'authors', and 'references'.
+`open_papers` gives the same columnar access to a JSON file, converting it
+in memory.
+
+`load_papers` and `save_papers` take any of the formats, deciding by the
+file extension, so scripts can switch between `papers.json`, `papers.jsonl`
+(JSON Lines, one paper per line) and `papers.npz` by changing a file name.
+A JSON Lines file, or a store, can be read one paper at a time with
+`iter_papers`, and is converted to columns `CHUNK_SIZE` papers at a time,
+so the whole dataset never has to be in memory as Python objects.  To
+convert an existing file:
+
+	python paperstore.py papers.json papers.npz
+'''
+
+import itertools
+import json
+import os
+import sys
+
+import numpy as np
+
+from interning import Interner, interning_path
+
+STRING_COLUMNS = ('sid', 'doi', 'pmid', 'source')
+LIST_COLUMNS = ('authors', 'references')
+COLUMNS = STRING_COLUMNS + ('year', 'core') + LIST_COLUMNS
+YEAR_MISSING = -1
+STORE_EXT = '.npz'
+JSONL_EXT = '.jsonl'
+# Number of papers converted to columns at a time
+CHUNK_SIZE = 10000
+
+# Key suffixes for the arrays behind some columns
+_JSON = '_json'			# Mask of string-column values stored as JSON
+_OFFSETS = '_offsets'	# Offsets of a list column
+_VALUES = '_values'		# Values of a list column
+_IDS = '_ids'			# Interned ints for 'sid', or the values of a list column
+
+# Namespace for the interned ints of each column
+INTERNED = {'sid': 'sid', 'references': 'sid', 'authors': 'author'}
+
+
+def is_store(path):
+	'''
+	:return: True iff `path` names a paper store, rather than a JSON file
+	'''
+	return path.endswith(STORE_EXT)
+
+
+def is_jsonl(path):
+	'''
+	:return: True iff `path` names a JSON Lines file
+	'''
+	return path.endswith(JSONL_EXT)
+
+
+class ListColumn:
+	'''
+	A list column:  the values for every paper, and where each paper's
+	values start and end
+	'''
+	def __init__(self, offsets, values):
+		self.offsets = offsets
+		self.values = values
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, i):
+		return self.values[self.offsets[i]:self.offsets[i+1]].tolist()
+
+	def lengths(self):
+		'''
+		:return: Array with the number of values for each paper
+		'''
+		return np.diff(self.offsets)
+
+	def rows(self):
+		'''
+		:return: Array with the index of the paper each value belongs to,
+			e.g., the citing paper for each reference
+		'''
+		return np.repeat(np.arange(len(self), dtype = np.int64), self.lengths())
+
+
+class PaperStore:
+	'''
+	Read-only access to a paper store
+	'''
+	def __init__(self, path, arrays = None, interner = None):
+		'''
+		:param path: The store.  For a JSON file converted by `open_papers`,
+			the JSON file.
+		:param arrays: The columns, if they're already in memory
+		:param interner: The interning table; by default it's loaded
+			from beside `path` when it's first needed
+		'''
+		self.path = path
+		if arrays is None:
+			# `np.load` on an `.npz` reads each array only when it's accessed
+			arrays = np.load(path, allow_pickle = False)
+		self._arrays = arrays
+		self._len = len(self._arrays['sid'])
+		self._interner = interner
+
+	def __len__(self):
+		return self._len
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		self.close()
+
+	def close(self):
+		if hasattr(self._arrays, 'close'):
+			self._arrays.close()
+
+	def load(self):
+		'''
+		Read every array, and the interning table, into memory; e.g., before
+		forking processes that will share the store
+
+		:return: The store
+		'''
+		if hasattr(self._arrays, 'files'):
+			arrays = {name: self._arrays[name] for name in self._arrays.files}
+			self._arrays.close()
+			self._arrays = arrays
+		self.interner
+		return self
+
+	@property
+	def files(self):
+		# Array names, whether the arrays are in a file or in memory
+		if hasattr(self._arrays, 'files'):
+			return self._arrays.files
+		return list(self._arrays)
+
+	@property
+	def interner(self):
+		'''
+		The `interning.Interner` for the int columns
+		'''
+		if self._interner is None:
+			self._interner = Interner(interning_path(self.path))
+		return self._interner
+
+	def columns(self):
+		'''
+		:return: The columns in this store
+		'''
+		return [column for column in COLUMNS if self.has_column(column)]
+
+	def has_column(self, name):
+		if name in LIST_COLUMNS:
+			return name + _OFFSETS in self.files
+		return name in self.files
+
+	def column(self, name, interned = False):
+		'''
+		:param interned: Give the interned ints, instead of the strings,
+			for 'sid', 'authors', and 'references'
+		:return: A NumPy array, or a `ListColumn` for 'authors' and 'references'
+		'''
+		if interned:
+			return self._interned(name)
+		if name in LIST_COLUMNS:
+			return ListColumn(self._arrays[name + _OFFSETS],
+								self._arrays[name + _VALUES])
+		if name not in COLUMNS:
+			raise KeyError('Unknown column ' + str(name))
+		return self._arrays[name]
+
+	def json_flags(self, name, start = 0, stop = None):
+		'''
+		:return: Bool array, True for the values of string column `name`
+			that are stored as JSON, or None if there aren't any
+		'''
+		if name + _JSON not in self.files:
+			return None
+		return self._arrays[name + _JSON][start:stop]
+
+	def _interned(self, name):
+		if name not in INTERNED:
+			raise KeyError('Column ' + str(name) + ' is not interned')
+		if name + _IDS in self.files:
+			ids = self._arrays[name + _IDS]
+		else:
+			# A store written before interning; intern it now
+			strings = self.column(name)
+			if name in LIST_COLUMNS:
+				strings = strings.values
+			ids = self.interner.intern_many(INTERNED[name], strings.tolist())
+		if name in LIST_COLUMNS:
+			return ListColumn(self._arrays[name + _OFFSETS], ids)
+		return ids
+
+	def values(self, name, start = 0, stop = None):
+		'''
+		A column as a list of Python values, the way they were in the JSON
+
+		:param start, stop: The range of papers to give; defaults to all of them
+		'''
+		if stop is None:
+			stop = len(self)
+		if name in LIST_COLUMNS:
+			column = self.column(name)
+			offsets = column.offsets[start:stop+1]
+			values = column.values[offsets[0]:offsets[-1]].tolist()
+			offsets = (offsets - offsets[0]).tolist()
+			return [values[offsets[i]:offsets[i+1]] for i in range(len(offsets) - 1)]
+		values = self.column(name)[start:stop].tolist()
+		if name == 'year':
+			return [None if year == YEAR_MISSING else year for year in values]
+		if name + _JSON in self.files:
+			# Non-string values, like the lists of ISSNs `_collapse` can give
+			is_json = self._arrays[name + _JSON][start:stop].tolist()
+			values = [json.loads(value) if flag else value
+						for value, flag in zip(values, is_json)]
+		return values
+
+	def records(self, columns = None, start = 0, stop = None):
+		'''
+		The papers as dicts, as they'd be read from the JSON
+
+		:param columns: The fields to include; defaults to all of them
+		:param start, stop: The range of papers to give; defaults to all of them
+		:return: A list of dicts
+		'''
+		if columns is None:
+			columns = self.columns()
+		columns = [column for column in columns if self.has_column(column)]
+		values = [self.values(column, start, stop) for column in columns]
+		return [dict(zip(columns, paper)) for paper in zip(*values)]
+
+
+def _build_arrays(papers, interner, chunk_size = CHUNK_SIZE):
+	'''
+	The columns of a store, as a dict of arrays.  The papers are converted
+	`chunk_size` at a time, so `papers` can be a generator over a file
+	whose papers wouldn't all fit in memory as dicts.
+	'''
+	papers = iter(papers)
+	chunks = []
+	while True:
+		chunk = list(itertools.islice(papers, chunk_size))
+		chunks += [_chunk_arrays(chunk, interner)]
+		if len(chunk) < chunk_size:
+			break
+	if len(chunks) == 1:
+		return chunks[0]
+	return _concatenate(chunks)
+
+
+def _concatenate(chunks):
+	'''
+	Join the columns converted by `_chunk_arrays`
+	'''
+	names = []
+	for chunk in chunks:
+		names += [name for name in chunk if name not in names]
+	arrays = {}
+	for name in names:
+		if name.endswith(_OFFSETS):
+			# Shift each chunk's offsets past the values before it
+			parts = [np.zeros(1, dtype = np.int64)]
+			total = 0
+			for chunk in chunks:
+				parts += [chunk[name][1:] + total]
+				total += chunk[name][-1]
+			arrays[name] = np.concatenate(parts)
+		elif name == 'core' or name.endswith(_JSON):
+			# Flags only written for chunks that have some set
+			arrays[name] = np.concatenate([chunk[name] if name in chunk else
+											np.zeros(len(chunk['sid']), dtype = bool)
+											for chunk in chunks])
+		else:
+			arrays[name] = np.concatenate([chunk[name] for chunk in chunks])
+	return arrays
+
+
+def _chunk_arrays(papers, interner):
+	'''
+	The columns for a list of papers
+	'''
+	strings = {column: [] for column in STRING_COLUMNS}
+	is_json = {column: [] for column in STRING_COLUMNS}
+	years = []
+	core = []
+	has_core = False
+	lists = {column: [] for column in LIST_COLUMNS}
+	lengths = {column: [] for column in LIST_COLUMNS}
+	for paper in papers:
+		for column in STRING_COLUMNS:
+			value = paper.get(column, '')
+			if isinstance(value, str):
+				strings[column] += [value]
+				is_json[column] += [False]
+			else:
+				strings[column] += [json.dumps(value)]
+				is_json[column] += [True]
+		year = paper.get('year')
+		years += [YEAR_MISSING if year is None else year]
+		if 'core' in paper:
+			has_core = True
+		core += [bool(paper.get('core', False))]
+		for column in LIST_COLUMNS:
+			values = paper.get(column, [])
+			lists[column] += values
+			lengths[column] += [len(values)]
+
+	arrays = {}
+	for column in STRING_COLUMNS:
+		arrays[column] = np.array(strings[column], dtype = str)
+		if any(is_json[column]):
+			arrays[column + _JSON] = np.array(is_json[column], dtype = bool)
+	arrays['year'] = np.array(years, dtype = np.int32)
+	if has_core:
+		arrays['core'] = np.array(core, dtype = bool)
+	for column in LIST_COLUMNS:
+		offsets = np.zeros(len(lengths[column]) + 1, dtype = np.int64)
+		np.cumsum(lengths[column], out = offsets[1:])
+		arrays[column + _OFFSETS] = offsets
+		arrays[column + _VALUES] = np.array(lists[column], dtype = str)
+	for column, namespace in INTERNED.items():
+		if column in LIST_COLUMNS:
+			arrays[column + _IDS] = interner.intern_many(namespace, lists[column])
+		else:
+			arrays[column + _IDS] = interner.intern_many(namespace, strings[column])
+	return arrays
+
+
+def write_store(papers, path, interner = None):
+	'''
+	Write papers to a store, replacing it atomically, and update the
+	interning table beside it
+
+	:param papers: Iterable of paper dicts, as in `papers.json`
+	:param path: The store, ending in `STORE_EXT`
+	:param interner: The interning table; defaults to the one beside `path`
+	:return: Number of papers written
+	'''
+	if interner is None:
+		interner = Interner(interning_path(path))
+	arrays = _build_arrays(papers, interner)
+	interner.save(interning_path(path))
+
+	# `np.savez` adds '.npz' to file names, but not to open files
+	with open(path + '.tmp', 'wb') as writefile:
+		np.savez(writefile, **arrays)
+	os.replace(path + '.tmp', path)
+	return len(arrays['sid'])
+
+
+def load_papers(path, columns = None):
+	'''
+	Read papers from either `papers.json` or a store
+
+	:param path: JSON file or store
+	:param columns: For a store, the fields to read; defaults to all of them.
+		JSON files are always read whole.
+	:return: A list of paper dicts
+	'''
+	if is_store(path):
+		with PaperStore(path) as store:
+			return store.records(columns)
+	if is_jsonl(path):
+		return list(iter_papers(path))
+	with open(path) as readfile:
+		return json.load(readfile)
+
+
+def iter_papers(path):
+	'''
+	Generate the papers in a file one at a time.  A JSON Lines file is read
+	a line at a time, and a store `CHUNK_SIZE` papers at a time; a JSON file
+	has to be loaded whole.
+
+	:param path: JSON file, JSON Lines file, or store
+	'''
+	if is_store(path):
+		with PaperStore(path) as store:
+			for start in range(0, len(store), CHUNK_SIZE):
+				for paper in store.records(start = start, stop = start + CHUNK_SIZE):
+					yield paper
+	elif is_jsonl(path):
+		with open(path) as readfile:
+			for line in readfile:
+				if line.strip() != '':
+					yield json.loads(line)
+	else:
+		with open(path) as readfile:
+			papers = json.load(readfile)
+		for paper in papers:
+			yield paper
+
+
+def write_jsonl(papers, path):
+	'''
+	Write papers to a JSON Lines file, one paper per line, replacing it
+	atomically
+
+	:param papers: Iterable of paper dicts
+	:return: Number of papers written
+	'''
+	count = 0
+	with open(path + '.tmp', 'w') as writefile:
+		for paper in papers:
+			writefile.write(json.dumps(paper) + '\n')
+			count += 1
+	os.replace(path + '.tmp', path)
+	return count
+
+
+def open_papers(path):
+	'''
+	Columnar access to a store, `papers.json`, or `papers.jsonl`.  A JSON
+	or JSON Lines file is converted in memory, interning any new IDs in the
+	table beside it.  JSON Lines is read one paper at a time, so only the
+	columns are ever held in memory; JSON has to be loaded whole first.
+
+	:return: A `PaperStore`
+	'''
+	if is_store(path):
+		return PaperStore(path)
+	interner = Interner(interning_path(path))
+	arrays = _build_arrays(iter_papers(path), interner)
+	interner.save(interning_path(path))
+	return PaperStore(path, arrays = arrays, interner = interner)
+
+
+def from_records(papers, interner = None):
+	'''
+	Columnar access to a list of paper dicts, converted in memory
+
+	:param papers: Iterable of paper dicts, as in `papers.json`
+	:param interner: The interning table; defaults to a new, empty one
+	:return: A `PaperStore`
+	'''
+	if interner is None:
+		interner = Interner()
+	return PaperStore(None, arrays = _build_arrays(papers, interner),
+						interner = interner)
+
+
+def save_papers(papers, path):
+	'''
+	Write papers to a JSON file, a JSON Lines file, or a store
+	'''
+	if is_store(path):
+		write_store(papers, path)
+	elif is_jsonl(path):
+		write_jsonl(papers, path)
+	else:
+		with open(path, 'w') as writefile:
+			json.dump(papers, writefile)
+
+
+def convert(in_path, out_path):
+	'''
+	Convert between formats, e.g., `papers.json` to a store.  Only writing
+	JSON needs all of the papers in memory at once.
+
+	:return: Number of papers converted
+	'''
+	if is_store(out_path):
+		return write_store(iter_papers(in_path), out_path)
+	if is_jsonl(out_path):
+		return write_jsonl(iter_papers(in_path), out_path)
+	papers = list(iter_papers(in_path))
+	save_papers(papers, out_path)
+	return len(papers)
+
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print('Usage:  python paperstore.py papers.json papers.npz')
+		print('        (or any of .json, .jsonl and .npz, in either position)')
+		sys.exit(1)
+	print(str(convert(sys.argv[1], sys.argv[2])) + ' papers converted')
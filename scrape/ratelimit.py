@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+'''
+A token-bucket rate limiter shared by everything that talks to the Scopus API.
+
+Scopus enforces two limits at once:  a per-second throttle and a weekly quota
+(the "limit cap" that had to be negotiated up for this project).  A single
+`TokenBucket` tracks both, so that every caller -- the plain `get_meta_by_*`
+functions, the threads behind `scrape.fetch_many`, etc. -- draws from the same
+budget.
+'''
+
+import asyncio
+import threading
+import time
+
+
+class QuotaExceeded(Exception):
+    pass
+
+
+class TokenBucket:
+    '''
+    Token bucket with an optional quota over a longer window.
+
+    Tokens refill continuously at `rate` per second, up to `capacity`.
+    Each request takes one token.  Independently, at most `quota` requests
+    are allowed in each `quota_period`-second window; once that is used up,
+    `acquire` raises `QuotaExceeded` rather than sleeping for days.
+    '''
+    def __init__(self, rate, capacity = None, quota = None,
+                    quota_period = 7*24*60*60, quota_used = 0,
+                    window_start = None):
+        '''
+        :param rate: Sustained requests per second
+        :param capacity: Maximum burst size; defaults to `rate` (at least 1)
+        :param quota: Maximum requests per quota window, or None for no quota
+        :param quota_period: Length of the quota window, in seconds
+        :param quota_used: Requests already used in the current window
+        :param window_start: Start of the current window, as a Unix timestamp
+        '''
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1, rate)
+        self.quota = quota
+        self.quota_period = quota_period
+        self.quota_used = quota_used
+        self.window_start = window_start if window_start is not None else time.time()
+
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        # Called with the lock held
+        now = time.monotonic()
+        self._tokens = min(self.capacity,
+                            self._tokens + (now - self._last) * self.rate)
+        self._last = now
+        # Roll over the quota window if it has expired
+        if time.time() - self.window_start >= self.quota_period:
+            self.window_start = time.time()
+            self.quota_used = 0
+
+    def quota_remaining(self):
+        '''
+        :return: Requests left in the current quota window, or None if there's no quota
+        '''
+        with self._lock:
+            self._refill()
+            if self.quota is None:
+                return None
+            return max(0, self.quota - self.quota_used)
+
+    def _reserve(self):
+        '''
+        Try to take a token.
+        :return: 0 if a token was taken, otherwise the number of seconds to
+            wait before trying again
+        '''
+        with self._lock:
+            self._refill()
+            if self.quota is not None and self.quota_used >= self.quota:
+                raise QuotaExceeded('Quota of ' + str(self.quota) +
+                                    ' requests used up for this window')
+            if self._tokens >= 1:
+                self._tokens -= 1
+                self.quota_used += 1
+                return 0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        '''
+        Block until a request is allowed.
+        '''
+        delay = self._reserve()
+        while delay > 0:
+            time.sleep(delay)
+            delay = self._reserve()
+
+    async def acquire_async(self):
+        '''
+        Like `acquire`, but yields to the event loop instead of blocking.
+        '''
+        delay = self._reserve()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self._reserve()
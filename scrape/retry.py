@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+Retry policy for `scrape._get_query`:  jittered exponential backoff that
+honors `Retry-After` and the Scopus `X-RateLimit-*` headers, plus a circuit
+breaker.
+
+A single `RetryPolicy` is shared by everyone making requests.  A backoff
+triggered by one caller applies to all of them -- the other threads in
+`scrape.fetch_many` wait too, instead of each one discovering the rate limit
+for itself.
+'''
+
+import email.utils
+import random
+import threading
+import time
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def _parse_retry_after(value):
+    '''
+    `Retry-After` is either a number of seconds or an HTTP date.
+    :return: Seconds to wait, or None if the header can't be read
+    '''
+    if value is None:
+        return None
+    try:
+        return max(0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0, when.timestamp() - time.time())
+
+
+class RetryPolicy:
+    '''
+    Decides whether and how long to wait before retrying a failed request,
+    and keeps the shared backoff and circuit-breaker state.
+    '''
+    # HTTP status codes worth retrying
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, max_attempts = 5, base_delay = 5, max_delay = 3*60,
+                    breaker_threshold = 10, breaker_cooldown = 15*60):
+        '''
+        :param max_attempts: Attempts per request before giving up
+        :param base_delay: Delay, in seconds, after the first failure;
+            doubled after each further failure
+        :param max_delay: Upper bound on the exponential delay
+        :param breaker_threshold: Consecutive failures, across all callers,
+            that open the circuit breaker
+        :param breaker_cooldown: Seconds the breaker stays open before letting
+            a trial request through
+        '''
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.retry_statuses = self.RETRY_STATUSES
+
+        # Shared state
+        self.consecutive_failures = 0
+        self.backoff_until = 0          # No one sends a request before this time
+        self.circuit_open_until = None  # Breaker is open until this time
+        # Most recent `X-RateLimit-*` values seen from the server
+        self.ratelimit_limit = None
+        self.ratelimit_remaining = None
+        self.ratelimit_reset = None
+        self._lock = threading.Lock()
+
+    def wait_turn(self):
+        '''
+        Call before each request.  Sleep through any shared backoff.
+        Raises `CircuitOpen` while the breaker is open.
+        '''
+        with self._lock:
+            if self.circuit_open_until is not None:
+                if time.time() < self.circuit_open_until:
+                    raise CircuitOpen('Too many consecutive failures; ' +
+                                        'not sending requests until ' +
+                                        time.strftime('%c',
+                                            time.localtime(self.circuit_open_until)))
+                # Half-open:  let requests through, but the next failure
+                #  opens the breaker again
+                self.circuit_open_until = None
+            delay = self.backoff_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _read_ratelimit_headers(self, response):
+        # Called with the lock held
+        headers = response.headers
+        try:
+            if 'X-RateLimit-Limit' in headers:
+                self.ratelimit_limit = int(headers['X-RateLimit-Limit'])
+            if 'X-RateLimit-Remaining' in headers:
+                self.ratelimit_remaining = int(headers['X-RateLimit-Remaining'])
+            if 'X-RateLimit-Reset' in headers:
+                # Scopus gives the reset time as a Unix timestamp
+                self.ratelimit_reset = float(headers['X-RateLimit-Reset'])
+        except ValueError:
+            pass
+
+    def on_success(self, response):
+        '''
+        Call after a request that doesn't need to be retried.
+        '''
+        with self._lock:
+            self.consecutive_failures = 0
+            self._read_ratelimit_headers(response)
+            # If that used up the quota, everyone waits for the reset
+            if self.ratelimit_remaining == 0 and self.ratelimit_reset is not None:
+                self.backoff_until = max(self.backoff_until, self.ratelimit_reset)
+
+    def on_failure(self, attempt, response = None, error = None):
+        '''
+        Call after a request fails, with either the response or the exception.
+        :param attempt: Number of attempts made so far for this request
+        :param response: The `requests.Response`, for retryable status codes
+        :param error: The exception, for timeouts and connection errors
+        :return: Seconds every caller will now wait, or None if this request
+            should not be retried
+        '''
+        with self._lock:
+            self.consecutive_failures += 1
+            now = time.time()
+
+            # The server's own instructions come first
+            delay = None
+            if response is not None:
+                self._read_ratelimit_headers(response)
+                delay = _parse_retry_after(response.headers.get('Retry-After'))
+                if (delay is None and self.ratelimit_remaining == 0 and
+                        self.ratelimit_reset is not None):
+                    delay = max(0, self.ratelimit_reset - now)
+            if delay is None:
+                # Exponential backoff with jitter:  somewhere between half and
+                #  all of base_delay * 2^(attempt-1)
+                delay = min(self.max_delay, self.base_delay * 2**(attempt - 1))
+                delay = delay/2 + random.uniform(0, delay/2)
+            self.backoff_until = max(self.backoff_until, now + delay)
+
+            if self.consecutive_failures >= self.breaker_threshold:
+                self.circuit_open_until = now + max(delay, self.breaker_cooldown)
+
+            if attempt >= self.max_attempts:
+                return None
+            return self.backoff_until - now
@@ -3,13 +3,16 @@
 Starting with the `csv` file for generation 1, retrieve the desired metadata.  
 '''
 
-import batch
-import csv
+import atexit
+import crawl
+import paperstore
 
 import os
 import random
 import pandas as pd
 from scrape import *
+from scheduler import Scheduler
+import session
 import sys
 import time
 
@@ -18,246 +21,160 @@ import time
 infile1 = 'gen 01 2016-03-30.xlsx'
 infile2 = 'gen 01 2016-04-04.xlsx'
 
-# Files to save the scraped data
-gen_1_outfile = 'gen_1.json'
-gen_0_outfile = 'gen_0.json'
-gen_n1_outfile = 'gen_n1.json'
+# File to save the combined data from every generation
+#  (Each generation is also saved on its own, as `gen_1.json`, etc.)
+#  Use a name ending in `.npz` to write a columnar store instead of JSON; 
+#  see `paperstore.py`
 combined_outfile = 'papers.json'
 
+# Generations to crawl beyond generation +1, following references backwards
+crawl_depth = 2
+# If a generation would have this many new items or more, stop before it
+max_generation_size = 100000
+# Queue each generation with the most important items first:  None (the 
+#  order they were found), 'citations', 'core', or a scoring function.  
+#  With a priority, a generation over `max_generation_size` is cut down to 
+#  its top items instead of being dropped.  See `crawl.py`.  
+crawl_priority = None
+# Maximum number of items to retrieve over the whole crawl, or None
+crawl_budget = None
+# Build the last generation from what the bibliographies of the generation 
+#  before it say about the papers they cite, instead of retrieving it.  
+#  Saves one API call per item, but the stubs have no DOIs or author IDs.  
+#  See `stubs.py`.  
+leaf_from_stubs = False
+
 # File with the DOIs for the core set
 css_dois_file = 'css_dois.json'
 
+# Retrieve generations 0 and -1 in chunks with the Scopus search API, 
+#  rather than one abstract retrieval call per SID?  
+#  See `scrape.search_meta_by_scopus`
+bulk_search = False
+bulk_chunk_size = 25
+
+# Size each batch session to the remaining API quota, and wait for the 
+#  quota to reset when it runs out.  See `scheduler.py`.  
+schedule = Scheduler(policy = RETRY_POLICY, auto_resume = True)
+
+def retrieve_gen(chunk_retrieve, item_retrieve, **kwargs):
+	'''
+	Run the current batch, with either the bulk or per-item retrieve function
+	'''
+	if bulk_search:
+		return schedule.run(lambda items: chunk_retrieve(items, **kwargs), 
+								chunk_size = bulk_chunk_size)
+	return schedule.run(item_retrieve)
+
 print('Run started at ' + time.strftime('%c', time.localtime()))
+# Report how many connections were reused, however the run ends
+atexit.register(session.print_stats)
 
 # A file to track the status of the scrape
 status_file = 'status.json'
+# Steps of the status file from before the crawler, and their generations
+legacy_steps = [('1', 1), ('2a', 0), ('2b', -1)]
+legacy_status = None
 if os.access(status_file, os.R_OK):
 	with open(status_file) as readfile:
 		status = json.load(readfile)
+	if 'crawl' not in status:
+		# Steps 1, 2a and 2b were the crawl
+		legacy_status = status
+		status = {'crawl': {'start': status['1']['start'], 
+							'finish': status['2b']['finish']}, 
+					'3': status['3'], '4': status['4']}
 else:
 	status = {
-		# Generation +1
-		'1': {'start': False, 'finish': False},
-		# Generation 0
-		'2a': {'start': False, 'finish': False},
-		# Generation -1
-		'2b': {'start': False, 'finish': False},
+		# Generation +1, and the generations crawled from it
+		'crawl': {'start': False, 'finish': False},
 		# Set core set metadata
 		'3': {'start': False, 'finish': False}, 
 		# Print a sample of IDs for validation
 		'4': {'start': False, 'finish': False}}
 
+def run_gen(generation, leaf):
+	'''
+	Run the current batch of the crawl within the quota
+	'''
+	schedule.print_projection(status)
+	if generation == 1:
+		batch_response = schedule.run(get_meta_by_doi)
+	else:
+		# The references of the last generation aren't followed, 
+		#  so the search view is enough
+		batch_response = retrieve_gen(search_meta_by_scopus, get_meta_by_scopus, 
+										references = not leaf)
+	if batch_response == False:
+		raise Exception('Error running batch')
+
+# With the 'core' priority, items are ranked by how many core papers reach them
+core_dois = None
+if crawl_priority == 'core' and os.access(css_dois_file, os.R_OK):
+	with open(css_dois_file) as readfile:
+		core_dois = json.load(readfile)
+crawler = crawl.Crawler(depth = crawl_depth, direction = 'backward', 
+						max_generation_size = max_generation_size, 
+						priority = crawl_priority, core_dois = core_dois, 
+						budget = crawl_budget, leaf_stubs = leaf_from_stubs)
+if leaf_from_stubs:
+	# Parse the reference stubs along with the rest of the metadata
+	import scrape
+	scrape.REFERENCE_STUBS = True
+
+if (legacy_status is not None and status['crawl']['start'] and 
+		not status['crawl']['finish'] and not crawler.started()):
+	# Pick up the crawl where the old steps left it:  the generations 
+	#  they finished, and the one whose batch they started, if any
+	finished = [generation for step, generation in legacy_steps 
+					if legacy_status[step]['finish']]
+	current = [generation for step, generation in legacy_steps 
+					if legacy_status[step]['start'] and 
+						not legacy_status[step]['finish']]
+	print('Resuming the crawl from the old status file')
+	crawler.adopt(finished, current[0] if current else None)
+if legacy_status is not None:
+	with open(status_file, 'w') as writefile:
+		json.dump(status, writefile)
 
 
-# Step 1:  Define core set and retrieve metadata
 
-if status['1']['start'] == False:
+# Steps 1 and 2:  Define core set, retrieve metadata, and crawl backwards 
+#  from it.  See `crawl.py`.  
+
+if status['crawl']['start'] == False:
 	# Get the DOIs manually retrieved from Scopus
 	dois1 = pd.read_excel(infile1)['DOI'].tolist()
 	dois2 = pd.read_excel(infile2)['DOI'].tolist()
 	gen_1_doi = list(set(dois1 + dois2))
 	#print(gen_1_doi)
-	print(str(len(gen_1_doi)) + ' items in generation +1')
 
-	if not batch.exists_batch():
+	if not crawler.started():
 		print('Setting batch for generation +1')
-		batch_response = batch.set_batch(gen_1_doi)
-
-	if batch_response == True:
-		status['1']['start'] = True
-		with open(status_file, 'w') as writefile:
-			json.dump(status, writefile)
-	else:	
-		raise Exception('Error setting batch')
-
-if status['1']['finish'] == False:
-	if batch.exists_batch():
-		# Run the batch
-		print('Running batch for generation +1')
-		batch_response = batch.run_batch(get_meta_by_doi)
-
-	# If the batch finished on this run, or previously, exists_batch will return False
-	if batch.exists_batch():
-		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
-		sys.exit(0)
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		gen_1 = batch.retrieve_batch()
-		# Write them to a permanent file
-		with open(gen_1_outfile, 'w') as writefile:
-			json.dump(gen_1, writefile)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Finished with step 1
-		status['1']['finish'] = True
-		with open(status_file, 'w') as writefile:
-			json.dump(status, writefile)
-
+		crawler.start(gen_1_doi)
 
+	status['crawl']['start'] = True
+	with open(status_file, 'w') as writefile:
+		json.dump(status, writefile)
 
-# Step 2:  Two generation backwards search
-
-if status['2a']['start'] == False:
-	# Load generation 1
-	with open(gen_1_outfile) as readfile:
-		gen_1 = json.load(readfile)
-	# Extract the generation 1 SIDs
-	gen_1_sid = [paper['sid'] for paper in gen_1]
-	# Extract the references
-	#  This isn't perspicuous.  
-	#  `for paper in gen_1` gets every paper in generation 1
-	#  `if 'references' in paper` filters out the papers without reference lists
-	#  `for reference in paper['references']` unpacks the list of references
-	#  Extracting as a set removes redundancies automatically
-	gen_0_sid = {reference for paper in gen_1 
-								if 'references' in paper 
-							for reference in paper['references']}
-	# Remove the SIDs that we've already scraped
-	gen_0_sid = {sid for sid in gen_0_sid if sid not in gen_1_sid}
-
-	print(str(len(gen_0_sid)) + ' items in generation 0')
-	
-	if not batch.exists_batch():
-		print('Setting batch for generation 0')
-		batch_response = batch.set_batch(list(gen_0_sid))
-		
-	if batch_response == True:
-		status['2a']['start'] = True
-		with open(status_file, 'w') as writefile:
-			json.dump(status, writefile)
-	else:
-		raise Exception('Error setting batch')
-		
-if status['2a']['finish'] == False:
-	# Run the batch
-	print('Running batch for generation 0')
-	batch_response = batch.run_batch(get_meta_by_scopus)
-	if batch_response == False:
-		raise Exception('Error running batch')
-		
-	# If the batch finished on this run, exists_batch will return False
-	if batch.exists_batch():
+if status['crawl']['finish'] == False:
+	if not crawler.run(run_gen):
 		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
 		sys.exit(0)
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		gen_0 = batch.retrieve_batch()
-		# Write them to a permanent file
-		with open(gen_0_outfile, 'w') as writefile:
-			json.dump(gen_0, writefile)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Finished with step 2a
-		status['2a']['finish'] = True
-		with open(status_file, 'w') as writefile:
-			json.dump(status, writefile)
-			
-if status['2b']['start'] == False:
-	with open(gen_0_outfile) as readfile:
-		gen_0 = json.load(readfile)
-	# Extract the SIDs
-	gen_0_sid = {paper['sid'] for paper in gen_0}
-	gen_n1_sid = {reference for paper in gen_0 
-								if 'references' in paper 
-							for reference in paper['references']}
-	print('Total ' + str(len(gen_n1_sid)) + ' references extracted from generation 0')
-
-	# Remove the SIDs scraped in generation 0
-	print('Filtering out generation 0 SIDs')
-	gen_n1_sid = {sid for sid in gen_n1_sid if sid not in gen_0_sid}
-	print('Done')
-	
-	# Load the generation 1 SIDs
-	print('Filtering out generation 1 SIDs')
-	with open(gen_1_outfile) as readfile:
-		gen_1 = json.load(readfile)
-	gen_1_sid = {paper['sid'] for paper in gen_1}
-	# And remove the SIDs scraped in generation 1
-	gen_n1_sid = {sid for sid in gen_n1_sid if sid not in gen_1_sid}
-	print('Done')
-
-	print(str(len(gen_n1_sid)) + ' new items in generation -1')
 	
-	# If there are more than 100,000 new items to retrieve, we'll cut things short here
-	if len(gen_n1_sid) < 100000:
-		if not batch.exists_batch():
-			print('Setting batch for generation -1')
-			batch_response = batch.set_batch(list(gen_n1_sid))
-		else:
-			raise Exception('Error setting batch')
-		
-		if batch_response == True:
-			status['2b']['start'] = True
-			with open(status_file, 'w') as writefile:
-				json.dump(status, writefile)
-		else:
-			raise Exception('Error setting batch')
-	else:
-		status['2b']['start'] = True
-		# Combine both generations
-		all_papers = gen_1 + gen_0
-		# And write them to a permanent file
-		with open(combined_outfile, 'w') as writefile:
-			json.dump(all_papers, writefile)
-
-		print()
-		print('Totals:')
-		print('Generation +1: ' + str(len(gen_1)))
-		print('Generation 0: ' + str(len(gen_0)))
-		print('All papers: ' + str(len(all_papers)))
-		print()
-		status['2b']['finish'] = True
-		
-if status['2b']['finish'] == False:
-	# Run the batch
-	print('Running batch for generation -1')
-	batch_response = batch.run_batch(get_meta_by_scopus)
-	if batch_response == False:
-		raise Exception('Error running batch')
-		
-	# If the batch finished on this run, exists_batch will return False
-	if batch.exists_batch():
-		# Exit gracefully
-		print('Finished the current batch run; batch not finished')
-		sys.exit(0)
-	else:
-		print('Finished the batch; moving data and cleaning up')
-		# Retrieve the batch results
-		gen_n1 = batch.retrieve_batch()
-		# Write them to a permanent file
-		with open(gen_n1_outfile, 'w') as writefile:
-			json.dump(gen_n1, writefile)
-		# Clean up the batch output
-		batch.clean_batch()
-		
-		# Combine all three generations
-		with open(gen_1_outfile) as readfile:
-			gen_1 = json.load(readfile)
-		with open(gen_0_outfile) as readfile:
-			gen_0 = json.load(readfile)
-		all_papers = gen_1 + gen_0 + gen_n1
-		# And write them to a permanent file
-		with open(combined_outfile, 'w') as writefile:
-			json.dump(all_papers, writefile)
-
-		print()
-		print('Totals:')
-		print('Generation +1: ' + str(len(gen_1)))
-		print('Generation 0: ' + str(len(gen_0)))
-		print('Generation -1: ' + str(len(gen_n1)))
-		print('All papers: ' + str(len(all_papers)))
-		print()
-
-		# Finished with step 2a
-		status['2b']['finish'] = True
-		with open(status_file, 'w') as writefile:
-			json.dump(status, writefile)
+	# Combine all of the generations
+	totals = crawler.combine(combined_outfile)
+	print()
+	print('Totals:')
+	for generation, total in totals.items():
+		print('Generation ' + crawl.gen_label(generation) + ': ' + str(total))
+	print('All papers: ' + str(sum(totals.values())))
+	print()
+
+	# Finished with steps 1 and 2
+	status['crawl']['finish'] = True
+	with open(status_file, 'w') as writefile:
+		json.dump(status, writefile)
 
 
 
@@ -266,16 +183,14 @@ if status['2b']['finish'] == False:
 if status['3']['start'] == False:
 	print('Setting core set metadata')
 
-	with open(combined_outfile) as readfile:
-		all_papers = json.load(readfile)
+	all_papers = paperstore.load_papers(combined_outfile)
 	with open(css_dois_file) as readfile:
 		core_doi = json.load(readfile)
 
 	for paper in all_papers:
 		paper['core'] = (paper['doi'] in core_doi)
 	
-	with open(combined_outfile, 'w') as writefile:
-		json.dump(all_papers, writefile)
+	paperstore.save_papers(all_papers, combined_outfile)
 	
 	core_set = [paper for paper in all_papers if paper['core']]
 	print('Core set: ' + str(len(core_set)))
@@ -292,8 +207,7 @@ if status['3']['start'] == False:
 # Step 4:  Generate a list of 100 entries for validation
 
 if status['4']['start'] == False:
-	with open(combined_outfile) as readfile:
-		all_papers = json.load(readfile)
+	all_papers = paperstore.load_papers(combined_outfile, columns = ('sid',))
 	all_papers_sid = {paper['sid'] for paper in all_papers}
 
 	random.seed(1234567)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+'''
+This module sizes each `batch.run_batch` session to the API quota that's
+actually left, instead of the fixed guess in `batch.MAX_RUN_LEN`.
+
+The remaining quota comes from the `X-RateLimit-*` headers Scopus sends with
+each response (as recorded by the `retry.RetryPolicy`), or, before any
+requests have been made, from a budget file like this:
+
+	{"limit": 20000, "remaining": 12500, "reset": 1460937600,
+	 "period": 604800}
+
+where `reset` is the Unix time at which the quota window resets and `period`
+is the length of the window in seconds.  The file is updated after every
+session, so the next run starts from the last known budget.
+'''
+
+import json
+import math
+import os
+import time
+
+import batch
+
+BUDGET_FILE = 'quota.json'		# File with the last known quota
+QUOTA_PERIOD = 7*24*60*60		# Default quota window:  one week
+DEFAULT_RATE = 0.5				# Items per second, until we've measured it
+
+
+class Scheduler:
+	'''
+	Plans and runs batch sessions within the remaining quota.
+	'''
+	def __init__(self, budget_file = BUDGET_FILE, policy = None,
+					calls_per_item = 1, reserve = 0, auto_resume = True):
+		'''
+		:param budget_file: JSON file with the last known quota
+		:param policy: A `retry.RetryPolicy`, for the quota in response headers
+		:param calls_per_item: Average API calls needed per item
+		:param reserve: Calls to leave unused in each window
+		:param auto_resume: When the quota runs out, sleep until the window
+			resets and carry on, rather than returning
+		'''
+		self.budget_file = budget_file
+		self.policy = policy
+		self.calls_per_item = calls_per_item
+		self.reserve = reserve
+		self.auto_resume = auto_resume
+
+		self.limit = batch.MAX_RUN_LEN
+		self.remaining = batch.MAX_RUN_LEN
+		self.reset = None
+		self.period = QUOTA_PERIOD
+		self.rate = DEFAULT_RATE
+		if os.access(budget_file, os.R_OK):
+			with open(budget_file) as readfile:
+				budget = json.load(readfile)
+			self.limit = budget.get('limit', self.limit)
+			self.remaining = budget.get('remaining', self.limit)
+			self.reset = budget.get('reset', None)
+			self.period = budget.get('period', self.period)
+			self.rate = budget.get('rate', self.rate)
+		self._roll_window()
+
+	def _roll_window(self):
+		'''
+		If the quota window has reset since we last looked, start a new one
+		'''
+		if self.reset is not None and time.time() >= self.reset:
+			# Skip over any windows that passed while we weren't running
+			windows = math.floor((time.time() - self.reset) / self.period) + 1
+			self.reset += windows * self.period
+			self.remaining = self.limit
+
+	def update(self, calls_used = 0):
+		'''
+		Update the quota after a session, preferring the server's headers
+
+		:param calls_used: API calls made in the session, used only if
+			the server hasn't told us the remaining quota
+		'''
+		if self.policy is not None and self.policy.ratelimit_remaining is not None:
+			self.remaining = self.policy.ratelimit_remaining
+			if self.policy.ratelimit_limit is not None:
+				self.limit = self.policy.ratelimit_limit
+			if self.policy.ratelimit_reset is not None:
+				self.reset = self.policy.ratelimit_reset
+		else:
+			self.remaining = max(0, self.remaining - calls_used)
+		self._roll_window()
+		self.save()
+
+	def save(self):
+		with open(self.budget_file, 'w') as writefile:
+			json.dump({'limit': self.limit, 'remaining': self.remaining,
+						'reset': self.reset, 'period': self.period,
+						'rate': self.rate}, writefile)
+
+	def plan_run(self, pending):
+		'''
+		:param pending: Number of items left in the batch
+		:return: Number of items to retrieve in the next session
+		'''
+		self._roll_window()
+		affordable = math.floor((self.remaining - self.reserve) / self.calls_per_item)
+		return max(0, min(pending, affordable))
+
+	def wait_for_reset(self):
+		'''
+		Sleep until the quota window resets
+		'''
+		if self.reset is None:
+			# We don't know when the window resets; assume a full period
+			self.reset = time.time() + self.period
+		delay = max(0, self.reset - time.time())
+		print('Quota used up; pausing until ' +
+				time.strftime('%c', time.localtime(self.reset)))
+		time.sleep(delay)
+		self._roll_window()
+		print('Quota window reset; resuming')
+
+	def projected_finish(self, items):
+		'''
+		Project when `items` more items will be retrieved, given the
+		remaining quota, the quota windows still to come, and the measured rate
+
+		:param items: Number of items
+		:return: Projected finish, as a Unix timestamp
+		'''
+		now = time.time()
+		calls = items * self.calls_per_item
+		available = max(0, self.remaining - self.reserve)
+		if calls <= available:
+			return now + items / self.rate
+		# Use up this window, then as many full windows as we need
+		per_window = max(1, self.limit - self.reserve)
+		windows = math.ceil((calls - available) / per_window)
+		reset = self.reset if self.reset is not None else now + self.period
+		last_window_calls = (calls - available) - (windows - 1) * per_window
+		return (reset + (windows - 1) * self.period +
+				last_window_calls / self.calls_per_item / self.rate)
+
+	def print_projection(self, status, estimates = None):
+		'''
+		Print the projected completion time for each batch step in the
+		`run_scrape` status file, and for the whole pipeline
+
+		:param status: The `run_scrape` status dict
+		:param estimates: Estimated sizes of batch steps that haven't started,
+			keyed by step
+		'''
+		if estimates is None:
+			estimates = {}
+		print('Quota:  ' + str(self.remaining) + ' of ' + str(self.limit) +
+				' calls remaining')
+		total = 0
+		unknown = []
+		for step, step_status in sorted(status.items()):
+			if step_status['finish']:
+				continue
+			if step_status['start'] and batch.exists_batch():
+				items = len(batch.pending_items())
+			elif step in estimates:
+				items = estimates[step]
+			else:
+				unknown += [step]
+				continue
+			total += items
+			print('Step ' + step + ':  ' + str(items) + ' items; done by ' +
+					time.strftime('%c', time.localtime(self.projected_finish(total))))
+		if unknown:
+			print('Steps ' + ', '.join(unknown) + ' not yet sized; ' +
+					'projection covers the known items only')
+		print('Projected completion:  ' +
+				time.strftime('%c', time.localtime(self.projected_finish(total))))
+
+	def run(self, retrieve, chunk_size = None, workers = None):
+		'''
+		Run batch sessions sized to the remaining quota, until the batch is
+		finished or (if not `auto_resume`) the quota runs out
+
+		:param retrieve: The function used to retrieve the data
+		:param chunk_size: Passed on to `batch.run_batch`
+		:param workers: If given, run each session with this many workers,
+			using `batch.run_batch_parallel`
+
+		:return: True iff the sessions ran without errors (False, too, if a
+			whole quota window can't cover a single item)
+		'''
+		while batch.exists_batch():
+			pending = len(batch.pending_items())
+			n_items = self.plan_run(pending)
+			if n_items == 0:
+				if not self.auto_resume:
+					print('No quota left for this window')
+					return True
+				if self.limit - self.reserve < self.calls_per_item:
+					# Waiting for the reset wouldn't help
+					print('A quota window of ' + str(self.limit) + ' calls, less the ' +
+							'reserve of ' + str(self.reserve) + ', can\'t cover an ' +
+							'item of ' + str(self.calls_per_item) + ' calls')
+					return False
+				self.wait_for_reset()
+				continue
+			print('Scheduling ' + str(n_items) + ' of ' + str(pending) +
+					' items for this session')
+			start = time.time()
+			try:
+				if workers is None:
+					batch_response = batch.run_batch(retrieve, chunk_size = chunk_size,
+														max_items = n_items)
+				else:
+					batch_response = batch.run_batch_parallel(retrieve, workers = workers,
+																chunk_size = chunk_size,
+																max_items = n_items)
+			finally:
+				done = pending - (len(batch.pending_items())
+									if batch.exists_batch() else 0)
+				if done > 0 and time.time() > start:
+					self.rate = done / (time.time() - start)
+				self.update(calls_used = done * self.calls_per_item)
+			if not batch_response:
+				return False
+		return True
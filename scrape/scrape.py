@@ -7,24 +7,80 @@ Note that these functions need a Scopus API key defined in `api_key.py`.
 A new Scopus API key can be generated by registering for free [on the Scopus API page](http://dev.elsevier.com/index.html). 
 '''
 
+import asyncio
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
 import requests
 import json
+import threading
+from urllib.parse import quote
 #from math import ceil
 import pandas as pd
-import time
 import xmltodict
+import xml.etree.ElementTree as ET
 
 from api_key import MY_API_KEY
+from cache import CacheMiss, ResponseCache
+import metrics
+from ratelimit import TokenBucket
+from retry import RetryPolicy
+import session
 
 class ParseError(Exception):
     pass
 
-def _parse_scopus_metadata(response_raw):
+# Which parser `_parse_scopus_metadata` uses:  
+#  'stream' reads only the fields we need, with `ElementTree.iterparse`
+#  'xmltodict' converts the whole response to nested dicts first (the old parser)
+#  Both return the same metadata; keep 'xmltodict' around for comparison.  
+PARSER = 'stream'
+
+# Should `_parse_scopus_metadata` also return a stub record for each entry 
+#  in the bibliography?  See `_reference_stub` and `stubs.py`.  
+REFERENCE_STUBS = False
+
+def _parse_scopus_metadata(response_raw, parser = None, stubs = None):
     '''
     Given the `requests.Response`, parse the XML metadata.
     Metadata to gather:  DOI, Scopus ID, author IDs, source ID, year, references.
     :param response_raw: XML metadata, retrieved from Scopus using requests.get
+    :param parser: 'stream' or 'xmltodict'; defaults to `PARSER`
+    :param stubs: Also return reference stubs?  Defaults to `REFERENCE_STUBS`; 
+        needs the 'stream' parser
+    :return: A dict of metadata:
+        'doi': The paper's DOI
+        'sid': The paper's Scopus ID
+        'pmid': The paper's PubMed ID
+        'authors': The paper's authors, as a list of Scopus author IDs
+        'source': The journal, etc., the paper was published in, as a Scopus source ID
+        'year': The publication year
+        'references': The paper's references, as a list of Scopus IDs
+        'reference_stubs': Only with `stubs`; a stub record for each entry 
+            in the bibliography, as from `_reference_stub`
+        'raw': The raw XML response from the server
+    '''
+    if parser is None:
+        parser = PARSER
+    if stubs is None:
+        stubs = REFERENCE_STUBS
+    if parser == 'stream':
+        return _parse_scopus_metadata_stream(response_raw, stubs)
+    elif parser == 'xmltodict':
+        if stubs:
+            raise ValueError('Reference stubs need the stream parser')
+        return _parse_scopus_metadata_xmltodict(response_raw)
+    else:
+        raise ValueError('Unknown parser ' + str(parser))
+
+
+def _parse_scopus_metadata_xmltodict(response_raw):
+    '''
+    Given the `requests.Response`, parse the XML metadata by converting 
+    the whole response with `xmltodict`.  
+    Metadata to gather:  DOI, Scopus ID, author IDs, source ID, year, references.
+    :param response_raw: XML metadata, retrieved from Scopus using requests.get
     :return: A dict of metadata:
         'doi': The paper's DOI
         'sid': The paper's Scopus ID
@@ -137,33 +193,390 @@ def _parse_scopus_metadata(response_raw):
     return {'doi': doi, 'sid': sid, 'pmid': pmid, 'authors': authors, 
                 'source': source, 'year': year, 'references': refs}
 
+def _local_name(tag):
+    '''
+    Strip the namespace from an ElementTree tag:  '{http://...}doi' -> 'doi'
+    '''
+    return tag.rsplit('}', 1)[-1]
+
+def _element_text(elem):
+    '''
+    The text of an element, the way `xmltodict` reports it:  
+    whitespace is stripped, and an empty element gives None
+    '''
+    if elem.text is None:
+        return None
+    return elem.text.strip() or None
+
+def _collapse(values):
+    '''
+    `xmltodict` gives a single value for one element, but a list for repeated ones
+    '''
+    if len(values) == 1:
+        return values[0]
+    return values
+
+# Paths, relative to an `abstracts-retrieval-response` element, read by 
+#  `_parse_scopus_metadata_stream`.  Namespace prefixes are dropped, so 
+#  `prism:doi` is just 'doi'.  
+_COREDATA_PATHS = {('coredata', 'doi'): 'doi', 
+                    ('coredata', 'identifier'): 'sid', 
+                    ('coredata', 'pubmed-id'): 'pmid', 
+                    ('coredata', 'issn'): 'issn', 
+                    ('coredata', 'isbn'): 'isbn'}
+_AUTHOR_PATH = ('authors', 'author')
+_YEAR_PATH = ('item', 'bibrecord', 'head', 'source', 'publicationyear')
+_REFERENCE_PATH = ('item', 'bibrecord', 'tail', 'bibliography', 'reference')
+_ITEMID_PATH = _REFERENCE_PATH + ('ref-info', 'refd-itemidlist', 'itemid')
+# Paths read for reference stubs
+_REF_YEAR_PATH = _REFERENCE_PATH + ('ref-info', 'ref-publicationyear')
+_REF_SOURCE_PATH = _REFERENCE_PATH + ('ref-info', 'ref-sourcetitle')
+_REF_AUTHOR_PATH = _REFERENCE_PATH + ('ref-info', 'ref-authors', 'author')
+_REF_AUTHOR_NAME_PATH = _REF_AUTHOR_PATH + ('indexed-name',)
+
+def _reference_stub(ref):
+    '''
+    Build a stub record from what a bibliography entry says about the 
+    paper it cites.  Stubs have the same keys as full records, plus:  
+        'stub': True
+        'source_title': The title of the journal, etc., as printed in the 
+            bibliography.  ('source' is left empty, since the bibliography 
+            doesn't give an ISSN.)  
+        'author_names': The authors' indexed names, e.g., 'Smith A.'  
+            ('authors' has Scopus author IDs only if the entry gives them, 
+            which it usually doesn't.)  
+    :param ref: What the stream parser collected for one `reference`
+    :return: The stub, or None if the entry doesn't identify the paper
+    '''
+    # Prefer the Scopus ID (`idtype="SGR"`), as the reference list does
+    sids = [text for idtype, text in ref['itemids'] if text is not None]
+    sgr = [text for idtype, text in ref['itemids'] 
+            if idtype == 'SGR' and text is not None]
+    if sgr:
+        sid = sgr[0]
+    elif sids:
+        sid = sids[0]
+    else:
+        return None
+    try:
+        year = int(ref['year'])
+    except (TypeError, ValueError):
+        year = None
+    # As with full records, a missing author ID throws out the list
+    if None in ref['auids']:
+        authors = []
+    else:
+        authors = ref['auids']
+    return {'doi': '', 'sid': sid, 'pmid': '', 'authors': authors, 
+            'source': '', 'year': year, 'references': [], 'stub': True, 
+            'source_title': ref['source_title'] or '', 
+            'author_names': [name for name in ref['author_names'] 
+                                if name is not None]}
+
+def _parse_scopus_metadata_stream(response_raw, stubs = False):
+    '''
+    Given the `requests.Response`, parse the XML metadata, reading only the 
+    elements we need as the response streams through `ElementTree.iterparse`.  
+    Elements are discarded as soon as they've been read, so a long 
+    bibliography doesn't build up a large tree.  
+    
+    The result is the same as `_parse_scopus_metadata_xmltodict`, 
+    including its quirks; see the comments below.  
+    :param response_raw: XML metadata, retrieved from Scopus using requests.get
+    :param stubs: Also return reference stubs? 
+    :return: A dict of metadata; see `_parse_scopus_metadata`
+    '''
+    records = []        # One entry for each `abstracts-retrieval-response`
+    record = None       # The entry currently being read
+    record_depth = None # Depth of the `abstracts-retrieval-response` element
+    path = []           # Local names of the elements from the root down
+    root = None
+    status_code = None  # Status code of a `service-error` response
+    
+    for event, elem in ET.iterparse(io.BytesIO(response_raw.content), 
+                                    events = ('start', 'end')):
+        if event == 'start':
+            path.append(_local_name(elem.tag))
+            if root is None:
+                root = path[0]
+            if path[-1] == 'abstracts-retrieval-response' and record is None:
+                record_depth = len(path)
+                record = {'coredata': False, 'doi': [], 'sid': [], 'pmid': [], 
+                            'issn': [], 'isbn': [], 'authors': [], 'year': [], 
+                            'references': [], 'refs': []}
+                records.append(record)
+                continue
+            if record is None:
+                continue
+            rel_path = tuple(path[record_depth:])
+            # Attributes are available on the start event
+            if rel_path == ('coredata',):
+                record['coredata'] = True
+            elif rel_path == _AUTHOR_PATH:
+                record['authors'].append(elem.get('auid'))
+            elif rel_path == _YEAR_PATH:
+                record['year'].append(elem.get('first'))
+            elif rel_path == _REFERENCE_PATH:
+                record['references'].append([])
+                if stubs:
+                    record['refs'].append({'itemids': [], 'year': None, 
+                                            'source_title': None, 
+                                            'auids': [], 'author_names': []})
+            elif stubs and rel_path == _REF_YEAR_PATH:
+                record['refs'][-1]['year'] = elem.get('first')
+            elif stubs and rel_path == _REF_AUTHOR_PATH:
+                record['refs'][-1]['auids'].append(elem.get('auid'))
+            continue
+        
+        # End event:  text is available now
+        if root == 'service-error' and path[-1] == 'statusCode':
+            status_code = _element_text(elem)
+        elif record is not None:
+            rel_path = tuple(path[record_depth:])
+            if rel_path in _COREDATA_PATHS:
+                record[_COREDATA_PATHS[rel_path]].append(_element_text(elem))
+            elif rel_path == _ITEMID_PATH:
+                record['references'][-1].append(
+                    (len(elem.attrib) > 0, _element_text(elem)))
+                if stubs:
+                    record['refs'][-1]['itemids'].append(
+                        (elem.get('idtype'), _element_text(elem)))
+            elif stubs and rel_path == _REF_SOURCE_PATH:
+                record['refs'][-1]['source_title'] = _element_text(elem)
+            elif stubs and rel_path == _REF_AUTHOR_NAME_PATH:
+                record['refs'][-1]['author_names'].append(_element_text(elem))
+            elif rel_path == ():
+                # End of this `abstracts-retrieval-response`
+                record = None
+        path.pop()
+        # We're done with this element, so free its contents
+        elem.clear()
+    
+    # This branch catches error codes in the response
+    if root == 'service-error':
+        # If the resource isn't found, return an empty set of metadata
+        if status_code == 'RESOURCE_NOT_FOUND':
+            print('\t\tResource not found error')
+            return {'doi': '', 'sid': ''}
+        # If something else is going on, raise an exception
+        else:
+            print(response_raw.text)
+            raise ParseError('Service error in query response')
+    if not records:
+        raise ParseError('No abstracts-retrieval-response in query response')
+    
+    # If Scopus found multiple documents (see `_parse_scopus_metadata_xmltodict`), 
+    #  take the first one with bibliography entries, or else just the first one
+    for record in records:
+        if record['references']:
+            break
+    else:
+        record = records[0]
+    
+    # Missing fields become empty strings, etc., just as in the old parser
+    doi = _collapse(record['doi']) if record['doi'] else ''
+    if record['sid'] and record['sid'][0] is not None:
+        # The content for `dc:identifier` looks something like 'Scopus:115628'
+        sid = record['sid'][0].split(':')[1]
+    else:
+        sid = ''
+    pmid = _collapse(record['pmid']) if record['pmid'] else ''
+    # A missing `@auid` on any author threw out the whole author list
+    if None in record['authors']:
+        authors = []
+    else:
+        authors = record['authors']
+    if record['isbn']:
+        source = _collapse(record['isbn'])
+    elif record['issn'] and record['coredata']:
+        source = _collapse(record['issn'])
+    else:
+        source = ''
+    if record['year'] and record['year'][0] is not None:
+        year = int(record['year'][0])
+    else:
+        year = None
+    # The old parser only got reference IDs if 
+    #  - there were at least two references (`xmltodict` gives a lone 
+    #    reference as a dict, and iterating over it failed), and 
+    #  - every reference had exactly one `itemid`, with attributes and text
+    #  Otherwise the whole reference list came back empty.  
+    refs = []
+    if len(record['references']) > 1:
+        for itemids in record['references']:
+            if (len(itemids) != 1 or not itemids[0][0] or 
+                    itemids[0][1] is None):
+                refs = []
+                break
+            refs += [itemids[0][1]]
+    meta = {'doi': doi, 'sid': sid, 'pmid': pmid, 'authors': authors, 
+                'source': source, 'year': year, 'references': refs}
+    if stubs:
+        # Unlike `refs`, stubs don't depend on the rest of the bibliography
+        meta['reference_stubs'] = [stub for stub in 
+                                    map(_reference_stub, record['refs']) 
+                                    if stub is not None]
+    return meta
+
             
-def _get_query(query):
+# Retry policy shared by every call to `_get_query`; see `retry.py`
+#  Replace with another `RetryPolicy` (or anything with the same methods) 
+#  to change how requests are retried.  
+RETRY_POLICY = RetryPolicy()
+
+def _get_query(query, policy = None):
     '''
-    Get an HTTP query, with some wrapping to handle timeouts.
+    Get an HTTP query, with some wrapping to handle timeouts and errors.  
+    Timeouts, connection errors, and retryable HTTP statuses (429, 5xx) are 
+    retried according to the retry policy, which also enforces any backoff 
+    requested by the server.  
+    Connections are reused across calls; see `session.py`.  
     :param query: The HTTP query string
+    :param policy: A `retry.RetryPolicy`; defaults to `RETRY_POLICY`
     :return: The requests.get response
     '''
     # Timeout for HTTP requests
     TIMEOUT = 60
-    # Delay, in seconds, after receiving a timeout
-    DELAY = 3*60
-    # Maximum number of attempts to make before throwing an error
-    MAX_ATTEMPTS = 5
     
+    if policy is None:
+        policy = RETRY_POLICY
     attempts = 0
-    while (attempts < MAX_ATTEMPTS):
+    while True:
         attempts += 1
+        # Wait out any backoff, whoever triggered it
+        policy.wait_turn()
         try:
-            response_raw = requests.get(query, 
+            response_raw = session.get_session().get(query, 
                             #headers = {'X-ELS-APIKey': MY_API_KEY}, 
                             timeout = TIMEOUT)
-            return(response_raw)
-        except requests.exceptions.Timeout:
-            print('Request timed out.  Cooldown for ' + str(DELAY) + ' seconds.')
-            time.sleep(DELAY)
+        except (requests.exceptions.Timeout, 
+                requests.exceptions.ConnectionError) as error:
+            print('Request failed:  ' + str(error))
+            delay = policy.on_failure(attempts, error = error)
+            if delay is None:
+                raise
+        else:
+            if response_raw.status_code not in policy.retry_statuses:
+                policy.on_success(response_raw)
+                return(response_raw)
+            print('Query response ' + str(response_raw.status_code))
+            delay = policy.on_failure(attempts, response = response_raw)
+            if delay is None:
+                response_raw.raise_for_status()
+        metrics.inc('retries')
+        print('Cooldown for ' + str(round(delay, 1)) + ' seconds.')
+
+
+# Base URLs for the abstract retrieval API, by the kind of identifier used
+_QUERY_BASES = {'doi': 'http://api.elsevier.com/content/abstract/doi/', 
+                'scopus': 'http://api.elsevier.com/content/abstract/scopus_id/', 
+                'pmid': 'http://api.elsevier.com/content/abstract/pubmed_id/'}
+
+# Rate limiter shared by every call to the abstract retrieval API.  
+#  None means no client-side limit, as before.  
+#  Set to a `ratelimit.TokenBucket` to throttle all callers together.  
+LIMITER = None
+
+# On-disk cache of raw responses, checked before going to the network
+#  See `cache.py`
+USE_CACHE = True
+#  Kept in the scrape folder's batch folder (see `batch.BATCH_FOLDER`), where 
+#  it ended up when batch runs changed the working directory
+CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+                            'batch', 'responses.sqlite')
+#  Ignore and evict cached responses older than this many seconds (None: never)
+CACHE_TTL = None
+#  Evict the oldest responses once the cache is bigger than this (None: no limit)
+CACHE_MAX_BYTES = None
+#  Offline mode:  never touch the network; raise `CacheMiss` if a response isn't cached
+OFFLINE = False
+
+_cache = None
+# Threads in `fetch_many` can ask for the cache before it's open
+_cache_lock = threading.Lock()
+
+def get_cache():
+    '''
+    :return: The `ResponseCache`, opening it if necessary, or None if the 
+        cache isn't in use
+    '''
+    global _cache
+    if not (USE_CACHE or OFFLINE):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                os.makedirs(os.path.dirname(CACHE_FILE), exist_ok = True)
+                _cache = ResponseCache(CACHE_FILE, ttl = CACHE_TTL, 
+                                        max_bytes = CACHE_MAX_BYTES)
+    return _cache
+
+
+def _fetch(kind, ident, query, throttle = True):
+    '''
+    Get the response for a query, from the cache if possible and otherwise 
+    from the network.  Network responses are added to the cache if they 
+    are successful or "not found;" other errors are not cached.  
+    :param kind: The kind of query, used for the cache key
+    :param ident: The identifier, used for the cache key
+    :param query: The HTTP query string
+    :param throttle: Wait on `LIMITER` before going to the network? 
+    :return: The `requests.get` response, or a `cache.CachedResponse`
+    '''
+    cache = get_cache()
+    if cache is not None:
+        response_raw = cache.get(kind, ident)
+        if response_raw is not None:
+            metrics.inc('cache_hits')
+            return response_raw
+    if OFFLINE:
+        raise CacheMiss('No cached response for ' + kind + ' ' + str(ident))
+    if throttle and LIMITER is not None:
+        LIMITER.acquire()
+    response_raw = _get_query(query)
+    if cache is not None and response_raw.status_code in (200, 404):
+        cache.put(kind, ident, response_raw)
+    return response_raw
+
+
+def _build_query(kind, ident):
+    '''
+    Build the abstract retrieval query for a single identifier
+    :param kind: 'doi', 'scopus', or 'pmid'
+    :param ident: The identifier
+    :return: The HTTP query string
+    '''
+    if kind not in _QUERY_BASES:
+        raise ValueError('Unknown identifier kind ' + str(kind))
+    return _QUERY_BASES[kind] + ident + '?' + 'apiKey=' + MY_API_KEY
+
+
+def _get_meta(kind, ident, save_raw = False, throttle = True):
+    '''
+    Retrieve and parse the metadata for a single identifier.  
+    This is the shared body of the `get_meta_by_*` functions.  
+    :param kind: 'doi', 'scopus', or 'pmid'
+    :param ident: The identifier
+    :param save_raw: Save the raw XML response from Scopus? 
+    :param throttle: Wait on `LIMITER`?  Callers that have already taken 
+        a token, like `fetch_many`, pass False
+    :return: A dict of metadata; see `_parse_scopus_metadata`
+    '''
+    # Build the http query, and send it using `_fetch`, which checks the cache 
+    #  before calling `_get_query`
+    query = _build_query(kind, ident)
+    print('\t' + query)
+    with metrics.timer('fetch'):
+        response_raw = _fetch(kind, ident, query, throttle)
+    # Then parse using `_parse_scopus_metadata`
+    with metrics.timer('parse'):
+        meta = _parse_scopus_metadata(response_raw)
+    # If the call asks us to save the raw response, do so; otherwise add a blank
+    if save_raw:
+        meta['raw'] = response_raw.text
     else:
-        raise requests.exceptions.Timeout('Maximum number of requests')
+        meta['raw'] = ''
+    return meta
 
 
 def get_meta_by_doi(doi, save_raw = False):
@@ -181,22 +594,10 @@ def get_meta_by_doi(doi, save_raw = False):
         'raw': The raw XML response from the server
     '''
     #print 'getting metadata for DOI ' + doi
-    # Build the http query, and send it using `_get_query`
     # If DOI is missing (Pandas NaN), then just return empty metadata
     if pd.isnull(doi):
         return {'doi': '', 'sid': ''}
-    base_query = 'http://api.elsevier.com/content/abstract/doi/'
-    query = base_query + doi + '?' + 'apiKey=' + MY_API_KEY
-    print('\t' + query)
-    response_raw = _get_query(query)
-    # Then parse using `_parse_scopus_metadata`
-    meta = _parse_scopus_metadata(response_raw)
-    # If the call asks us to save the raw response, do so; otherwise add a blank
-    if save_raw:
-        meta['raw'] = response_raw.text
-    else:
-        meta['raw'] = ''
-    return meta
+    return _get_meta('doi', doi, save_raw)
 
 
 def get_meta_by_scopus(sid, save_raw = False):
@@ -214,17 +615,7 @@ def get_meta_by_scopus(sid, save_raw = False):
         'raw': The raw XML response from the server
     '''
     # This works just like `get_meta_by_doi`
-    base_query = 'http://api.elsevier.com/content/abstract/scopus_id/'
-    query = base_query + sid + '?' + 'apiKey=' + MY_API_KEY
-    print('\t' + query)
-    response_raw = _get_query(query)
-    #print 'received response'
-    meta = _parse_scopus_metadata(response_raw)
-    if save_raw:
-        meta['raw'] = response_raw.text
-    else:
-        meta['raw'] = ''
-    return meta
+    return _get_meta('scopus', sid, save_raw)
 
                 
 def get_meta_by_pmid(pmid, save_raw = False):
@@ -241,17 +632,229 @@ def get_meta_by_pmid(pmid, save_raw = False):
         'references': The paper's references, as a list of Scopus IDs
         'raw': The raw XML response from the server
     '''
-    base_query = 'http://api.elsevier.com/content/abstract/pubmed_id/'
-    query = base_query + pmid + '?' + 'apiKey=' + MY_API_KEY
-    print('\t' + query)
-    response_raw = _get_query(query)
-    #print 'received response'
-    meta = _parse_scopus_metadata(response_raw)
-    if save_raw:
-        meta['raw'] = response_raw.text
+    return _get_meta('pmid', pmid, save_raw)
+
+
+# Scopus search API, used to retrieve many items with one request
+_SEARCH_BASE = 'http://api.elsevier.com/content/search/scopus?'
+# Results per page of search results
+SEARCH_PAGE_SIZE = 25
+
+def _search_term(kind, ident):
+    '''
+    Scopus advanced search term matching a single identifier
+    '''
+    if kind == 'scopus':
+        return 'EID(2-s2.0-' + ident + ')'
+    elif kind == 'doi':
+        # Braces give an exact match, so parentheses, etc., in the DOI are safe
+        return 'DOI({' + ident + '})'
+    elif kind == 'pmid':
+        return 'PMID(' + ident + ')'
+    raise ValueError('Unknown identifier kind ' + str(kind))
+
+
+def _search_values(field):
+    '''
+    The search API gives some fields as plain strings, and others as lists of 
+    `{'$': value}` dicts.  Collapse them to a string, or a list of strings if 
+    there are several, the way `_parse_scopus_metadata` does.  
+    '''
+    if isinstance(field, list):
+        values = [entry['$'] if isinstance(entry, dict) else entry 
+                    for entry in field]
+        return _collapse(values)
+    return field
+
+
+def _parse_search_entry(entry):
+    '''
+    Parse one entry of the search API's JSON results.  
+    The search view has no reference list; 'references' is left empty.  
+    :param entry: An item of `['search-results']['entry']`
+    :return: A dict of metadata, as from `_parse_scopus_metadata`
+    '''
+    # Like `dc:identifier` in the abstract, this looks like 'SCOPUS_ID:115628'
+    sid = entry.get('dc:identifier', '')
+    if ':' in sid:
+        sid = sid.split(':')[1]
+    authors = [author['authid'] for author in entry.get('author', []) 
+                if 'authid' in author]
+    if 'prism:isbn' in entry:
+        source = _search_values(entry['prism:isbn'])
     else:
-        meta['raw'] = ''
-    return meta
+        source = _search_values(entry.get('prism:issn', ''))
+    try:
+        # Dates look like '2012-05-01'
+        year = int(entry['prism:coverDate'][:4])
+    except (KeyError, TypeError, ValueError):
+        year = None
+    return {'doi': entry.get('prism:doi', ''), 'sid': sid, 
+            'pmid': entry.get('pubmed-id', ''), 'authors': authors, 
+            'source': source, 'year': year, 'references': []}
+
+
+def _search_meta(kind, ids, references = True, save_raw = False):
+    '''
+    Retrieve metadata for many papers with the Scopus search API, packing the 
+    identifiers into one `EID(...) OR EID(...) OR ...` query and paging 
+    through the results.  
+    
+    The search view doesn't include reference lists.  If `references` is 
+    True, each paper found is then retrieved individually with the abstract 
+    retrieval API, just to get its references.  (These calls go through the 
+    response cache, like any other.)  Leave `references` False for the 
+    outermost generation, where the references aren't followed anyway.  
+    Identifiers the search doesn't find, and papers the search returns 
+    without authors (i.e., if the `COMPLETE` view isn't available), are 
+    also retrieved individually.  
+    
+    With `save_raw`, 'raw' is the response of the individual retrieval if 
+    there was one, and otherwise the paper's entry in the search response, 
+    as a JSON string.  
+    
+    :param kind: 'doi', 'scopus', or 'pmid'
+    :param ids: List of identifiers
+    :param references: Retrieve reference lists? 
+    :param save_raw: Save the raw responses from Scopus? 
+    :return: A dict, with the identifiers as keys and dicts of metadata 
+        (as from `get_meta_by_doi`, etc.) as values
+    '''
+    ids = [ident for ident in ids if not pd.isnull(ident) and ident != '']
+    if ids == []:
+        return {}
+    search_string = ' OR '.join(_search_term(kind, ident) for ident in ids)
+    
+    entries = []
+    start = 0
+    total = None
+    while total is None or start < total:
+        query = (_SEARCH_BASE + 'query=' + quote(search_string) + '&' + 
+                    'view=COMPLETE' + '&' + 
+                    'count=' + str(SEARCH_PAGE_SIZE) + '&' + 
+                    'start=' + str(start) + '&' + 
+                    'httpAccept=application/json' + '&' + 
+                    'apiKey=' + MY_API_KEY)
+        print('\t' + query)
+        with metrics.timer('fetch'):
+            response_raw = _fetch('search', search_string + '&start=' + str(start), 
+                                    query)
+        with metrics.timer('parse'):
+            response = json.loads(response_raw.text)
+        if 'service-error' in response:
+            print(response)
+            raise ParseError('Service error in search response')
+        results = response['search-results']
+        total = int(results['opensearch:totalResults'] or 0)
+        # An empty result set comes back as a single entry with an 'error'
+        page = [entry for entry in results.get('entry', []) 
+                    if 'error' not in entry]
+        if page == []:
+            break
+        entries += page
+        start += len(page)
+    
+    # Match the results back up with the identifiers we asked for
+    found = {}
+    for entry in entries:
+        meta = _parse_search_entry(entry)
+        if kind == 'scopus':
+            key = meta['sid']
+        elif kind == 'doi':
+            key = meta['doi'].lower()
+        else:
+            key = meta['pmid']
+        found[key] = (meta, entry)
+    
+    metas = {}
+    n_found = 0
+    for ident in ids:
+        meta, entry = found.get(ident.lower() if kind == 'doi' else ident, 
+                                (None, None))
+        if meta is not None:
+            n_found += 1
+        if meta is None or meta['authors'] == []:
+            # Fall back to the abstract retrieval API for the whole record
+            metas[ident] = _get_meta(kind, ident, save_raw)
+            continue
+        if references:
+            # Only the reference list is missing
+            full_meta = _get_meta('scopus', meta['sid'], save_raw)
+            meta['references'] = full_meta.get('references', [])
+            if 'reference_stubs' in full_meta:
+                meta['reference_stubs'] = full_meta['reference_stubs']
+            meta['raw'] = full_meta['raw']
+        else:
+            meta['raw'] = ''
+        if save_raw and meta['raw'] == '':
+            meta['raw'] = json.dumps(entry)
+        metas[ident] = meta
+    print('\t' + str(n_found) + ' of ' + str(len(ids)) + ' items found by search')
+    return metas
+
+
+def search_meta_by_scopus(sids, references = True, save_raw = False):
+    '''
+    Retrieve metadata for a chunk of papers from Scopus given their Scopus IDs, 
+    using the search API.  This can be used as the `retrieve` function for 
+    `batch.run_batch` with `chunk_size` set.  
+    :param sids: List of Scopus IDs
+    :param references: Retrieve reference lists?  See `_search_meta`
+    :param save_raw: Save the raw responses from Scopus? 
+    :return: A dict, with the Scopus IDs as keys and dicts of metadata 
+        (as from `get_meta_by_scopus`) as values
+    '''
+    return _search_meta('scopus', sids, references, save_raw)
+
+
+def search_meta_by_doi(dois, references = True, save_raw = False):
+    '''
+    Retrieve metadata for a chunk of papers from Scopus given their DOIs, 
+    using the search API.  This works just like `search_meta_by_scopus`.  
+    :param dois: List of DOIs
+    :param references: Retrieve reference lists?  See `_search_meta`
+    :param save_raw: Save the raw responses from Scopus? 
+    :return: A dict, with the DOIs as keys and dicts of metadata 
+        (as from `get_meta_by_doi`) as values
+    '''
+    return _search_meta('doi', dois, references, save_raw)
+
+
+def get_citing_sids(sid):
+    '''
+    Use the search API to find the papers that cite a given paper,
+    e.g., for a forward crawl with `crawl.Crawler`
+    :param sid: The cited paper's Scopus ID
+    :return: A list of the Scopus IDs of the citing papers
+    '''
+    search_string = 'REFEID(2-s2.0-' + sid + ')'
+    sids = []
+    start = 0
+    total = None
+    while total is None or start < total:
+        query = (_SEARCH_BASE + 'query=' + quote(search_string) + '&' +
+                    'field=dc:identifier' + '&' +
+                    'count=' + str(SEARCH_PAGE_SIZE) + '&' +
+                    'start=' + str(start) + '&' +
+                    'httpAccept=application/json' + '&' +
+                    'apiKey=' + MY_API_KEY)
+        print('\t' + query)
+        response_raw = _fetch('citing', sid + '&start=' + str(start), query)
+        response = json.loads(response_raw.text)
+        if 'service-error' in response:
+            print(response)
+            raise ParseError('Service error in search response')
+        results = response['search-results']
+        total = int(results['opensearch:totalResults'] or 0)
+        page = [entry for entry in results.get('entry', [])
+                    if 'error' not in entry]
+        if page == []:
+            break
+        for entry in page:
+            # 'SCOPUS_ID:115628'
+            sids += [entry.get('dc:identifier', '').split(':')[-1]]
+        start += len(page)
+    return [citing for citing in sids if citing != '']
 
 
 def get_pmids_by_issn(issn, since = '2010', until = '2015'):
@@ -285,7 +888,8 @@ def get_pmids_by_issn(issn, since = '2010', until = '2015'):
                 search_string)
     print('\t' + query)
     try:
-        response_raw = _get_query(query)
+        response_raw = _fetch('pubmed_issn', issn + ':' + since + ':' + until, 
+                                query, throttle = False)
         response = json.loads(response_raw.text)
         # Get the total number of items
         total_papers = int(response['esearchresult']['count'])
@@ -302,3 +906,77 @@ def get_pmids_by_issn(issn, since = '2010', until = '2015'):
     pmids = response['esearchresult']['idlist']
     return(pmids)
 
+
+# Default settings for `fetch_many`
+#  Number of requests to keep in flight at once
+MAX_IN_FLIGHT = 4
+#  Requests per second, if no limiter is given and `LIMITER` isn't set
+RATE_LIMIT = 3
+
+def fetch_many(ids, kind = 'doi', max_in_flight = MAX_IN_FLIGHT, 
+                limiter = None, save_raw = False):
+    '''
+    Retrieve metadata for many papers, keeping several requests in flight.  
+    Requests are still made with `requests` (via `_get_query`), but in a pool 
+    of worker threads driven by an asyncio event loop, so up to 
+    `max_in_flight` of them wait on the server at the same time.  
+    Every request first takes a token from `limiter`, so the per-second 
+    and weekly limits are respected however many are in flight.  
+    Responses already in the cache don't use a token.  
+    
+    Results are yielded as they finish, which is generally *not* the 
+    order of `ids`.  If a retrieval raises an error, the error is raised 
+    from the generator and the requests still in flight are abandoned.  
+    
+    :param ids: Iterable of identifiers
+    :param kind: 'doi', 'scopus', or 'pmid'
+    :param max_in_flight: Maximum number of simultaneous requests
+    :param limiter: A `ratelimit.TokenBucket`; defaults to `LIMITER`, or 
+        a new bucket allowing `RATE_LIMIT` requests per second
+    :param save_raw: Save the raw XML response from Scopus? 
+    :return: A generator of `(identifier, metadata)` pairs, with metadata 
+        as returned by `get_meta_by_doi`, etc.
+    '''
+    if kind not in _QUERY_BASES:
+        raise ValueError('Unknown identifier kind ' + str(kind))
+    if limiter is None:
+        limiter = LIMITER if LIMITER is not None else TokenBucket(RATE_LIMIT)
+    
+    loop = asyncio.new_event_loop()
+    executor = ThreadPoolExecutor(max_workers = max_in_flight)
+    
+    async def fetch_one(ident):
+        # Missing DOIs (Pandas NaN) get empty metadata, like `get_meta_by_doi`
+        if pd.isnull(ident):
+            return ident, {'doi': '', 'sid': ''}
+        # Cached responses don't need a token
+        cache = get_cache()
+        if cache is None or not cache.contains(kind, ident):
+            await limiter.acquire_async()
+        meta = await loop.run_in_executor(executor, _get_meta, 
+                                            kind, ident, save_raw, False)
+        return ident, meta
+    
+    ids = iter(ids)
+    in_flight = set()
+    try:
+        while True:
+            # Top up the set of requests in flight
+            for ident in ids:
+                in_flight.add(loop.create_task(fetch_one(ident)))
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            # Run the loop until at least one request finishes
+            done, in_flight = loop.run_until_complete(
+                asyncio.wait(in_flight, return_when = asyncio.FIRST_COMPLETED))
+            for task in done:
+                yield task.result()
+    finally:
+        for task in in_flight:
+            task.cancel()
+        if in_flight:
+            loop.run_until_complete(asyncio.wait(in_flight))
+        executor.shutdown(wait = False, cancel_futures = True)
+        loop.close()
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+'''
+A shared, keep-alive HTTP session for the scraping functions.
+
+`requests.get` opens a new connection for every call.  Over tens of thousands
+of lookups, the TCP (and eventually TLS) handshakes add up.  Everything in
+`scrape` goes through `get_session()` instead, which holds a connection pool
+for each host and reuses its connections.
+'''
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Number of per-host connection pools to keep
+POOL_CONNECTIONS = 4
+# Maximum number of connections kept open to any one host
+POOL_MAXSIZE = 8
+# Block, rather than open extra throwaway connections, when a host's pool is empty?
+POOL_BLOCK = True
+# Ask the server for compressed responses?
+COMPRESS = True
+
+_session = None
+_lock = threading.Lock()
+
+
+def configure(pool_connections = None, pool_maxsize = None,
+                pool_block = None, compress = None):
+    '''
+    Change the session settings.  The current session, if any, is closed,
+    and the next call to `get_session` builds a new one with these settings.
+    :param pool_connections: Number of per-host connection pools to keep
+    :param pool_maxsize: Maximum number of connections to any one host
+    :param pool_block: Wait for a free connection when the pool is in use?
+    :param compress: Request gzip/deflate compressed responses?
+    '''
+    global POOL_CONNECTIONS, POOL_MAXSIZE, POOL_BLOCK, COMPRESS
+    if pool_connections is not None:
+        POOL_CONNECTIONS = pool_connections
+    if pool_maxsize is not None:
+        POOL_MAXSIZE = pool_maxsize
+    if pool_block is not None:
+        POOL_BLOCK = pool_block
+    if compress is not None:
+        COMPRESS = compress
+    close()
+
+
+def get_session():
+    '''
+    :return: The shared `requests.Session`, creating it if necessary
+    '''
+    global _session
+    with _lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections = POOL_CONNECTIONS,
+                                    pool_maxsize = POOL_MAXSIZE,
+                                    pool_block = POOL_BLOCK)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+            if COMPRESS:
+                _session.headers['Accept-Encoding'] = 'gzip, deflate'
+            else:
+                _session.headers['Accept-Encoding'] = 'identity'
+        return _session
+
+
+def close():
+    '''
+    Close the shared session and all of its connections.
+    '''
+    global _session
+    with _lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def connection_stats():
+    '''
+    Count requests and new connections across the session's connection pools.
+    Pools that have been dropped (e.g., by `close`) are no longer counted.
+    :return: A dict with, for each host and for the 'total',
+        'requests': Number of requests sent
+        'connections': Number of new connections opened
+        'reused': Number of requests that reused an open connection
+    '''
+    stats = {'total': {'requests': 0, 'connections': 0, 'reused': 0}}
+    with _lock:
+        if _session is None:
+            return stats
+        adapters = set(_session.adapters.values())
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host_stats = stats.setdefault(pool.host,
+                            {'requests': 0, 'connections': 0, 'reused': 0})
+            for entry in (host_stats, stats['total']):
+                entry['requests'] += pool.num_requests
+                entry['connections'] += pool.num_connections
+                entry['reused'] += pool.num_requests - pool.num_connections
+    return stats
+
+
+def print_stats():
+    '''
+    Print `connection_stats` for the user.
+    '''
+    stats = connection_stats()
+    total = stats.pop('total')
+    for host, host_stats in stats.items():
+        print(host + ': ' + str(host_stats['requests']) + ' requests, ' +
+                str(host_stats['connections']) + ' connections, ' +
+                str(host_stats['reused']) + ' reused')
+    print('Total: ' + str(total['requests']) + ' requests, ' +
+            str(total['connections']) + ' connections, ' +
+            str(total['reused']) + ' reused')
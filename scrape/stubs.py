@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Reference stubs are what a paper's bibliography says about the papers it
+cites:  their Scopus IDs, years, source titles, and author names.  With
+`scrape.REFERENCE_STUBS` set, every retrieved paper carries a stub for each
+entry in its bibliography, under 'reference_stubs'.
+
+The outermost generation of a crawl is only needed as vertices -- its own
+references aren't followed -- so it can be built entirely from the stubs in
+the generation before it, without a single API call.  See the `leaf_stubs`
+option of `crawl.Crawler`.  When the generations are combined, the stubs
+also fill in what the search API left out of retrieved records, e.g., a
+missing year or source title; see `fill_from_stubs`.
+'''
+
+# Fields that are filled in from a stub when a record doesn't have them
+_FILL_FIELDS = ('year', 'source_title', 'author_names', 'authors')
+
+
+def empty_stub(sid):
+	'''
+	Stub for a paper nothing is known about except its Scopus ID
+	'''
+	return {'doi': '', 'sid': sid, 'pmid': '', 'authors': [], 'source': '',
+			'year': None, 'references': [], 'stub': True,
+			'source_title': '', 'author_names': []}
+
+
+def _missing(value):
+	return value is None or value == '' or value == []
+
+
+def merge_stub(record, stub):
+	'''
+	Fill in the fields of `record` that are missing, from `stub`.
+	Different bibliographies give different details about the same paper;
+	where both have an author list, the longer one is kept.
+
+	:param record: A stub or full record; changed in place
+	:param stub: A stub for the same paper
+	:return: `record`
+	'''
+	for field in _FILL_FIELDS:
+		if field not in stub:
+			continue
+		if _missing(record.get(field)):
+			record[field] = stub[field]
+		elif (field == 'author_names' and record.get('stub') and
+				len(stub[field]) > len(record[field])):
+			record[field] = stub[field]
+	return record
+
+
+def collect_stubs(papers, sids = None):
+	'''
+	Gather the reference stubs from a list of papers, merging the stubs for
+	the same cited paper
+
+	:param papers: Retrieved papers, with 'reference_stubs'
+	:param sids: If given, collect stubs only for these Scopus IDs
+	:return: A dict, with Scopus IDs as keys and merged stubs as values
+	'''
+	if sids is not None:
+		sids = set(sids)
+	stubs = {}
+	for paper in papers:
+		for stub in paper.get('reference_stubs', []):
+			sid = stub['sid']
+			if sids is not None and sid not in sids:
+				continue
+			if sid in stubs:
+				merge_stub(stubs[sid], stub)
+			else:
+				stubs[sid] = dict(stub)
+	return stubs
+
+
+def stub_generation(papers, sids):
+	'''
+	Build a generation from the stubs in the generation before it
+
+	:param papers: The previous generation, with 'reference_stubs'
+	:param sids: Scopus IDs of the new generation
+	:return: A list of stubs, one for each of `sids`, in the same order.
+		Papers no bibliography had details for get an `empty_stub`.
+	'''
+	stubs = collect_stubs(papers, sids)
+	return [stubs.get(sid, empty_stub(sid)) for sid in sids]
+
+
+def fill_from_stubs(records, papers):
+	'''
+	Fill in missing fields of already-retrieved records (e.g., ones the
+	search API returned without a year) from the stubs in `papers`
+
+	:param records: Records to fill in; changed in place
+	:param papers: Papers with 'reference_stubs'
+	:return: Number of records that had something filled in
+	'''
+	stubs = collect_stubs(papers, [record.get('sid', '') for record in records])
+	filled = 0
+	for record in records:
+		stub = stubs.get(record.get('sid', ''))
+		if stub is None:
+			continue
+		before = {field: record.get(field) for field in _FILL_FIELDS}
+		merge_stub(record, stub)
+		if before != {field: record.get(field) for field in _FILL_FIELDS}:
+			filled += 1
+	return filled
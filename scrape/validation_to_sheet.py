@@ -1,12 +1,15 @@
 import csv
 import json
 
+import paperstore
+
+# Either `papers.json` or a columnar store, `papers.npz`
 papers_file = 'papers.json'
 val_list_file = 'validation.json'
 val_spreadsheet_file = 'validation.csv'
 
-with open(papers_file) as readfile:
-	papers = json.load(readfile)
+papers = paperstore.load_papers(papers_file, 
+									columns = ('sid', 'doi', 'authors', 'references'))
 	
 with open(val_list_file) as readfile:
 	validation_sids = json.load(readfile)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+'''
+The queue of items still to be retrieved in a batch.
+
+A `WorkQueue` is an ordered set:  items keep the order they were added in,
+and membership tests and removals are O(1), however long the queue is.
+Items are compared by their JSON serialization, so anything that can be
+written to the batch file works, including the NaNs Pandas produces for
+missing DOIs.
+'''
+
+import itertools
+import json
+import os
+import threading
+import time
+
+
+class WorkQueue:
+	'''
+	An ordered set of pending items, which can be saved to and loaded from
+	a JSON file.
+	'''
+	def __init__(self, items = ()):
+		'''
+		:param items: Initial items; duplicates are dropped
+		'''
+		# Keys are the JSON for each item, values the items themselves.
+		#  Dicts keep insertion order, which gives us the queue order.
+		self._items = {}
+		self._shared = False
+		for item in items:
+			self.add(item)
+
+	@staticmethod
+	def _key(item):
+		return json.dumps(item, sort_keys = True)
+
+	def _unshare(self):
+		# Copy-on-write:  a snapshot shares its dict until one side changes
+		if self._shared:
+			self._items = dict(self._items)
+			self._shared = False
+
+	def __len__(self):
+		return len(self._items)
+
+	def __contains__(self, item):
+		return self._key(item) in self._items
+
+	def __iter__(self):
+		return iter(self._items.values())
+
+	def add(self, item):
+		'''
+		Add an item to the end of the queue, unless it's already queued
+		'''
+		key = self._key(item)
+		if key not in self._items:
+			self._unshare()
+			self._items[key] = item
+
+	def discard(self, item):
+		'''
+		Remove an item, if it's queued
+		'''
+		key = self._key(item)
+		if key in self._items:
+			self._unshare()
+			del self._items[key]
+
+	def peek(self, n):
+		'''
+		:return: A list of the first `n` items, without removing them
+		'''
+		return list(itertools.islice(self._items.values(), n))
+
+	def snapshot(self):
+		'''
+		A copy of the queue, as it is now.  Copying is deferred until either
+		the queue or the snapshot is changed, so taking a snapshot is cheap.
+
+		:return: A new `WorkQueue`
+		'''
+		snap = WorkQueue()
+		snap._items = self._items
+		snap._shared = True
+		self._shared = True
+		return snap
+
+	@staticmethod
+	def exists(path):
+		'''
+		:return: True iff a saved queue exists at `path`
+		'''
+		return os.access(path, os.F_OK)
+
+	@classmethod
+	def load(cls, path):
+		'''
+		Read a queue saved as a JSON list
+
+		:return: A new `WorkQueue`
+		'''
+		with open(path, 'r') as readfile:
+			items = json.load(readfile)
+		if type(items) is not list:
+			raise ValueError(path + ' does not read as list')
+		return cls(items)
+
+	def save(self, path):
+		'''
+		Write the queue to disk as a JSON list.  The file is replaced
+		atomically, so a crash leaves either the old or the new queue.
+		'''
+		with open(path + '.tmp', 'w') as writefile:
+			json.dump(list(self), writefile)
+			writefile.flush()
+			os.fsync(writefile.fileno())
+		os.replace(path + '.tmp', path)
+
+
+class LeaseTable:
+	'''
+	Hands out chunks of a `WorkQueue` to several workers.  Each chunk is
+	leased to one worker for `lease_timeout` seconds.  A worker renews its
+	lease as it makes progress; if it dies or hangs, the lease expires and
+	its unfinished items go back to the queue for another worker.
+	All methods are thread-safe.
+	'''
+	def __init__(self, queue, lease_size, lease_timeout):
+		'''
+		:param queue: `WorkQueue` of items to hand out; it's emptied as
+			items are leased
+		:param lease_size: Maximum number of items in a lease
+		:param lease_timeout: Seconds before an unrenewed lease expires
+		'''
+		self.available = queue
+		self.lease_size = lease_size
+		self.lease_timeout = lease_timeout
+		self.leases = {}			# Lease ID -> {'items': WorkQueue, 'expires': time}
+		self._next_id = 0
+		self._lock = threading.Lock()
+
+	def _expire(self):
+		# Called with the lock held
+		now = time.monotonic()
+		for lease_id in [lease_id for lease_id, lease in self.leases.items()
+							if lease['expires'] < now]:
+			print('Lease ' + str(lease_id) + ' expired')
+			self._release(lease_id)
+
+	def _release(self, lease_id):
+		# Called with the lock held
+		lease = self.leases.pop(lease_id, None)
+		if lease is not None:
+			for item in lease['items']:
+				self.available.add(item)
+
+	def acquire(self):
+		'''
+		Lease the next chunk of items
+
+		:return: `(lease_id, items)`, or None if nothing is available right now
+		'''
+		with self._lock:
+			self._expire()
+			items = self.available.peek(self.lease_size)
+			if items == []:
+				return None
+			for item in items:
+				self.available.discard(item)
+			lease_id = self._next_id
+			self._next_id += 1
+			self.leases[lease_id] = {'items': WorkQueue(items),
+										'expires': time.monotonic() + self.lease_timeout}
+			return lease_id, items
+
+	def renew(self, lease_id):
+		'''
+		Extend a lease
+
+		:return: True iff the lease was still held
+		'''
+		with self._lock:
+			self._expire()
+			if lease_id not in self.leases:
+				return False
+			self.leases[lease_id]['expires'] = time.monotonic() + self.lease_timeout
+			return True
+
+	def complete(self, lease_id, item):
+		'''
+		Mark an item as finished.  This works even if the lease has expired,
+		in which case the item is taken back out of the queue.
+		'''
+		with self._lock:
+			if lease_id in self.leases:
+				self.leases[lease_id]['items'].discard(item)
+			self.available.discard(item)
+
+	def release(self, lease_id):
+		'''
+		Give up a lease, returning its unfinished items to the queue
+		'''
+		with self._lock:
+			self._release(lease_id)
+
+	def outstanding(self):
+		'''
+		:return: Number of leases currently held
+		'''
+		with self._lock:
+			self._expire()
+			return len(self.leases)
@@ -1,13 +1,19 @@
 import html
 import json
+import os
 import pandas as pd
 import re
-import requests
+import sys
 
 from api_key import MY_API_KEY
 
+## Share the keep-alive session used by `scrape`
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+								'..', 'scrape'))
+import session
+
 def get_query (query):
-	response = requests.get(query)
+	response = session.get_session().get(query)
 	note = []
 	if response.status_code == 400:
 		note += ['Scopus returned a parse error']
@@ -86,4 +92,5 @@ for title in titles:
 	data += [{'title': title, 'doi': doi, 'note': note, 'query': query}]
 	print()
 	
-pd.DataFrame(data)[['title', 'doi', 'note', 'query']].to_csv('results.csv')
\ No newline at end of file
+pd.DataFrame(data)[['title', 'doi', 'note', 'query']].to_csv('results.csv')
+session.print_stats()